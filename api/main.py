@@ -1,35 +1,60 @@
-from fastapi import FastAPI, HTTPException, BackgroundTasks, Response
+from fastapi import FastAPI, HTTPException, BackgroundTasks, Depends, Request, Response
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
 from fastapi.responses import FileResponse
 from starlette.concurrency import run_in_threadpool
 import logging
 import time
-from typing import List, Optional
-import json
+from typing import Dict, List, Optional, Union
 import os
 from pydantic import BaseModel
 import uuid
-from services.create_rag.choose_image import find_closest_event_id, find_closest_event_ids, find_closest_event_ids_async
-from services.generate_events import (
-    generate_future_events,
-    generate_narrative_arc_events,
-)
+from services.branch_tree import BranchTree, turn_signature
+from services.fallback_events import FallbackLibrary
+from services.turns import TurnCache, generate_turn, load_initial_events, plan_image_tasks
 from services.generate_final_report import generate_final_report
+from services.llm_router import LLMDeadlineExceeded
+from services.running_report import REPORT_MODE, final_summary, refresh_summary, stream_final_summary
+from services.session_store import SessionStore, get_session_backend
+from services.usage import total_cost, track_session
+from services.admission import AdmissionController, ClosingStreamingResponse, admit, client_id
+from services.metrics import IMAGE_TASKS_IN_FLIGHT, TURN_FALLBACKS, mark_worker_dead, render_metrics, time_stage
 from services.create_rag.generate_image import generate_image
+from services.image_storage import get_image_storage
+from services.assets import ASSET_CACHE_CONTROL, AssetManifest, AssetResponse, etag_matches
+from services.http_clients import close_clients, open_clients
+from services.profiling import ProfilingMiddleware, profile_store, require_admin, start_monitoring
 from models.event import Event
-from services.music.choose_music import choose_music, choose_music_batch, choose_music_batch_async
 import asyncio
+from contextlib import asynccontextmanager
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Event loop lag and threadpool usage, plus the stack sampler when PROFILE_SLOW_SECONDS is set
+    monitor = start_monitoring()
+    # Pooled OpenAI connections shared by the retrieval calls of every request
+    await open_clients()
+    # Seed the image status tracker off the event loop: unknown ids fall back to the storage meanwhile
+    warmup = asyncio.create_task(run_in_threadpool(initialize_image_status))
+    yield
+    warmup.cancel()
+    monitor.cancel()
+    await close_clients()
+    mark_worker_dead()
 
-app = FastAPI()
+
+app = FastAPI(lifespan=lifespan)
 
 # Set up logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-# Create images directory if it doesn't exist
-IMAGES_DIR = os.path.join(os.path.dirname(os.path.dirname(__file__)), "data", "generated_images")
-os.makedirs(IMAGES_DIR, exist_ok=True)
+# Generated images (IMAGE_STORAGE): local directory served below, or an S3-compatible bucket
+image_storage = get_image_storage()
+
+# Content-hashed URLs of the deck and consequence images (python -m services.assets)
+asset_manifest = AssetManifest()
 
 # Mount the static files directory
 static_dir = os.path.join(os.path.dirname(os.path.dirname(__file__)), "data")
@@ -43,32 +68,74 @@ app.add_middleware(
     allow_methods=["*"],  # Allows all methods
     allow_headers=["*"],  # Allows all headers
 )
+# Slow-request capture and on-demand cProfile (PROFILE_SLOW_SECONDS, PROFILE_TOKEN)
+app.add_middleware(ProfilingMiddleware)
 
 # In-memory task status tracker
 image_task_status = {}
-
-# Initialize status tracker with existing images
+# Seconds an id the storage does not have is answered "processing" without asking it again
+IMAGE_MISSING_TTL = float(os.getenv("IMAGE_MISSING_TTL", 2))
+# task_id -> time.monotonic() until which the id is known to be missing from the storage
+missing_images = {}
+MAX_MISSING_IMAGES = 10000
+
+# Pre-generated opening turns (python -m services.branch_tree)
+branch_tree = BranchTree()
+
+# Seconds a turn may spend generating before fallback events are served (0 disables)
+TURN_LATENCY_BUDGET = float(os.getenv("TURN_LATENCY_BUDGET", 30))
+# Ready-made events for degraded turns (python -m services.fallback_events)
+fallback_library = FallbackLibrary()
+# Generations that outlived their turn, kept to answer the same timeline later
+turn_cache = TurnCache()
+background_generations = set()
+
+# Server-side game sessions, optionally persisted (SESSION_BACKEND)
+session_store = SessionStore(backend=get_session_backend())
+
+# Admission control per endpoint class (limits are per worker, see services/admission.py)
+turn_admission = AdmissionController.from_env("turn", max_concurrent=16, max_queue=32, queue_timeout=10)
+report_admission = AdmissionController.from_env("report", max_concurrent=8, max_queue=16, queue_timeout=10)
+# Images are generated in the background, so /generate-image never waits: it is rejected when full
+image_admission = AdmissionController.from_env("image", max_concurrent=16, max_queue=0, queue_timeout=0)
+
+# Initialize status tracker with existing images (run at startup, in the threadpool)
 def initialize_image_status():
-    for filename in os.listdir(IMAGES_DIR):
-        if filename.endswith('.png'):
-            # Extract task_id from filename (remove .png extension)
-            task_id = filename.replace('.png', '')
-            # Mark the task as completed
-            image_task_status[task_id] = "completed"
-    print(f"Initialized image status tracker with {len(image_task_status)} completed images")
-
-# Run the initialization
-initialize_image_status()
+    count = 0
+    # S3 listings are read page by page, so statuses are available before the listing ends
+    for task_id in image_storage.task_ids():
+        # Mark the task as completed, unless this worker already tracks it
+        image_task_status.setdefault(task_id, "completed")
+        count += 1
+    logger.info(f"Initialized image status tracker with {count} completed images")
 
 class UpdateEventsRequest(BaseModel):
-    events: List[Event]
+    # Full timeline (legacy clients); omit it and pass session_id to use the server-side session
+    events: Optional[List[Event]] = None
     option_chosen: str
     model: str = "gpt-4o"
     temperature: float = 0.7
+    session_id: Optional[str] = None
 
 class UpdateEventsResponse(BaseModel):
     events: List[Event]
     image_tasks: List[dict]
+    session_id: Optional[str] = None
+    # True when the events come from the fallback library because generation was too slow
+    degraded: bool = False
+
+class SessionUsage(BaseModel):
+    session_id: str
+    calls: int
+    prompt_tokens: int
+    completion_tokens: int
+    cost_usd: float
+    # stage -> calls, prompt_tokens, completion_tokens, cost_usd
+    stages: Dict[str, Dict[str, Union[int, float]]]
+
+class StartGameResponse(BaseModel):
+    session_id: str
+    events: List[Event]
 
 class Summary(BaseModel):
     description: str
@@ -93,6 +160,41 @@ class ImageBatchStatusResponse(BaseModel):
 async def healthcheck():
     return {"status": "healthy"}
 
+@app.get("/metrics")
+async def metrics():
+    """Prometheus metrics (per-stage latencies, LLM calls, cache hits, image queue depth)"""
+    payload, content_type = render_metrics()
+    return Response(content=payload, media_type=content_type)
+
+@app.get("/admin/profiles", dependencies=[Depends(require_admin)])
+async def list_profiles():
+    """Captured request profiles, newest first (without stages and stacks)"""
+    return await run_in_threadpool(profile_store.list)
+
+
+@app.get("/admin/profiles/{profile_id}", dependencies=[Depends(require_admin)])
+async def get_profile(profile_id: str):
+    """A captured profile with its stage timings and folded stacks"""
+    profile = await run_in_threadpool(profile_store.load, profile_id)
+    if profile is None:
+        raise HTTPException(status_code=404, detail=f"Profile {profile_id} not found")
+    return profile
+
+
+@app.get("/admin/profiles/{profile_id}/download", dependencies=[Depends(require_admin)])
+async def download_profile(profile_id: str):
+    """The cProfile stats (pstats format) of a profile, or its folded stacks as text"""
+    path = profile_store.download_path(profile_id)
+    if path is not None:
+        return FileResponse(path, media_type="application/octet-stream", filename=f"{profile_id}.prof")
+    profile = await get_profile(profile_id)
+    return Response(
+        content=profile["folded"],
+        media_type="text/plain",
+        headers={"Content-Disposition": f'attachment; filename="{profile_id}.folded"'},
+    )
+
+
 @app.get("/version", status_code=200)
 async def get_version():
     """Return a hardcoded version to confirm deployment"""
@@ -101,53 +203,67 @@ async def get_version():
 @app.get("/get_initial_events", response_model=List[Event])
 async def get_initial_events():
     """Return events from the starting deck JSON file with options and consequences"""
-    # Get the path to the JSON file
-    json_path = os.path.join(os.path.dirname(os.path.dirname(__file__)), "data", "starting_deck.json")
-    
-    # Read the JSON file
-    with open(json_path, "r") as f:
-        data = json.load(f)
-
-    # Convert the data to match our API model
-    events = []
-    for story in data["stories"]:
-        # For each story, create an event
-        event = {
-            "id": story["id"],
-            "title": story["title"],
-            "description": story["description"],
-            "image": story["img"],  # No image links in the source data
-            "date": story["date"],  # No dates in the source data
-            "music_file": story["music_file"],
-            "options": []
-        }
-
-        # For each option in the story, create an option with its consequence
-        for option in story["options"]:
-            event["options"].append({
-                "title": option["title"],
-                "img": option["img"],
-                "consequence": option["consequence"],
-                "music_file": option["music_file"]
-            })
-
-        events.append(event)
-
-    return events[:4]  # Return only the first 4 events to match the expected response
-
-
-@app.post("/update_events", response_model=UpdateEventsResponse)
+    return asset_manifest.hashed_event_urls(load_initial_events())
+
+
+@app.get("/assets/{name:path}")
+async def get_asset(name: str, request: Request):
+    """Serve a static asset under its content-hashed name (cacheable forever, ranges supported)"""
+    asset = asset_manifest.resolve(name)
+    if asset is None:
+        raise HTTPException(status_code=404, detail="Asset not found")
+    path, etag = asset
+    headers = {"Cache-Control": ASSET_CACHE_CONTROL, "ETag": etag}
+    if etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers=headers)
+    return AssetResponse(path, headers=headers)
+
+
+@app.post("/start_game", response_model=StartGameResponse)
+async def start_game():
+    """Create a server-side game session seeded with the starting deck"""
+    deck = asset_manifest.hashed_event_urls(load_initial_events())
+    events = sorted((Event.model_validate(e) for e in deck), key=lambda x: x.date)
+    session = await session_store.create(events)
+    return StartGameResponse(session_id=session.session_id, events=session.events)
+
+
+@app.post("/update_events", response_model=UpdateEventsResponse, dependencies=[Depends(admit(turn_admission))])
 async def update_events(request: UpdateEventsRequest, background_tasks: BackgroundTasks):
+    with time_stage("update_events"):
+        return await _update_events(request, background_tasks)
+
+
+async def _update_events(request: UpdateEventsRequest, background_tasks: BackgroundTasks):
     start_time = time.time()
     logger.info(f"=== Starting update_events with chosen option: {request.option_chosen} ===")
     
     # option_chosen format: "{event_id}_{option_idx}"
     event_id, option_idx = map(str, request.option_chosen.split("_"))
 
+    session = await session_store.get(request.session_id) if request.session_id else None
+    # Tokens and cost of this turn are added to the session when it is saved
+    track_session(session)
+
+    if request.events is None:
+        # Delta request: the timeline is the one kept in the session, already sorted by date
+        if session is None:
+            raise HTTPException(status_code=404, detail=f"Session {request.session_id} not found")
+        sorted_events = session.events
+        choices = dict(session.choices)
+    else:
+        # Full-payload request: filter events to remove future events
+        logger.info(f"Original events count: {len(request.events)}")
+        # Sort events by date first
+        sorted_events = sorted(request.events, key=lambda x: x.date)
+        choices = dict(session.choices) if session else {}
+
     # Find the event that was chosen
-    event = next((event for event in request.events if event.id == event_id), None)
-    if not event:
+    chosen_event_index = next((i for i, e in enumerate(sorted_events) if e.id == event_id), None)
+    if chosen_event_index is None:
         raise HTTPException(status_code=404, detail=f"Event with id {event_id} not found")
+    logger.info(f"Chosen event index: {chosen_event_index}")
+    event = sorted_events[chosen_event_index]
 
     chosen_option = {
         "title": event.options[int(option_idx)].title,
@@ -155,179 +271,272 @@ async def update_events(request: UpdateEventsRequest, background_tasks: Backgrou
     }
     logger.info(f"Processing chosen option: {chosen_option['title']}")
 
-    # filter events to remove future events and remove options for past events
-    logger.info(f"Original events count: {len(request.events)}")
-
-    # Sort events by date first
-    sorted_events = sorted(request.events, key=lambda x: x.date)
-    chosen_event_index = next(i for i, e in enumerate(sorted_events) if e.id == event_id)
-    logger.info(f"Chosen event index: {chosen_event_index}")
-
     # Keep all events up to and including the chosen event
     filtered_events = sorted_events[:chosen_event_index + 1]
     logger.info(f"Filtered events count: {len(filtered_events)}")
+    # Choices made on dropped events would label the new events reusing their ids
+    kept_ids = {e.id for e in filtered_events}
+    choices = {k: v for k, v in choices.items() if k in kept_ids}
+    choices[event_id] = int(option_idx)
+
+    # Opening turns are served from the pre-generated branch tree when available
+    signature = turn_signature(filtered_events, event_id, option_idx)
+    variant = branch_tree.pick(signature)
+    degraded = False
+    if variant is not None:
+        logger.info("Serving a pre-generated turn from the branch tree")
+        new_events, image_tasks = variant["events"], variant["image_tasks"]
+        image_prompts = []
+        for image in variant["images"]:
+            # Variants are shared by every player: skip images already stored or being generated
+            if image_task_status.get(image["task_id"]) in ("completed", "processing"):
+                continue
+            if await run_in_threadpool(image_storage.exists, image["task_id"]):
+                image_task_status[image["task_id"]] = "completed"
+            else:
+                image_task_status[image["task_id"]] = "processing"
+                image_prompts.append((image["prompt"], image["task_id"]))
+    else:
+        new_events = turn_cache.get(signature)
+        if new_events is None:
+            # Generate new events
+            logger.info("Starting narrative arc events generation...")
+            new_events, degraded = await generate_within_budget(
+                signature,
+                filtered_events,
+                chosen_option,
+                session_id=session.session_id if session else None,
+                choices=choices,
+            )
+        if degraded:
+            # Fallback events keep the library images they were built with: no renders to wait for
+            image_prompts, image_tasks = [], []
+        else:
+            image_prompts, image_tasks = plan_image_tasks(new_events)
 
-    # Generate new events
-    logger.info("Starting narrative arc events generation...")
-    generation_start = time.time()
-    new_events = await generate_narrative_arc_events(filtered_events, chosen_option)
-    logger.info(f"Events generation completed in {time.time() - generation_start:.2f} seconds")
-    logger.info(f"Generated {len(new_events)} new events")
-
-    # START OPTIMIZATION: Batch image and music processing
-    # Prepare all prompts for image finding at once
-    logger.info("Preparing batch processing for images and music...")
-    batch_start = time.time()
-    
-    event_image_prompts = []
-    event_indices = []
-    option_image_prompts = []
-    option_indices = []
-    music_prompts = []
-    music_indices = []
-    
-    # Collect all prompts first
-    for event_idx, event in enumerate(new_events):
-        # Event image prompt
-        event_image_prompts.append(event["title"] + " - Year : " + event["date"])
-        event_indices.append((event_idx, None))
-        
-        # Event music prompt
-        music_prompts.append(event["title"] + " " + event["description"])
-        music_indices.append((event_idx, None))
-        
-        # Option prompts
-        for option_idx, option in enumerate(event["options"]):
-            # Option image prompt
-            option_image_prompts.append(option["title"] + "- Year :" + event["date"])
-            option_indices.append((event_idx, option_idx))
-            
-            # Option music prompt
-            music_prompts.append(option["title"] + " " + event["title"])
-            music_indices.append((event_idx, option_idx))
-    
-    # Process all image IDs and music selections concurrently using async functions
-    logger.info(f"Finding image IDs and music for all events and options...")
-    
-    # Run the async operations concurrently to save time
-    event_image_ids, option_image_ids, all_music_files = await asyncio.gather(
-        find_closest_event_ids_async(event_image_prompts),
-        find_closest_event_ids_async(option_image_prompts),
-        choose_music_batch_async(music_prompts)
-    )
-    
-    # Now assign all the results back to the events and options
-    logger.info("Assigning image IDs and music files...")
-    
-    # Assign event images and music
-    for i, (event_idx, _) in enumerate(event_indices):
-        event = new_events[event_idx]
-        image_id = event_image_ids[i]
-        event["image"] = f"https://uchronia.s3.eu-west-3.amazonaws.com/image_{image_id}.png"
-        event["music_file"] = all_music_files[music_indices.index((event_idx, None))]
-    
-    # Assign option images and music
-    for i, (event_idx, option_idx) in enumerate(option_indices):
-        option = new_events[event_idx]["options"][option_idx]
-        image_id = option_image_ids[i]
-        option["img"] = f"https://uchronia.s3.eu-west-3.amazonaws.com/image_{image_id}.png"
-        option["music_file"] = all_music_files[music_indices.index((event_idx, option_idx))]
-    
-    logger.info(f"Batch processing completed in {time.time() - batch_start:.2f} seconds")
-    # END OPTIMIZATION
-    
     # Start image generation tasks for new events
     logger.info("Starting background image generation tasks...")
-    image_tasks = []
-    task_start = time.time()
-    
-    for event_idx, event in enumerate(new_events):
-        # Main event image
-        task_id = str(uuid.uuid4())
-        logger.info(f"Adding background task for event image: {event['title'][:30]}...")
-        background_tasks.add_task(generate_image_task, event["title"], task_id)
-        image_tasks.append({
-            "event_id": event["id"],
-            "task_id": task_id,
-            "type": "event"
-        })
-        
-        # Options images
-        for idx, option in enumerate(event["options"]):
-            # Option image
-            option_task_id = str(uuid.uuid4())
-            logger.info(f"Adding background task for option image: {option['title'][:30]}...")
-            background_tasks.add_task(generate_image_task, option["title"], option_task_id)
-            image_tasks.append({
-                "event_id": event["id"],
-                "option_id": idx,
-                "task_id": option_task_id,
-                "type": "option"
-            })
-    
-    logger.info(f"All background tasks added in {time.time() - task_start:.2f} seconds")
-    logger.info(f"Added {len(image_tasks)} image generation tasks")
+    for prompt, task_id in image_prompts:
+        logger.info(f"Adding background task for image: {prompt[:30]}...")
+        background_tasks.add_task(generate_image_task, prompt, task_id)
+    logger.info(f"Added {len(image_prompts)} image generation tasks")
+
+    # Record the new timeline so the next turn can be a delta request
+    timeline = filtered_events + [Event.model_validate(e) for e in new_events]
+    timeline.sort(key=lambda x: x.date)
+    if session is None:
+        session = await session_store.create(timeline, choices)
+    else:
+        session.events = timeline
+        session.choices = choices
+        await session_store.save(session)
+    if REPORT_MODE == "incremental":
+        background_tasks.add_task(refresh_summary, session_store, session.session_id)
+
     logger.info(f"=== update_events completed in {time.time() - start_time:.2f} seconds ===")
 
-    return UpdateEventsResponse(events=new_events, image_tasks=image_tasks)
+    return UpdateEventsResponse(
+        events=new_events, image_tasks=image_tasks, session_id=session.session_id, degraded=degraded
+    )
+
+
+def _warm_turn_cache(signature, generation):
+    background_generations.discard(generation)
+    if not generation.cancelled() and generation.exception() is None:
+        turn_cache.put(signature, generation.result())
+        logger.info(f"Late generation of turn {signature} stored in the turn cache")
+
+
+async def generate_within_budget(signature, filtered_events, chosen_option, session_id=None, choices=None):
+    """
+    Generate a turn, falling back to library events if it misses TURN_LATENCY_BUDGET.
+
+    The generation is shielded: when the fallback is served it keeps running and its
+    result warms the turn cache for the same timeline.
+
+    Returns:
+        tuple[list, bool]: The new events, and whether they come from the fallback library
+    """
+    generation = asyncio.ensure_future(
+        generate_turn(filtered_events, chosen_option, session_id=session_id, choices=choices)
+    )
+    if TURN_LATENCY_BUDGET <= 0 or not len(fallback_library):
+        try:
+            return await generation, False
+        except LLMDeadlineExceeded as e:
+            raise HTTPException(status_code=504, detail=str(e))
 
-@app.post("/exit_game", response_model=Summary)
-async def exit_game(request: List[Event]):
-    # Use the provided list of events
+    try:
+        return await asyncio.wait_for(asyncio.shield(generation), TURN_LATENCY_BUDGET), False
+    except Exception as e:
+        if not generation.done():
+            reason = "budget"
+            background_generations.add(generation)
+            generation.add_done_callback(lambda task: _warm_turn_cache(signature, task))
+        else:
+            reason = "deadline" if isinstance(e, LLMDeadlineExceeded) else "error"
+        logger.warning(f"Turn generation failed ({reason}: {e!r}), serving fallback events")
+        TURN_FALLBACKS.labels(reason).inc()
+
+    new_events = fallback_library.pick(filtered_events, chosen_option)
+    max_id = max(int(event.id) for event in filtered_events)
+    for offset, event in enumerate(new_events, start=1):
+        event["id"] = str(max_id + offset)
+    return new_events, True
+
+@app.post("/exit_game", response_model=Summary, dependencies=[Depends(admit(report_admission))])
+async def exit_game(request: Optional[List[Event]] = None, session_id: Optional[str] = None):
+    # Use the provided list of events, or the timeline of the server-side session
     events = request
-    print("events", events)
+    session = await session_store.get(session_id) if session_id else None
+    track_session(session)
+    if events is None and session:
+        events = session.events
+    logger.debug(f"exit_game timeline: {len(events or [])} events")
     if not events:
         raise HTTPException(status_code=404, detail=f"Events not found")
-    
-    # Set default values for model and temperature as they are not provided in the input JSON
-    model = "gpt-4o"
-    temperature = 0.7
-    summary = await generate_final_report(events, model, temperature)
+
+    try:
+        if REPORT_MODE == "incremental" and session and session.choices:
+            # The running report is usually up to date: no LLM call at all
+            return Summary(description=await final_summary(session_store, session.session_id))
+
+        # Set default values for model and temperature as they are not provided in the input JSON
+        model = "gpt-4o"
+        temperature = 0.7
+        summary = await generate_final_report(events, model, temperature)
+    except LLMDeadlineExceeded as e:
+        raise HTTPException(status_code=504, detail=str(e))
+    if session:
+        # Keep the cost of the report in the session usage
+        await session_store.save(session)
     
     if summary:
         return summary
     else:
         raise HTTPException(status_code=500, detail="Error generating final report")
 
-async def generate_image_task(prompt: str, task_id: str):
-    output_path = os.path.join(IMAGES_DIR, f"{task_id}.png")
+
+@app.post("/exit_game/stream")
+async def exit_game_stream(session_id: str, request: Request):
+    """Stream the end-of-game report of a session as plain text."""
+    # The admission slot is held until the stream is over, not only until this handler returns
+    client = client_id(request)
+    acquired_at = await report_admission.acquire(client)
+    stream = None
+
+    async def close():
+        # Closing the generator releases the session lock it holds while suspended
+        if stream is not None:
+            await stream.aclose()
+        report_admission.release(client, acquired_at)
+
+    try:
+        session = await session_store.get(session_id)
+        if session is None or not session.choices:
+            raise HTTPException(status_code=404, detail=f"Session {session_id} not found or has no decisions")
+        track_session(session)
+        # Wait for the first piece so a missed deadline is still reported as a 504
+        stream = stream_final_summary(session_store, session)
+        try:
+            first = await stream.__anext__()
+        except StopAsyncIteration:
+            first = ""
+        except LLMDeadlineExceeded as e:
+            raise HTTPException(status_code=504, detail=str(e))
+    except BaseException:
+        await close()
+        raise
+
+    async def body():
+        yield first
+        async for text in stream:
+            yield text
+
+    return ClosingStreamingResponse(body(), on_close=close, media_type="text/plain; charset=utf-8")
+
+@app.get("/session_usage", response_model=SessionUsage)
+async def session_usage(session_id: str):
+    """Tokens and estimated cost of the LLM and embedding calls made for a session, per stage"""
+    session = await session_store.get(session_id)
+    if session is None:
+        raise HTTPException(status_code=404, detail=f"Session {session_id} not found")
+    stages = session.usage
+    return SessionUsage(
+        session_id=session_id,
+        calls=sum(totals["calls"] for totals in stages.values()),
+        prompt_tokens=sum(totals["prompt_tokens"] for totals in stages.values()),
+        completion_tokens=sum(totals["completion_tokens"] for totals in stages.values()),
+        cost_usd=total_cost(stages),
+        stages=stages,
+    )
+
+async def generate_image_task(prompt: str, task_id: str, admission: Optional[tuple] = None):
+    """Generate an image in the background; `admission` is the (client, acquired_at) slot to release."""
+    output_path = image_storage.spool_path(task_id)
+    IMAGE_TASKS_IN_FLIGHT.inc()
     try:
         # Set task as processing in our in-memory tracker
         image_task_status[task_id] = "processing"
-        await run_in_threadpool(generate_image, prompt, output_path)
+        with time_stage("image_generation"):
+            await run_in_threadpool(generate_image, prompt, output_path)
+        await run_in_threadpool(image_storage.store, task_id, output_path)
         # Update status when completed
         image_task_status[task_id] = "completed"
     except Exception as e:
         # Log the error and update status
         print(f"Error generating image for task {task_id}: {str(e)}")
         image_task_status[task_id] = "error"
+    finally:
+        IMAGE_TASKS_IN_FLIGHT.dec()
+        if admission:
+            image_admission.release(*admission)
 
 @app.post("/generate-image")
-async def request_image_generation(prompt: str, background_tasks: BackgroundTasks) -> ImageGenerationResponse:
+async def request_image_generation(prompt: str, background_tasks: BackgroundTasks, http_request: Request) -> ImageGenerationResponse:
+    # The slot is held until the background generation finishes
+    client = client_id(http_request)
+    acquired_at = await image_admission.acquire(client, wait=False)
     task_id = str(uuid.uuid4())
     # Initialize task status
     image_task_status[task_id] = "processing"
-    background_tasks.add_task(generate_image_task, prompt, task_id)
+    background_tasks.add_task(generate_image_task, prompt, task_id, (client, acquired_at))
     return ImageGenerationResponse(task_id=task_id, status="processing")
 
 
-@app.get("/image-status/{task_id}")
-async def get_image_status(task_id: str, response: Response) -> ImageStatus:
-    response.headers["Cache-Control"] = "no-cache, no-store, must-revalidate"
+def _remember_missing(task_id):
+    now = time.monotonic()
+    if len(missing_images) >= MAX_MISSING_IMAGES:
+        for expired in [key for key, until in missing_images.items() if until <= now]:
+            del missing_images[expired]
+        if len(missing_images) >= MAX_MISSING_IMAGES:
+            return
+    missing_images[task_id] = now + IMAGE_MISSING_TTL
+
 
+async def _image_status(task_id):
+    """Status of an image task, with the direct URL of completed images."""
     status = image_task_status.get(task_id)
-    if status is None:
-        return ImageStatus(status="processing")
+    # Images generated by another worker (or before a restart) are only known to the storage,
+    # asked at most once per IMAGE_MISSING_TTL for an id it does not have (one S3 HEAD per poll otherwise)
+    if status is None and missing_images.get(task_id, 0) <= time.monotonic():
+        if await run_in_threadpool(image_storage.exists, task_id):
+            missing_images.pop(task_id, None)
+            status = image_task_status[task_id] = "completed"
+        else:
+            _remember_missing(task_id)
 
+    if status is None:
+        return {"status": "processing"}
     if status == "completed":
-        image_path = os.path.join(IMAGES_DIR, f"{task_id}.png")
-        exists = await run_in_threadpool(os.path.exists, image_path)
-        if exists:
-            return ImageStatus(
-                status="completed", image_url=f"data/generated_images/{task_id}.png"
-            )
+        return {"status": "completed", "image_url": image_storage.url(task_id)}
+    return {"status": status}
 
-    return ImageStatus(status=status)
+
+@app.get("/image-status/{task_id}")
+async def get_image_status(task_id: str, response: Response) -> ImageStatus:
+    response.headers["Cache-Control"] = "no-cache, no-store, must-revalidate"
+    return ImageStatus(**await _image_status(task_id))
 
 
 @app.post("/batch-image-status")
@@ -336,29 +545,5 @@ async def batch_get_image_status(request: ImageBatchStatusRequest) -> ImageBatch
     Check the status of multiple image generation tasks in a single request.
     Returns immediately with the current status of all requested tasks.
     """
-    results = {}
-    
-    # Process each task ID
-    for task_id in request.task_ids:
-        # Check in-memory status first (super fast)
-        status = image_task_status.get(task_id)
-        
-        # If task_id not in dictionary, mark as processing without file check
-        if status is None:
-            results[task_id] = {"status": "processing"}
-            continue
-            
-        # Only check file system if our in-memory status says it's completed
-        if status == "completed":
-            image_path = os.path.join(IMAGES_DIR, f"{task_id}.png")
-            if os.path.exists(image_path):
-                results[task_id] = {
-                    "status": "completed", 
-                    "image_url": f"data/generated_images/{task_id}.png"
-                }
-                continue
-                
-        # For any other status
-        results[task_id] = {"status": status}
-    
-    return ImageBatchStatusResponse(statuses=results)
+    statuses = await asyncio.gather(*(_image_status(task_id) for task_id in request.task_ids))
+    return ImageBatchStatusResponse(statuses=dict(zip(request.task_ids, statuses)))
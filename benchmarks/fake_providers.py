@@ -0,0 +1,236 @@
+"""
+Local stand-ins for the OpenAI/Groq chat and embedding APIs and the Seelab image API.
+
+Point the backend at it through the provider base URLs, e.g.:
+
+    python -m benchmarks.fake_providers --port 9000 --chat-latency 2 --failure-rate 0.02
+    OPENAI_API_BASE=http://127.0.0.1:9000/v1 OPENAI_BASE_URL=http://127.0.0.1:9000/v1 \
+    GROQ_API_BASE=http://127.0.0.1:9000/v1 SEELAB_API_URL=http://127.0.0.1:9000/api/predict \
+    SEELAB_POLLING_INTERVAL=0.2 uvicorn api.main:app
+"""
+import argparse
+import asyncio
+import json
+import random
+import struct
+import time
+import uuid
+import zlib
+
+import numpy as np
+import uvicorn
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, Response, StreamingResponse
+
+app = FastAPI()
+
+# Runtime configuration, overwritten from the command line
+config = {
+    "chat_latency": 1.0,
+    "embedding_latency": 0.1,
+    "seelab_latency": 0.1,
+    "seelab_render_time": 2.0,
+    "jitter": 0.25,
+    "failure_rate": 0.0,
+    "embedding_dim": 1536,
+    "image_bytes": None,
+}
+
+# Seelab session id -> time at which the fake render completes
+seelab_sessions = {}
+
+
+async def simulate(latency_key):
+    """Sleep for the configured latency (with jitter) and decide whether this call fails."""
+    latency = config[latency_key] * random.uniform(1 - config["jitter"], 1 + config["jitter"])
+    await asyncio.sleep(max(latency, 0))
+    return random.random() < config["failure_rate"]
+
+
+def failure_response():
+    return JSONResponse(
+        status_code=503,
+        content={"error": {"message": "Simulated provider failure", "type": "server_error"}},
+    )
+
+
+def _tiny_png():
+    """Build a valid 1x1 PNG without any imaging dependency."""
+    def chunk(kind, data):
+        return struct.pack(">I", len(data)) + kind + data + struct.pack(">I", zlib.crc32(kind + data))
+
+    header = struct.pack(">IIBBBBB", 1, 1, 8, 2, 0, 0, 0)
+    pixels = zlib.compress(b"\x00\x80\x80\x80")
+    return b"\x89PNG\r\n\x1a\n" + chunk(b"IHDR", header) + chunk(b"IDAT", pixels) + chunk(b"IEND", b"")
+
+
+def _fake_event(index, year):
+    return {
+        "title": f"Événement simulé numéro {index}",
+        "date": f"{year:04d}-06-15",
+        "description": [
+            "Un tournant inattendu bouleverse l'équilibre du monde.",
+            "Les chroniqueurs de l'époque peinent à en mesurer la portée.",
+        ],
+        "options": [
+            {
+                "title": "Accepter le changement",
+                "consequence": ["Le monde s'adapte lentement.", "Une ère nouvelle commence."],
+            },
+            {
+                "title": "Résister à tout prix",
+                "consequence": ["Les tensions explosent.", "Rien ne sera plus comme avant."],
+            },
+        ],
+    }
+
+
+def fake_completion_content(messages):
+    """Return a response shaped like what each pipeline stage expects from the model."""
+    prompt = "\n".join(str(message.get("content", "")) for message in messages)
+    events = {"events": [_fake_event(i, year) for i, year in enumerate((2001, 2030, 2150), start=1)]}
+    if "JSON format" in prompt:
+        return json.dumps(events, ensure_ascii=False)
+    if "<events>" in prompt:
+        return f"<think>Projection simulée.</think>\n<events>\n{json.dumps(events, ensure_ascii=False)}\n</events>"
+    if "Rewrite each historical event" in prompt:
+        corpus = json.loads(messages[-1]["content"])
+        rewritten = [{**_fake_event(entry["id"], entry["year"]), "id": entry["id"]} for entry in corpus]
+        return json.dumps({"events": rewritten}, ensure_ascii=False)
+    if "Current report" in prompt:
+        return "Bravo ! Vos décisions ont profondément remodelé le cours de l'histoire."
+    if "chaos_level" in prompt:
+        return json.dumps({"description": "Bravo ! Vos choix ont remodelé l'histoire."}, ensure_ascii=False)
+    return (
+        "1. **Événement simulé numéro 1** (2001) : un premier bouleversement.\n"
+        "2. **Événement simulé numéro 2** (2030) : la situation atteint son apogée.\n"
+        "3. **Événement simulé numéro 3** (2150) : une renaissance lointaine."
+    )
+
+
+async def stream_chunks(model, content, pieces=8):
+    """Server-sent events in the OpenAI streaming format, spread over a few chunks."""
+    completion_id = f"chatcmpl-{uuid.uuid4().hex}"
+    size = max(len(content) // pieces, 1)
+    for start in range(0, len(content), size):
+        chunk = {
+            "id": completion_id,
+            "object": "chat.completion.chunk",
+            "created": int(time.time()),
+            "model": model,
+            "choices": [{"index": 0, "delta": {"content": content[start:start + size]}, "finish_reason": None}],
+        }
+        yield f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n"
+        await asyncio.sleep(0.01)
+    done = {"id": completion_id, "object": "chat.completion.chunk", "created": int(time.time()), "model": model,
+            "choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}]}
+    yield f"data: {json.dumps(done)}\n\n"
+    yield "data: [DONE]\n\n"
+
+
+@app.post("/v1/chat/completions")
+async def chat_completions(request: Request):
+    body = await request.json()
+    if await simulate("chat_latency"):
+        return failure_response()
+    content = fake_completion_content(body.get("messages", []))
+    if body.get("stream"):
+        return StreamingResponse(stream_chunks(body.get("model", "fake"), content), media_type="text/event-stream")
+    prompt_tokens = sum(len(str(m.get("content", ""))) for m in body.get("messages", [])) // 4
+    completion_tokens = len(content) // 4
+    return {
+        "id": f"chatcmpl-{uuid.uuid4().hex}",
+        "object": "chat.completion",
+        "created": int(time.time()),
+        "model": body.get("model", "fake"),
+        "choices": [
+            {"index": 0, "message": {"role": "assistant", "content": content}, "finish_reason": "stop"}
+        ],
+        "usage": {
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": completion_tokens,
+            "total_tokens": prompt_tokens + completion_tokens,
+        },
+    }
+
+
+@app.post("/v1/embeddings")
+async def embeddings(request: Request):
+    body = await request.json()
+    if await simulate("embedding_latency"):
+        return failure_response()
+    texts = body["input"] if isinstance(body["input"], list) else [body["input"]]
+    data = []
+    for index, text in enumerate(texts):
+        # Deterministic per text so retrieval results are stable across runs
+        rng = np.random.default_rng(zlib.crc32(str(text).encode()))
+        vector = rng.standard_normal(config["embedding_dim"])
+        vector /= np.linalg.norm(vector)
+        data.append({"object": "embedding", "index": index, "embedding": vector.tolist()})
+    tokens = sum(len(str(text)) for text in texts) // 4
+    return {
+        "object": "list",
+        "data": data,
+        "model": body.get("model", "fake"),
+        "usage": {"prompt_tokens": tokens, "total_tokens": tokens},
+    }
+
+
+@app.post("/api/predict/text-to-image")
+async def text_to_image(request: Request):
+    await request.json()
+    if await simulate("seelab_latency"):
+        return failure_response()
+    session_id = uuid.uuid4().hex
+    seelab_sessions[session_id] = time.monotonic() + config["seelab_render_time"]
+    return {"id": session_id, "state": "pending"}
+
+
+@app.get("/api/predict/session/{session_id}")
+async def seelab_session(session_id: str, request: Request):
+    if await simulate("seelab_latency"):
+        return failure_response()
+    ready_at = seelab_sessions.get(session_id)
+    if ready_at is None:
+        return JSONResponse(status_code=404, content={"detail": "Unknown session"})
+    if time.monotonic() < ready_at:
+        return {"id": session_id, "state": "running"}
+    link = f"{str(request.base_url).rstrip('/')}/images/{session_id}.png"
+    return {"id": session_id, "state": "succeed", "result": {"image": [{"links": {"original": link}}]}}
+
+
+@app.get("/images/{name}")
+async def image(name: str):
+    if await simulate("seelab_latency"):
+        return failure_response()
+    return Response(content=config["image_bytes"], media_type="image/png")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run local fake LLM, embedding and Seelab providers")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=9000)
+    parser.add_argument("--chat-latency", type=float, default=config["chat_latency"])
+    parser.add_argument("--embedding-latency", type=float, default=config["embedding_latency"])
+    parser.add_argument("--seelab-latency", type=float, default=config["seelab_latency"])
+    parser.add_argument("--seelab-render-time", type=float, default=config["seelab_render_time"])
+    parser.add_argument("--jitter", type=float, default=config["jitter"], help="Relative latency jitter (0.25 = ±25%%)")
+    parser.add_argument("--failure-rate", type=float, default=config["failure_rate"])
+    parser.add_argument("--embedding-dim", type=int, default=config["embedding_dim"])
+    parser.add_argument("--image-file", help="PNG served as the generated image (defaults to a 1x1 PNG)")
+    args = parser.parse_args()
+
+    for key in ("chat_latency", "embedding_latency", "seelab_latency", "seelab_render_time", "jitter",
+                "failure_rate", "embedding_dim"):
+        config[key] = getattr(args, key)
+    if args.image_file:
+        with open(args.image_file, "rb") as f:
+            config["image_bytes"] = f.read()
+    else:
+        config["image_bytes"] = _tiny_png()
+
+    uvicorn.run(app, host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,168 @@
+"""
+Replay realistic game turns against a running backend and report throughput and latency percentiles.
+
+    python -m benchmarks.load_test --base-url http://127.0.0.1:8000 --users 20 --turns 3
+    python -m benchmarks.load_test --mode payload --body test_body.json --users 10 --output report.json
+"""
+import argparse
+import asyncio
+import json
+import random
+import time
+from collections import defaultdict
+
+import httpx
+
+
+def percentile(samples, q):
+    if not samples:
+        return None
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+class Recorder:
+    """Collects latencies and errors per endpoint."""
+
+    def __init__(self):
+        self.latencies = defaultdict(list)
+        self.errors = defaultdict(int)
+
+    async def request(self, client, endpoint, method, url, **kwargs):
+        start = time.perf_counter()
+        try:
+            response = await client.request(method, url, **kwargs)
+        except httpx.HTTPError:
+            self.errors[endpoint] += 1
+            return None
+        self.latencies[endpoint].append(time.perf_counter() - start)
+        if response.status_code >= 400:
+            self.errors[endpoint] += 1
+            return None
+        return response.json()
+
+    def report(self, elapsed):
+        report = {}
+        for endpoint in sorted(set(self.latencies) | set(self.errors)):
+            samples = self.latencies[endpoint]
+            report[endpoint] = {
+                "requests": len(samples),
+                "errors": self.errors[endpoint],
+                "throughput_rps": len(samples) / elapsed if elapsed else 0.0,
+                "p50": percentile(samples, 0.50),
+                "p95": percentile(samples, 0.95),
+                "p99": percentile(samples, 0.99),
+            }
+        return report
+
+
+async def poll_images(client, recorder, task_ids, timeout, interval):
+    deadline = time.monotonic() + timeout
+    pending = list(task_ids)
+    while pending and time.monotonic() < deadline:
+        await asyncio.sleep(interval)
+        result = await recorder.request(
+            client, "batch-image-status", "POST", "/batch-image-status", json={"task_ids": pending}
+        )
+        if result is None:
+            continue
+        pending = [
+            task_id for task_id, status in result["statuses"].items()
+            if status["status"] not in ("completed", "error")
+        ]
+
+
+def choose_option(events):
+    event = random.choice(events)
+    return f"{event['id']}_{random.randrange(len(event['options']))}"
+
+
+async def session_user(client, recorder, args):
+    """Start a game and play `turns` turns through the delta session API."""
+    start = await recorder.request(client, "start_game", "POST", "/start_game")
+    if start is None:
+        return
+    session_id, events = start["session_id"], start["events"]
+    for _ in range(args.turns):
+        result = await recorder.request(
+            client, "update_events", "POST", "/update_events",
+            json={"session_id": session_id, "option_chosen": choose_option(events)},
+        )
+        if result is None:
+            return
+        events = result["events"]
+        if args.poll_images:
+            await poll_images(client, recorder, [t["task_id"] for t in result["image_tasks"]],
+                              args.image_timeout, args.poll_interval)
+    await recorder.request(client, "exit_game", "POST", "/exit_game", params={"session_id": session_id})
+
+
+async def payload_user(client, recorder, args, body):
+    """Replay the captured full-payload request `turns` times."""
+    await recorder.request(client, "get_initial_events", "GET", "/get_initial_events")
+    for _ in range(args.turns):
+        result = await recorder.request(client, "update_events", "POST", "/update_events", json=body)
+        if result is None:
+            return
+        if args.poll_images:
+            await poll_images(client, recorder, [t["task_id"] for t in result["image_tasks"]],
+                              args.image_timeout, args.poll_interval)
+    await recorder.request(client, "exit_game", "POST", "/exit_game", json=body["events"])
+
+
+async def run(args):
+    recorder = Recorder()
+    body = None
+    if args.mode == "payload":
+        with open(args.body, "r") as f:
+            body = json.load(f)
+
+    limits = httpx.Limits(max_connections=args.users, max_keepalive_connections=args.users)
+    async with httpx.AsyncClient(base_url=args.base_url, timeout=args.timeout, limits=limits) as client:
+        start = time.perf_counter()
+        if args.mode == "payload":
+            users = [payload_user(client, recorder, args, body) for _ in range(args.users)]
+        else:
+            users = [session_user(client, recorder, args) for _ in range(args.users)]
+        await asyncio.gather(*users)
+        elapsed = time.perf_counter() - start
+
+    return {"elapsed_seconds": elapsed, "users": args.users, "turns": args.turns,
+            "endpoints": recorder.report(elapsed)}
+
+
+def print_report(report):
+    print(f"{report['users']} users x {report['turns']} turns in {report['elapsed_seconds']:.1f}s")
+    print(f"{'endpoint':<22}{'reqs':>6}{'errs':>6}{'rps':>8}{'p50':>8}{'p95':>8}{'p99':>8}")
+    for endpoint, stats in report["endpoints"].items():
+        def fmt(value):
+            return f"{value:8.2f}" if value is not None else f"{'-':>8}"
+        print(f"{endpoint:<22}{stats['requests']:>6}{stats['errors']:>6}{stats['throughput_rps']:>8.2f}"
+              f"{fmt(stats['p50'])}{fmt(stats['p95'])}{fmt(stats['p99'])}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test the uchronia backend")
+    parser.add_argument("--base-url", default="http://127.0.0.1:8000")
+    parser.add_argument("--mode", choices=["session", "payload"], default="session")
+    parser.add_argument("--body", default="test_body.json", help="Captured update_events body (payload mode)")
+    parser.add_argument("--users", type=int, default=10, help="Concurrent virtual players")
+    parser.add_argument("--turns", type=int, default=3, help="update_events turns per player")
+    parser.add_argument("--poll-images", action="store_true", help="Poll image tasks like the client does")
+    parser.add_argument("--poll-interval", type=float, default=1.0)
+    parser.add_argument("--image-timeout", type=float, default=60.0)
+    parser.add_argument("--timeout", type=float, default=120.0, help="Per-request timeout in seconds")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="Write the JSON report to this file")
+    args = parser.parse_args()
+
+    random.seed(args.seed)
+    report = asyncio.run(run(args))
+    print_report(report)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
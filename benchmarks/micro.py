@@ -0,0 +1,267 @@
+"""
+Micro-benchmarks of the pure-Python work of a turn, run offline.
+
+Covers the LLM output parsing (parse_json_markdown, extract_tag_content), the greedy
+unique-match loop of image retrieval and the index scoring before it, the media prompt
+assembly and assignment loops, the timeline prompt, the stage timer, and the validation of timelines into
+Event models. Timelines of 5 to 200 events are built from the starting deck, corpora of 1k
+to 100k vectors are random, and captured LLM outputs are read from cassettes when present
+(see benchmarks/parse_json.py).
+
+Each case reports the median and minimum time per call over several samples. Save a report
+before a change and compare against it after; the comparison exits with status 1 when a case
+got slower than the threshold:
+
+    python -m benchmarks.micro --output baseline.json
+    python -m benchmarks.micro --compare baseline.json --threshold 0.15
+    python -m benchmarks.micro --compare baseline.json --against candidate.json
+"""
+import argparse
+import copy
+import json
+import os
+import platform
+import statistics
+import sys
+import time
+from datetime import datetime, timezone
+from typing import List
+
+import numpy as np
+import pydantic
+from pydantic import TypeAdapter
+
+from benchmarks.parse_json import load_cassette, load_files
+from models.event import Event
+from services.cassette import CASSETTE_PATH
+from services.event_repair import check_events
+from services.media_prompts import apply_media, media_prompts
+from services.metrics import time_stage
+from services.shared_index import cosine_scores, normalize_rows, unique_best_indices
+from services.timeline_context import build_timeline_context
+from utils.parse_llm_output import extract_tag_content, parse_json_markdown
+
+STARTING_DECK = "data/starting_deck.json"
+EVENT_SIZES = [5, 20, 50, 200]
+CORPUS_SIZES = [1000, 10000, 100000]
+# Image prompts of a turn: 3 events and their 6 options
+RETRIEVAL_BATCH = 9
+
+
+def synthetic_timeline(size, path=STARTING_DECK):
+    """`size` events in the Event layout, cycling through the starting deck stories."""
+    with open(path, "r") as f:
+        stories = json.load(f)["stories"]
+    events = []
+    for i in range(size):
+        story = stories[i % len(stories)]
+        events.append({
+            "id": str(i + 1),
+            "title": f"{story['title']} ({i // len(stories) + 1})" if i >= len(stories) else story["title"],
+            "description": story["description"],
+            "image": story["img"],
+            "date": f"{1000 + i * 5:04d}-01-01",
+            "music_file": story["music_file"],
+            "options": [
+                {"title": o["title"], "consequence": o["consequence"], "img": o["img"], "music_file": o["music_file"]}
+                for o in story["options"]
+            ],
+        })
+    return events
+
+
+def generated_events(timeline):
+    """The timeline as format_narrative_arc returns it (no ids, images or music)."""
+    return [
+        {
+            "title": event["title"],
+            "date": event["date"],
+            "description": event["description"],
+            "options": [{"title": o["title"], "consequence": o["consequence"]} for o in event["options"]],
+        }
+        for event in timeline
+    ]
+
+
+def measure(fn, samples, min_sample_seconds):
+    """Seconds per call of `fn`: (median, minimum, loops per sample)."""
+    loops = 1
+    while True:
+        start = time.perf_counter()
+        for _ in range(loops):
+            fn()
+        elapsed = time.perf_counter() - start
+        if elapsed >= min_sample_seconds:
+            break
+        loops *= 2
+    timings = [elapsed / loops]
+    for _ in range(samples - 1):
+        start = time.perf_counter()
+        for _ in range(loops):
+            fn()
+        timings.append((time.perf_counter() - start) / loops)
+    return statistics.median(timings), min(timings), loops
+
+
+def parse_cases(event_sizes, captured):
+    for size in event_sizes:
+        events = {"events": generated_events(synthetic_timeline(size))}
+        fenced = "```json\n" + json.dumps(events, ensure_ascii=False, indent=2) + "\n```"
+        tagged = f"<think>Projection.</think>\n<events>\n{json.dumps(events, ensure_ascii=False)}\n</events>"
+        yield "parse.parse_json_markdown", size, lambda text=fenced: parse_json_markdown(text)
+        yield "parse.extract_tag_content", size, lambda text=tagged: extract_tag_content(text, "events")
+    if captured:
+        def parse_captured():
+            for text in captured:
+                try:
+                    parse_json_markdown(text)
+                except json.JSONDecodeError:
+                    pass
+
+        yield "parse.captured_responses", len(captured), parse_captured
+
+
+def retrieval_cases(corpus_sizes, dim, seed):
+    rng = np.random.default_rng(seed)
+    for size in corpus_sizes:
+        index = normalize_rows(rng.normal(size=(size, dim)).astype(np.float32))
+        queries = rng.normal(size=(RETRIEVAL_BATCH, dim)).astype(np.float32)
+        similarities = cosine_scores(index, queries)
+        yield "retrieval.cosine_scores", size, lambda index=index, queries=queries: cosine_scores(index, queries)
+        yield "retrieval.unique_best_indices", size, lambda scores=similarities: unique_best_indices(scores)
+
+
+def timed_stage():
+    with time_stage("benchmark"):
+        pass
+
+
+def turn_cases(event_sizes):
+    # A turn records a few dozen stages
+    yield "turn.time_stage", 1, timed_stage
+    for size in event_sizes:
+        new_events = generated_events(synthetic_timeline(size))
+        prompts = media_prompts(new_events)
+        event_ids = list(range(len(prompts["event_images"])))
+        option_ids = list(range(len(prompts["option_images"])))
+        music = [f"{i}.mp3" for i in range(len(prompts["music"]))]
+        yield "turn.media_prompts", size, lambda events=new_events: media_prompts(events)
+        yield "turn.apply_media", size, lambda events=new_events, prompts=prompts, e=event_ids, o=option_ids, m=music: (
+            apply_media(events, prompts, e, o, m)
+        )
+        timeline = synthetic_timeline(size)
+        yield "turn.build_timeline_context", size, lambda events=timeline: build_timeline_context(events)
+
+
+def validation_cases(event_sizes):
+    adapter = TypeAdapter(List[Event])
+    for size in event_sizes:
+        timeline = synthetic_timeline(size)
+        events = adapter.validate_python(timeline)
+        raw = generated_events(timeline)
+        yield "validation.events", size, lambda data=timeline: adapter.validate_python(data)
+        yield "validation.events_json", size, lambda data=json.dumps(timeline): adapter.validate_json(data)
+        yield "validation.model_dump", size, lambda events=events: [event.model_dump() for event in events]
+        # check_events normalizes its input in place, give it a fresh copy each call
+        yield "validation.check_events", size, lambda raw=raw: check_events(copy.deepcopy(raw))
+
+
+def run(args, captured):
+    groups = {
+        "parse": lambda: parse_cases(args.events, captured),
+        "retrieval": lambda: retrieval_cases(args.corpus, args.dim, args.seed),
+        "turn": lambda: turn_cases(args.events),
+        "validation": lambda: validation_cases(args.events),
+    }
+    results = []
+    for group, cases in groups.items():
+        if args.only and group not in args.only:
+            continue
+        for name, size, fn in cases():
+            median, minimum, loops = measure(fn, args.samples, args.min_sample_seconds)
+            results.append({"name": name, "size": size, "median_us": median * 1e6, "min_us": minimum * 1e6,
+                            "loops": loops})
+            print(f"{name:<32} {size:>7} {median * 1e6:>12.1f} {minimum * 1e6:>12.1f}")
+    return {
+        "created_at": datetime.now(timezone.utc).isoformat(),
+        "python": sys.version.split()[0],
+        "numpy": np.__version__,
+        "pydantic": pydantic.VERSION,
+        "machine": platform.platform(),
+        "results": results,
+    }
+
+
+def compare(baseline, candidate, threshold):
+    """
+    Compare the median times of two reports.
+
+    Returns:
+        list[dict]: One row per case present in both reports, with "regression" set
+        when the candidate is slower than the baseline by more than `threshold`
+    """
+    before = {(row["name"], row["size"]): row for row in baseline["results"]}
+    rows = []
+    for row in candidate["results"]:
+        base = before.get((row["name"], row["size"]))
+        if base is None:
+            continue
+        ratio = row["median_us"] / base["median_us"] if base["median_us"] else float("inf")
+        rows.append({"name": row["name"], "size": row["size"], "baseline_us": base["median_us"],
+                     "median_us": row["median_us"], "ratio": ratio, "regression": ratio > 1 + threshold})
+    return rows
+
+
+def print_comparison(rows, threshold):
+    print(f"\n{'case':<32} {'size':>7} {'before µs':>12} {'after µs':>12} {'change':>8}")
+    for row in rows:
+        flag = "  ⚠️ slower" if row["regression"] else ""
+        print(f"{row['name']:<32} {row['size']:>7} {row['baseline_us']:>12.1f} {row['median_us']:>12.1f} "
+              f"{row['ratio'] - 1:>+8.1%}{flag}")
+    regressions = sum(row["regression"] for row in rows)
+    print(f"\n{regressions} of {len(rows)} cases slower than +{threshold:.0%}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Micro-benchmark the pure-Python paths of a turn")
+    parser.add_argument("--events", type=int, nargs="*", default=EVENT_SIZES, help="Synthetic timeline sizes")
+    parser.add_argument("--corpus", type=int, nargs="*", default=CORPUS_SIZES, help="Synthetic index sizes")
+    parser.add_argument("--dim", type=int, default=256, help="Dimension of the synthetic index vectors")
+    parser.add_argument("--only", nargs="*", choices=["parse", "retrieval", "turn", "validation"],
+                        help="Run only these groups")
+    parser.add_argument("--cassette", action="append", help=f"Recorded cassette (default: {CASSETTE_PATH} if present)")
+    parser.add_argument("--captured", nargs="*", default=[], help="Files holding raw LLM responses")
+    parser.add_argument("--samples", type=int, default=5, help="Timed samples per case")
+    parser.add_argument("--min-sample-seconds", type=float, default=0.05,
+                        help="Calls per sample are doubled until a sample lasts this long")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="Write the JSON report to this file")
+    parser.add_argument("--compare", help="Baseline report to compare against")
+    parser.add_argument("--against", help="Compare this report with the baseline instead of running the suite")
+    parser.add_argument("--threshold", type=float, default=0.15, help="Relative slowdown counted as a regression")
+    args = parser.parse_args()
+
+    if args.against:
+        if not args.compare:
+            parser.error("--against requires --compare")
+        with open(args.against, "r") as f:
+            report = json.load(f)
+    else:
+        cassettes = args.cassette or ([CASSETTE_PATH] if os.path.exists(CASSETTE_PATH) else [])
+        captured = [text for path in cassettes for text in load_cassette(path)] + load_files(args.captured)
+        print(f"{'case':<32} {'size':>7} {'median µs':>12} {'min µs':>12}")
+        report = run(args, captured)
+        if args.output:
+            with open(args.output, "w") as f:
+                json.dump(report, f, indent=2)
+
+    if args.compare:
+        with open(args.compare, "r") as f:
+            baseline = json.load(f)
+        if print_comparison(compare(baseline, report, args.threshold), args.threshold):
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,184 @@
+"""
+Benchmark LLM JSON parsing on captured responses and damaged variants of them.
+
+Responses come from recorded cassettes (CASSETTE_MODE=record) and from extra files. Without
+any, documents shaped like the format_narrative_arc output are built from the starting
+deck. Each response is parsed as is and after typical LLM damage (trailing commas, raw
+newlines, unescaped quotes, truncation), with plain json.loads as the baseline:
+
+    python -m benchmarks.parse_json --cassette data/cassettes/cassette.jsonl --output parse.json
+"""
+import argparse
+import json
+import os
+import random
+import re
+import time
+
+from services.cassette import CASSETTE_PATH
+from utils.parse_llm_output import _parse_json, extract_tag_content, parse_json_markdown
+
+STARTING_DECK = "data/starting_deck.json"
+# Stages whose responses carry JSON
+JSON_STAGES = ("generate_future_events", "format_narrative_arc", "generate_final_report")
+TRUNCATE_AT = (0.35, 0.6, 0.85)
+
+
+def load_cassette(path):
+    responses = []
+    with open(path, "r") as f:
+        for line in f:
+            if not line.strip():
+                continue
+            entry = json.loads(line)
+            if entry["kind"] != "llm" or entry["request"].get("stage") not in JSON_STAGES:
+                continue
+            content = entry["response"]["choices"][0]["message"]["content"]
+            if entry["request"]["stage"] == "generate_future_events":
+                content = extract_tag_content(content, "events") or content
+            responses.append(content)
+    return responses
+
+
+def load_files(paths):
+    responses = []
+    for path in paths:
+        with open(path, "r") as f:
+            responses.append(f.read())
+    return responses
+
+
+def starting_deck_responses(path=STARTING_DECK, per_response=3):
+    with open(path, "r") as f:
+        stories = json.load(f)["stories"]
+    events = [
+        {
+            "title": story["title"],
+            "date": story["date"],
+            "description": story["description"],
+            "options": [{"title": o["title"], "consequence": o["consequence"]} for o in story["options"]],
+        }
+        for story in stories
+    ]
+    return [
+        "```json\n" + json.dumps({"events": events[i:i + per_response]}, ensure_ascii=False, indent=2) + "\n```"
+        for i in range(0, len(events), per_response)
+    ]
+
+
+def quote_words(value, rng):
+    """Put raw double quotes around one word of every multi-word string."""
+    if isinstance(value, dict):
+        return {key: quote_words(item, rng) for key, item in value.items()}
+    if isinstance(value, list):
+        return [quote_words(item, rng) for item in value]
+    if isinstance(value, str) and " " in value:
+        words = value.split(" ")
+        index = rng.randrange(len(words))
+        words[index] = f'\u0000{words[index]}\u0000'
+        return " ".join(words)
+    return value
+
+
+def damaged_variants(text, rng):
+    """
+    Yield (damage kind, text, expected result) triples derived from one response.
+
+    The expected result is None when the damage loses information (truncation).
+    """
+    try:
+        document = parse_json_markdown(text)
+    except json.JSONDecodeError:
+        yield "clean", text, None
+        return
+    yield "clean", text, document
+    dumped = json.dumps(document, ensure_ascii=False, indent=2)
+    yield "trailing_commas", re.sub(r"([^\[{,\s])(\s*\n\s*[}\]])", r"\1,\2", dumped), document
+    yield "raw_newlines", dumped.replace(". ", ".\n"), json.loads(json.dumps(document).replace(". ", ".\\n"))
+    quoted = quote_words(document, rng)
+    yield "unescaped_quotes", json.dumps(quoted, ensure_ascii=False, indent=2).replace("\\u0000", '"'), json.loads(
+        json.dumps(quoted).replace("\\u0000", '\\"')
+    )
+    for fraction in TRUNCATE_AT:
+        yield f"truncated_{int(fraction * 100)}", dumped[: int(len(dumped) * fraction)], None
+
+
+def count_events(result):
+    if isinstance(result, dict) and isinstance(result.get("events"), list):
+        return len(result["events"])
+    return 1 if result else 0
+
+
+def measure(parse, text, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        try:
+            result = parse(text)
+        except json.JSONDecodeError:
+            result = None
+    return result, (time.perf_counter() - start) / repeat
+
+
+def run(responses, repeat, seed):
+    rng = random.Random(seed)
+    stats = {}
+    for text in responses:
+        for kind, variant, expected in damaged_variants(text, rng):
+            row = stats.setdefault(kind, {"cases": 0, "baseline_ok": 0, "ok": 0, "exact": 0, "events": 0,
+                                          "baseline_seconds": 0.0, "seconds": 0.0})
+            baseline, baseline_seconds = measure(_parse_json, variant, repeat)
+            result, seconds = measure(parse_json_markdown, variant, repeat)
+            row["cases"] += 1
+            row["baseline_ok"] += baseline is not None
+            # A response is usable when it yields at least one event (or a non-empty report)
+            row["ok"] += count_events(result) > 0
+            row["exact"] += expected is not None and result == expected
+            row["events"] += count_events(result)
+            row["baseline_seconds"] += baseline_seconds
+            row["seconds"] += seconds
+    return {
+        kind: {
+            "cases": row["cases"],
+            "baseline_success": row["baseline_ok"] / row["cases"],
+            "success": row["ok"] / row["cases"],
+            "exact": row["exact"] / row["cases"],
+            "events_recovered": row["events"],
+            "baseline_mean_us": row["baseline_seconds"] / row["cases"] * 1e6,
+            "mean_us": row["seconds"] / row["cases"] * 1e6,
+        }
+        for kind, row in stats.items()
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the tolerant LLM JSON parser")
+    parser.add_argument("--cassette", action="append", help=f"Recorded cassette (default: {CASSETTE_PATH} if present)")
+    parser.add_argument("--corpus", nargs="*", default=[], help="Files holding raw LLM responses")
+    parser.add_argument("--repeat", type=int, default=20, help="Parses per case for timing")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="Write the JSON report to this file")
+    args = parser.parse_args()
+
+    cassettes = args.cassette or ([CASSETTE_PATH] if os.path.exists(CASSETTE_PATH) else [])
+    responses = [text for path in cassettes for text in load_cassette(path)] + load_files(args.corpus)
+    source = "captured responses"
+    if not responses:
+        responses = starting_deck_responses()
+        source = f"responses built from {STARTING_DECK}"
+    print(f"Benchmarking {len(responses)} {source}")
+
+    report = run(responses, args.repeat, args.seed)
+    print(f"{'case':<18} {'n':>4} {'json.loads':>10} {'tolerant':>9} {'exact':>6} {'events':>7} "
+          f"{'loads µs':>9} {'parse µs':>9}")
+    for kind, row in report.items():
+        print(
+            f"{kind:<18} {row['cases']:>4} {row['baseline_success']:>10.0%} {row['success']:>9.0%} {row['exact']:>6.0%} "
+            f"{row['events_recovered']:>7} {row['baseline_mean_us']:>9.1f} {row['mean_us']:>9.1f}"
+        )
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,155 @@
+"""
+Benchmark quantized retrieval indexes against the exact float32 index.
+
+For each index, float16 and int8 copies are scored with and without the exact re-rank of
+the top-k candidates. Queries are index rows with Gaussian noise added (no embedding calls
+needed), scored in batches the size of a turn. Reports the bytes scored per query, the
+latency per batch, top-1 agreement and recall@10 against the exact index:
+
+    python -m benchmarks.quantized_index
+    python -m benchmarks.quantized_index --synthetic 200000 --output quantized.json
+
+--direct also times scoring the codes without converting them to float32 (int8 codes and
+queries with int32 accumulation, float16 codes and queries), the alternative to the block
+conversion of QuantizedIndex; its rows report rerank "direct".
+"""
+import argparse
+import glob
+import json
+import tempfile
+import time
+
+import numpy as np
+
+from services.create_rag.embedding_cache import INDEX_PREFIX as IMAGE_INDEX_PREFIX
+from services.shared_index import QuantizedIndex, cosine_scores, load_or_build_index
+
+MUSIC_INDEX_PREFIX = "services/music/music_index"
+# Image and music prompts of a turn: 3 events and their 6 options
+BATCH_SIZE = 9
+RECALL_AT = 10
+
+
+def find_index(prefix):
+    paths = [
+        path for path in glob.glob(f"{glob.escape(prefix)}.*.npy")
+        if path.count(".") == prefix.count(".") + 2 and not path.endswith(".tmp.npy")
+    ]
+    return paths[0] if paths else None
+
+
+def synthetic_index(items, dim, rng, clusters=256):
+    """Clustered unit vectors, closer to real embeddings than uniform noise."""
+    centers = rng.normal(size=(clusters, dim)).astype(np.float32)
+    return centers[rng.integers(clusters, size=items)] + rng.normal(scale=0.5, size=(items, dim)).astype(np.float32)
+
+
+def direct_scores(index, queries):
+    """Score the codes in their own dtype: int8 with int32 accumulation, float16 without upcast."""
+    queries = queries / np.linalg.norm(queries, axis=1, keepdims=True)
+    if index.scales is None:
+        return (np.asarray(index.codes) @ queries.astype(np.float16).T).T.astype(np.float32)
+    query_scales = np.abs(queries).max(axis=1) / 127
+    query_codes = np.round(queries / query_scales[:, None]).astype(np.int8)
+    scores = np.matmul(np.asarray(index.codes), query_codes.T, dtype=np.int32).T.astype(np.float32)
+    return scores * index.scales * query_scales[:, None]
+
+
+def time_batches(score, queries, repeat):
+    timings = []
+    for _ in range(repeat):
+        batches = []
+        for start in range(0, len(queries), BATCH_SIZE):
+            began = time.perf_counter()
+            batches.append(score(queries[start:start + BATCH_SIZE]))
+            timings.append(time.perf_counter() - began)
+    return np.vstack(batches), np.array(timings)
+
+
+def measure(index, queries, repeat):
+    return time_batches(lambda batch: cosine_scores(index, batch), queries, repeat)
+
+
+def top(scores, k):
+    return np.argsort(-scores, axis=1)[:, :k]
+
+
+def run(name, items, queries, repeat, rerank_ks, direct=False):
+    rows = []
+    with tempfile.TemporaryDirectory() as directory:
+        prefix = f"{directory}/index"
+        exact = load_or_build_index(prefix, "bench", lambda: items)
+        exact_scores, timings = measure(exact, queries, repeat)
+        exact_top = top(exact_scores, RECALL_AT)
+        rows.append({"index": name, "dtype": "float32", "rerank_k": 0, "bytes": exact.nbytes,
+                     "batch_ms_p50": np.percentile(timings, 50) * 1e3, "batch_ms_p95": np.percentile(timings, 95) * 1e3,
+                     "top1_agreement": 1.0, "recall_at_10": 1.0})
+        for dtype in ("float16", "int8"):
+            quantized = load_or_build_index(prefix, "bench", lambda: items, dtype=dtype)
+            for rerank_k in rerank_ks + (["direct"] if direct else []):
+                if rerank_k == "direct":
+                    index = quantized
+                    scores, timings = time_batches(lambda batch: direct_scores(quantized, batch), queries, repeat)
+                else:
+                    index = QuantizedIndex(quantized.codes, quantized.scales, quantized.exact, rerank_k)
+                    scores, timings = measure(index, queries, repeat)
+                found = top(scores, RECALL_AT)
+                rows.append({
+                    "index": name,
+                    "dtype": dtype,
+                    "rerank_k": rerank_k,
+                    "bytes": index.nbytes,
+                    "batch_ms_p50": np.percentile(timings, 50) * 1e3,
+                    "batch_ms_p95": np.percentile(timings, 95) * 1e3,
+                    "top1_agreement": float((found[:, 0] == exact_top[:, 0]).mean()),
+                    "recall_at_10": float(np.mean([len(set(a) & set(b)) / RECALL_AT
+                                                   for a, b in zip(found, exact_top)])),
+                })
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark float16/int8 retrieval indexes")
+    parser.add_argument("--synthetic", type=int, nargs="*", default=[],
+                        help="Also benchmark synthetic indexes of these sizes")
+    parser.add_argument("--dim", type=int, default=1536, help="Dimension of synthetic indexes")
+    parser.add_argument("--queries", type=int, default=180)
+    parser.add_argument("--noise", type=float, default=0.04, help="Per-dimension noise added to the query rows")
+    parser.add_argument("--rerank-k", type=int, nargs="*", default=[0, 16])
+    parser.add_argument("--direct", action="store_true", help="Also time scoring the codes in their own dtype")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="Write the JSON report to this file")
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(args.seed)
+    datasets = []
+    for name, prefix in (("image", IMAGE_INDEX_PREFIX), ("music", MUSIC_INDEX_PREFIX)):
+        path = find_index(prefix)
+        if path:
+            datasets.append((name, np.load(path)))
+        else:
+            print(f"⚠️ No {name} index under {prefix}.*.npy (python -m services.shared_index builds it)")
+    datasets += [(f"synthetic_{size}", synthetic_index(size, args.dim, rng)) for size in args.synthetic]
+
+    report = []
+    for name, items in datasets:
+        picked = rng.integers(len(items), size=args.queries)
+        queries = items[picked] / np.linalg.norm(items[picked], axis=1, keepdims=True)
+        queries = queries + rng.normal(scale=args.noise, size=queries.shape).astype(np.float32)
+        report += run(name, items, queries, args.repeat, args.rerank_k, args.direct)
+
+    print(f"{'index':<18} {'dtype':<8} {'rerank':>6} {'MiB':>8} {'p50 ms':>8} {'p95 ms':>8} {'top-1':>7} {'R@10':>6}")
+    for row in report:
+        print(
+            f"{row['index']:<18} {row['dtype']:<8} {row['rerank_k']:>6} {row['bytes'] / 2**20:>8.2f} "
+            f"{row['batch_ms_p50']:>8.3f} {row['batch_ms_p95']:>8.3f} {row['top1_agreement']:>7.1%} "
+            f"{row['recall_at_10']:>6.1%}"
+        )
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
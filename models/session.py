@@ -0,0 +1,17 @@
+from pydantic import BaseModel
+from typing import Dict, List, Optional, Union
+
+from models.event import Event
+
+class GameSession(BaseModel):
+    session_id: str
+    events: List[Event]
+    # event id -> index of the option the player chose
+    choices: Dict[str, int] = {}
+    # Running end-of-game report and the keys of the decisions folded into it (running_report.decision_key)
+    report_summary: Optional[str] = None
+    summarized_choices: List[str] = []
+    # stage -> calls, prompt_tokens, completion_tokens and cost_usd of the LLM and embedding calls
+    usage: Dict[str, Dict[str, Union[int, float]]] = {}
+    created_at: float
+    updated_at: float
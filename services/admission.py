@@ -0,0 +1,186 @@
+"""
+Admission control for the expensive endpoints.
+
+Each endpoint class (turns, final reports, image generation) gets a concurrency limit and
+a bounded wait queue, configured with ADMISSION_<CLASS>_MAX_CONCURRENT, _MAX_QUEUE,
+_QUEUE_TIMEOUT and _PER_CLIENT. Overload is answered right away with a 429 or 503 and a
+Retry-After header instead of piling more LLM and Seelab calls onto a saturated worker.
+"""
+import asyncio
+import math
+import os
+import time
+from collections import defaultdict, deque
+
+from fastapi import HTTPException, Request
+from fastapi.responses import StreamingResponse
+
+from services.metrics import ADMISSION_ACTIVE, ADMISSION_QUEUE_DEPTH, ADMISSION_REJECTED
+
+
+class AdmissionController:
+    """
+    Concurrency limit with a bounded FIFO wait queue for one class of endpoints.
+
+    Requests beyond `max_concurrent` wait in the queue for at most `queue_timeout`
+    seconds; when the queue is full or the wait times out they are rejected with a 503.
+    With `per_client_limit`, a single client may not hold or wait for more than that many
+    slots at once and is rejected with a 429 instead, so one noisy client cannot starve
+    the others. Limits apply per worker process.
+    """
+
+    def __init__(self, name, max_concurrent, max_queue, queue_timeout, per_client_limit=0):
+        self.name = name
+        self.max_concurrent = max_concurrent
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.per_client_limit = per_client_limit
+        self.active = 0
+        self._waiters = deque()
+        self._clients = defaultdict(int)
+        # Exponential moving average of how long a slot is held, used for Retry-After
+        self._hold_seconds = 1.0
+
+    @classmethod
+    def from_env(cls, name, max_concurrent, max_queue, queue_timeout, per_client_limit=0):
+        """Build a controller whose limits can be overridden by ADMISSION_<NAME>_* env vars."""
+        prefix = f"ADMISSION_{name.upper()}"
+        return cls(
+            name,
+            max_concurrent=int(os.getenv(f"{prefix}_MAX_CONCURRENT", max_concurrent)),
+            max_queue=int(os.getenv(f"{prefix}_MAX_QUEUE", max_queue)),
+            queue_timeout=float(os.getenv(f"{prefix}_QUEUE_TIMEOUT", queue_timeout)),
+            per_client_limit=int(os.getenv(f"{prefix}_PER_CLIENT", per_client_limit)),
+        )
+
+    @property
+    def queue_depth(self):
+        return len(self._waiters)
+
+    def retry_after(self):
+        """Seconds until a slot is likely to free up, from the queue length and mean hold time."""
+        turns = (self.queue_depth + 1) / max(self.max_concurrent, 1)
+        return max(1, math.ceil(turns * self._hold_seconds))
+
+    def _reject(self, status_code, reason, detail):
+        ADMISSION_REJECTED.labels(self.name, reason).inc()
+        raise HTTPException(
+            status_code=status_code, detail=detail, headers={"Retry-After": str(self.retry_after())}
+        )
+
+    def _update_gauges(self):
+        ADMISSION_ACTIVE.labels(self.name).set(self.active)
+        ADMISSION_QUEUE_DEPTH.labels(self.name).set(self.queue_depth)
+
+    async def acquire(self, client, wait=True):
+        """
+        Take a slot for `client`, waiting in the queue if allowed.
+
+        Args:
+            client: Identifier used for per-client fair sharing
+            wait: Queue when no slot is free; otherwise reject immediately
+
+        Returns:
+            float: monotonic time at which the slot was granted (pass it to release)
+
+        Raises:
+            HTTPException: 429 when the client exceeds its share, 503 when overloaded
+        """
+        if self.per_client_limit and self._clients.get(client, 0) >= self.per_client_limit:
+            self._reject(429, "client_limit", f"Too many concurrent {self.name} requests for this client")
+
+        if self.active < self.max_concurrent and not self._waiters:
+            self.active += 1
+            self._clients[client] += 1
+        else:
+            if not wait or self.queue_depth >= self.max_queue:
+                self._reject(503, "queue_full", f"Server is busy ({self.name}), retry later")
+            waiter = asyncio.get_running_loop().create_future()
+            self._waiters.append(waiter)
+            # Queued requests count towards the client's share, and keep counting once granted
+            self._clients[client] += 1
+            self._update_gauges()
+            try:
+                await asyncio.wait_for(asyncio.shield(waiter), self.queue_timeout)
+            except (asyncio.TimeoutError, asyncio.CancelledError) as e:
+                self._forget(client)
+                if waiter.done() and not waiter.cancelled():
+                    # The slot was handed over just as we gave up: pass it on
+                    self._release_slot()
+                else:
+                    waiter.cancel()
+                    self._waiters.remove(waiter)
+                self._update_gauges()
+                if isinstance(e, asyncio.CancelledError):
+                    raise
+                self._reject(503, "queue_timeout", f"Timed out waiting for a {self.name} slot, retry later")
+
+        self._update_gauges()
+        return time.monotonic()
+
+    def _release_slot(self):
+        # Hand the slot straight to the oldest waiter, otherwise free it
+        while self._waiters:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+                return
+        self.active -= 1
+
+    def _forget(self, client):
+        # Drop the client once it holds nothing, so the table does not grow with every caller
+        self._clients[client] -= 1
+        if self._clients[client] <= 0:
+            del self._clients[client]
+
+    def release(self, client, acquired_at):
+        self._hold_seconds = 0.8 * self._hold_seconds + 0.2 * (time.monotonic() - acquired_at)
+        self._forget(client)
+        self._release_slot()
+        self._update_gauges()
+
+
+def client_id(request: Request):
+    """Identify the caller for fair sharing: X-Client-Id header, else the peer address."""
+    return request.headers.get("x-client-id") or (request.client.host if request.client else "unknown")
+
+
+def admit(controller):
+    """
+    FastAPI dependency holding an admission slot for the duration of the request.
+
+    The slot is released once the handler returns, before a StreamingResponse body is
+    sent: streamed endpoints acquire their slot themselves and release it through
+    ClosingStreamingResponse.
+
+    Example:
+        >>> @app.post("/update_events", dependencies=[Depends(admit(turn_admission))])
+    """
+    async def dependency(request: Request):
+        client = client_id(request)
+        acquired_at = await controller.acquire(client)
+        try:
+            yield
+        finally:
+            controller.release(client, acquired_at)
+
+    return dependency
+
+
+class ClosingStreamingResponse(StreamingResponse):
+    """
+    StreamingResponse that awaits `on_close()` once the response is over, whether the body
+    was sent in full, failed, or the client disconnected while it was being streamed.
+    """
+
+    def __init__(self, content, on_close, **kwargs):
+        super().__init__(content, **kwargs)
+        self.on_close = on_close
+
+    async def __call__(self, scope, receive, send):
+        try:
+            await super().__call__(scope, receive, send)
+        finally:
+            if hasattr(self.body_iterator, "aclose"):
+                await self.body_iterator.aclose()
+            await self.on_close()
@@ -0,0 +1,171 @@
+"""
+Content-hashed URLs for the static game assets (starting deck and consequence images).
+
+The manifest maps every file of ASSET_DIRS to a name carrying a hash of its content, e.g.
+data/images/img_2.png -> assets/images/img_2.1f3a9c0e7b2d.png. A hashed URL always names
+the same bytes, so it is served with `Cache-Control: immutable` and a strong ETag, and
+clients only download an asset again when it changes. Build the manifest before starting
+the workers with:
+
+    python -m services.assets
+
+Entries whose file changed since the manifest was written are re-hashed at load time.
+"""
+import hashlib
+import json
+import logging
+import os
+
+from starlette.responses import FileResponse
+
+logger = logging.getLogger(__name__)
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.dirname(__file__)), "data")
+ASSET_MANIFEST_PATH = os.getenv("ASSET_MANIFEST_PATH", os.path.join(DATA_DIR, "asset_manifest.json"))
+# Directories of data/ whose files get hashed URLs
+ASSET_DIRS = ("images", "images_default", "consequences")
+ASSET_URL_PREFIX = "assets/"
+ASSET_CACHE_CONTROL = "public, max-age=31536000, immutable"
+# Hex digits of the content hash kept in file names
+HASH_LENGTH = 12
+
+
+def hash_file(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def hashed_name(relative_path, digest):
+    stem, ext = os.path.splitext(relative_path)
+    return f"{stem}.{digest[:HASH_LENGTH]}{ext}"
+
+
+class AssetManifest:
+    """
+    Source path <-> hashed name of every asset, with the data needed to serve it.
+
+    Entries are keyed by the path the starting deck uses ("data/images/img_2.png") and hold
+    the hashed name, the full sha256 (the ETag) and the size and mtime the hash was taken at.
+    """
+
+    def __init__(self, path=ASSET_MANIFEST_PATH, data_dir=DATA_DIR, dirs=ASSET_DIRS):
+        self.path = path
+        self.data_dir = data_dir
+        self.dirs = dirs
+        self.entries = {}
+        if os.path.exists(path):
+            with open(path, "r") as f:
+                self.entries = json.load(f)["assets"]
+        changed = self.refresh()
+        if changed:
+            logger.info(f"Hashed {changed} new or changed assets (run python -m services.assets at build time)")
+        self.by_name = {entry["name"]: (source, entry) for source, entry in self.entries.items()}
+
+    def __len__(self):
+        return len(self.entries)
+
+    def refresh(self):
+        """Hash the assets that are new or changed on disk, drop the removed ones; returns the number hashed."""
+        entries = {}
+        changed = 0
+        for directory in self.dirs:
+            root = os.path.join(self.data_dir, directory)
+            if not os.path.isdir(root):
+                continue
+            for dirpath, _, filenames in os.walk(root):
+                for filename in sorted(filenames):
+                    full_path = os.path.join(dirpath, filename)
+                    relative_path = os.path.relpath(full_path, self.data_dir).replace(os.sep, "/")
+                    source = f"data/{relative_path}"
+                    stat = os.stat(full_path)
+                    entry = self.entries.get(source)
+                    if entry is None or entry["size"] != stat.st_size or entry["mtime_ns"] != stat.st_mtime_ns:
+                        digest = hash_file(full_path)
+                        entry = {
+                            "name": hashed_name(relative_path, digest),
+                            "sha256": digest,
+                            "size": stat.st_size,
+                            "mtime_ns": stat.st_mtime_ns,
+                        }
+                        changed += 1
+                    entries[source] = entry
+        self.entries = entries
+        return changed
+
+    def save(self):
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump({"assets": self.entries}, f, indent=1)
+        os.replace(tmp_path, self.path)
+
+    def url(self, source):
+        """Hashed URL of an asset, or `source` unchanged when it is not a known asset."""
+        entry = self.entries.get(source)
+        return f"{ASSET_URL_PREFIX}{entry['name']}" if entry else source
+
+    def resolve(self, name):
+        """
+        Find the asset served under a hashed name.
+
+        Returns:
+            tuple[str, str] | None: The file path and its strong ETag
+        """
+        found = self.by_name.get(name)
+        if found is None:
+            return None
+        source, entry = found
+        return os.path.join(self.data_dir, source[len("data/"):]), f'"{entry["sha256"]}"'
+
+    def hashed_event_urls(self, events):
+        """Replace the asset paths of event dicts (event image, option images) with hashed URLs, in place."""
+        for event in events:
+            if event.get("image"):
+                event["image"] = self.url(event["image"])
+            for option in event.get("options", []):
+                if option.get("img"):
+                    option["img"] = self.url(option["img"])
+        return events
+
+
+def etag_matches(if_none_match, etag):
+    if not if_none_match:
+        return False
+    candidates = [candidate.strip() for candidate in if_none_match.split(",")]
+    # Weak comparison, as required for If-None-Match
+    return "*" in candidates or etag in candidates or f"W/{etag}" in candidates
+
+
+class AssetResponse(FileResponse):
+    """
+    FileResponse reading in 1 MiB chunks instead of 64 KiB.
+
+    When the server advertises the ASGI `http.response.pathsend` extension, the path is
+    handed to it instead, so it can send the file itself. uvicorn (which startup.sh runs)
+    does not implement the extension, so under uvicorn the file is always read by the app
+    in chunks and copied through the event loop.
+    """
+
+    chunk_size = 1024 * 1024
+
+    async def __call__(self, scope, receive, send):
+        self.pathsend = "http.response.pathsend" in scope.get("extensions", {})
+        await super().__call__(scope, receive, send)
+
+    async def _handle_simple(self, send, send_header_only):
+        if not self.pathsend or send_header_only:
+            return await super()._handle_simple(send, send_header_only)
+        await send({"type": "http.response.start", "status": self.status_code, "headers": self.raw_headers})
+        await send({"type": "http.response.pathsend", "path": os.fspath(self.path)})
+
+
+def main():
+    manifest = AssetManifest()
+    manifest.save()
+    print(f"✅ Asset manifest holds {len(manifest)} assets: {manifest.path}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,192 @@
+"""
+Pre-generated outcomes of the opening turns.
+
+Every game starts from the starting deck, so the first levels of choices are the same for
+all players. The builder expands the deck into a tree of turns, several variants per
+option, with their images already rendered into the image storage. update_events
+serves a random variant whenever the timeline matches a node of the tree:
+
+    python -m services.branch_tree --depth 2 --variants 3
+"""
+import argparse
+import asyncio
+import copy
+import hashlib
+import json
+import logging
+import os
+import random
+
+from models.event import Event
+from services.create_rag.generate_image import generate_image
+from services.image_storage import get_image_storage
+from services.metrics import record_cache
+from services.turns import generate_turn, load_initial_events, plan_image_tasks
+
+logger = logging.getLogger(__name__)
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.dirname(__file__)), "data")
+BRANCH_TREE_PATH = os.getenv("BRANCH_TREE_PATH", os.path.join(DATA_DIR, "branch_tree.json"))
+
+
+def _field(event, name):
+    return event[name] if isinstance(event, dict) else getattr(event, name)
+
+
+def turn_signature(filtered_events, event_id, option_idx):
+    """
+    Identify a turn by the timeline it starts from and the option chosen.
+
+    Only ids, titles and dates are used, so clients sending the full payload and clients
+    using a server-side session get the same signature for the same game state.
+    """
+    timeline = [[_field(e, "id"), _field(e, "title"), _field(e, "date")] for e in filtered_events]
+    encoded = json.dumps({"timeline": timeline, "choice": [str(event_id), int(option_idx)]}, ensure_ascii=False)
+    return hashlib.sha256(encoded.encode()).hexdigest()[:16]
+
+
+class BranchTree:
+    """Turn variants keyed by turn signature, stored as one JSON file."""
+
+    def __init__(self, path=BRANCH_TREE_PATH):
+        self.path = path
+        self.nodes = {}
+        if os.path.exists(path):
+            with open(path, "r") as f:
+                self.nodes = json.load(f)["nodes"]
+            logger.info(f"Loaded {len(self.nodes)} pre-generated turns from {path}")
+
+    def __len__(self):
+        return len(self.nodes)
+
+    def pick(self, signature):
+        """
+        Return a random pre-generated variant of a turn.
+
+        Args:
+            signature: Signature of the turn (see turn_signature)
+
+        Returns:
+            dict | None: Copy of the variant (events, image_tasks, images), or None if the
+            turn is not in the tree
+        """
+        node = self.nodes.get(signature) if self.nodes else None
+        record_cache("branch_tree", node is not None)
+        if node is None:
+            return None
+        return copy.deepcopy(random.choice(node["variants"]))
+
+    def variants(self, signature):
+        return self.nodes.get(signature, {}).get("variants", [])
+
+    def add_variant(self, signature, variant, depth):
+        node = self.nodes.setdefault(signature, {"depth": depth, "variants": []})
+        node["variants"].append(variant)
+
+    def save(self):
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump({"nodes": self.nodes}, f, ensure_ascii=False)
+        os.replace(tmp_path, self.path)
+
+
+async def render_images(images, storage, semaphore):
+    """Render the images of a variant that are not stored yet; failures are generated at serve time."""
+    async def render(prompt, task_id):
+        if await asyncio.to_thread(storage.exists, task_id):
+            return
+        async with semaphore:
+            try:
+                output_path = storage.spool_path(task_id)
+                await asyncio.to_thread(generate_image, prompt, output_path)
+                await asyncio.to_thread(storage.store, task_id, output_path)
+            except Exception as e:
+                logger.warning(f"Image {task_id} failed: {e}")
+
+    await asyncio.gather(*(render(image["prompt"], image["task_id"]) for image in images))
+
+
+async def build_node(tree, timeline, choices, chosen_index, option_idx, depth, variants, semaphores, storage):
+    """Generate the missing variants of one node and return the (timeline, choices) pairs they lead to."""
+    filtered_events = timeline[:chosen_index + 1]
+    event = filtered_events[-1]
+    signature = turn_signature(filtered_events, event.id, option_idx)
+    option = event.options[option_idx]
+    chosen_option = {"title": option.title, "consequence": option.consequence}
+    choices = {**choices, event.id: option_idx}
+
+    async def build_variant():
+        async with semaphores["turns"]:
+            new_events = await generate_turn(filtered_events, chosen_option, choices=choices)
+        prompts, image_tasks = plan_image_tasks(new_events)
+        images = [{"prompt": prompt, "task_id": task_id} for prompt, task_id in prompts]
+        if storage is not None:
+            await render_images(images, storage, semaphores["images"])
+        tree.add_variant(signature, {"events": new_events, "image_tasks": image_tasks, "images": images}, depth)
+        tree.save()
+        print(f"✅ Turn {signature} (depth {depth}, {event.title[:40]} / option {option_idx})")
+
+    missing = variants - len(tree.variants(signature))
+    results = await asyncio.gather(*(build_variant() for _ in range(max(missing, 0))), return_exceptions=True)
+    for result in results:
+        if isinstance(result, Exception):
+            print(f"⚠️ Turn {signature} variant failed: {result}")
+
+    return [
+        (sorted(filtered_events + [Event.model_validate(e) for e in variant["events"]], key=lambda x: x.date), choices)
+        for variant in tree.variants(signature)
+    ]
+
+
+async def build_tree(tree, depth=1, variants=3, deep_variants=1, concurrency=4, image_concurrency=4, storage=None):
+    """
+    Expand the starting deck into `depth` levels of pre-generated turns.
+
+    Args:
+        tree: BranchTree to complete (existing variants are kept, so builds resume)
+        depth: Number of turn levels to pre-generate
+        variants: Variants per option of the first level
+        deep_variants: Variants per option of deeper levels
+        concurrency: Turns generated at once
+        image_concurrency: Images rendered at once
+        storage: ImageStorage the images of every variant are rendered into (None skips rendering)
+    """
+    semaphores = {"turns": asyncio.Semaphore(concurrency), "images": asyncio.Semaphore(image_concurrency)}
+    deck = sorted((Event.model_validate(e) for e in load_initial_events()), key=lambda x: x.date)
+    # Timelines to expand at the current level, with the choices made so far
+    frontier = [(deck, {})]
+    deck_ids = {e.id for e in deck}
+    for level in range(1, depth + 1):
+        jobs = [
+            build_node(tree, timeline, choices, index, option_idx, level,
+                       variants if level == 1 else deep_variants, semaphores, storage)
+            for timeline, choices in frontier
+            # Deeper levels only branch on generated events: the deck nodes are already built
+            for index, event in enumerate(timeline) if level == 1 or event.id not in deck_ids
+            for option_idx in range(len(event.options))
+        ]
+        print(f"⏳ Level {level}: {len(jobs)} turns")
+        frontier = [branch for branches in await asyncio.gather(*jobs) for branch in branches]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Pre-generate the opening turns of the game")
+    parser.add_argument("--output", default=BRANCH_TREE_PATH)
+    parser.add_argument("--depth", type=int, default=1, help="Turn levels to pre-generate")
+    parser.add_argument("--variants", type=int, default=3, help="Variants per option at the first level")
+    parser.add_argument("--deep-variants", type=int, default=1, help="Variants per option at deeper levels")
+    parser.add_argument("--concurrency", type=int, default=4, help="Turns generated at once")
+    parser.add_argument("--image-concurrency", type=int, default=4, help="Images rendered at once")
+    parser.add_argument("--no-images", action="store_true", help="Skip rendering (images are generated when served)")
+    args = parser.parse_args()
+
+    tree = BranchTree(args.output)
+    storage = None if args.no_images else get_image_storage()
+    asyncio.run(build_tree(tree, args.depth, args.variants, args.deep_variants, args.concurrency,
+                           args.image_concurrency, storage=storage))
+    tree.save()
+    print(f"Branch tree holds {len(tree)} turns")
+
+
+if __name__ == "__main__":
+    main()
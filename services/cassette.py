@@ -0,0 +1,145 @@
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from collections import defaultdict
+
+logger = logging.getLogger(__name__)
+
+# off: call providers normally, record: call providers and append every exchange to the
+# cassette, replay: serve exchanges from the cassette without any network access
+CASSETTE_MODE = os.getenv("CASSETTE_MODE", "off")
+CASSETTE_PATH = os.getenv(
+    "CASSETTE_PATH",
+    os.path.join(os.path.dirname(os.path.dirname(__file__)), "data", "cassettes", "cassette.jsonl"),
+)
+# Multiplier applied to recorded latencies on replay (0 replays instantly)
+CASSETTE_LATENCY_SCALE = float(os.getenv("CASSETTE_LATENCY_SCALE", 1.0))
+
+
+class CassetteMiss(KeyError):
+    """Raised in replay mode when a request was never recorded."""
+
+
+def request_key(kind, payload):
+    """Stable hash of a provider request, used to match replays with recordings."""
+    encoded = json.dumps(payload, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha256(f"{kind}:{encoded}".encode()).hexdigest()
+
+
+class Cassette:
+    """
+    JSONL recording of provider exchanges (LLM completions, embeddings, Seelab images).
+
+    Each line holds the request kind and key, the request payload, the response and the
+    time the provider took. Binary media are stored next to the cassette in `<path>.media/`.
+    When a key was recorded several times (hedged calls, repeated turns) the recordings
+    are replayed in turn.
+    """
+
+    def __init__(self, path=CASSETTE_PATH, mode=CASSETTE_MODE, latency_scale=CASSETTE_LATENCY_SCALE):
+        if mode not in ("off", "record", "replay"):
+            raise ValueError(f"Unknown cassette mode: {mode}")
+        self.path = path
+        self.mode = mode
+        self.latency_scale = latency_scale
+        self.media_dir = f"{path}.media"
+        self._lock = threading.Lock()
+        self._entries = None
+        self._cursors = defaultdict(int)
+
+    @property
+    def enabled(self):
+        return self.mode != "off"
+
+    def _load(self):
+        entries = defaultdict(list)
+        with open(self.path, "r") as f:
+            for line in f:
+                if line.strip():
+                    entry = json.loads(line)
+                    entries[entry["key"]].append(entry)
+        logger.info(f"Loaded {sum(len(v) for v in entries.values())} exchanges from {self.path}")
+        return entries
+
+    def lookup(self, kind, payload):
+        key = request_key(kind, payload)
+        with self._lock:
+            if self._entries is None:
+                self._entries = self._load()
+            recordings = self._entries.get(key)
+            if not recordings:
+                raise CassetteMiss(f"No recorded {kind} exchange for key {key[:12]}")
+            entry = recordings[self._cursors[key] % len(recordings)]
+            self._cursors[key] += 1
+        return entry
+
+    def record(self, kind, payload, response, seconds):
+        entry = {
+            "kind": kind,
+            "key": request_key(kind, payload),
+            "request": payload,
+            "response": response,
+            "seconds": seconds,
+            "recorded_at": time.time(),
+        }
+        line = json.dumps(entry, ensure_ascii=False, default=str)
+        with self._lock:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            with open(self.path, "a") as f:
+                f.write(line + "\n")
+
+    def save_media(self, data):
+        name = hashlib.sha256(data).hexdigest()
+        os.makedirs(self.media_dir, exist_ok=True)
+        path = os.path.join(self.media_dir, name)
+        if not os.path.exists(path):
+            with open(path, "wb") as f:
+                f.write(data)
+        return name
+
+    def load_media(self, name):
+        with open(os.path.join(self.media_dir, name), "rb") as f:
+            return f.read()
+
+    def call(self, kind, payload, fn, encode=lambda r: r, decode=lambda r: r):
+        """
+        Run a blocking provider call through the cassette.
+
+        Args:
+            kind: Exchange type ("llm", "embedding", "seelab_image")
+            payload: JSON-serializable request identifying the exchange
+            fn: Zero-argument callable performing the real call
+            encode: Converts the real response to something JSON-serializable
+            decode: Rebuilds the response from its recorded form
+
+        Returns:
+            The provider response, live or replayed
+        """
+        if self.mode == "replay":
+            entry = self.lookup(kind, payload)
+            time.sleep(entry["seconds"] * self.latency_scale)
+            return decode(entry["response"])
+        start = time.perf_counter()
+        response = fn()
+        if self.mode == "record":
+            self.record(kind, payload, encode(response), time.perf_counter() - start)
+        return response
+
+    async def acall(self, kind, payload, fn, encode=lambda r: r, decode=lambda r: r):
+        """Async counterpart of `call`; `fn` returns an awaitable."""
+        if self.mode == "replay":
+            entry = self.lookup(kind, payload)
+            await asyncio.sleep(entry["seconds"] * self.latency_scale)
+            return decode(entry["response"])
+        start = time.perf_counter()
+        response = await fn()
+        if self.mode == "record":
+            self.record(kind, payload, encode(response), time.perf_counter() - start)
+        return response
+
+
+cassette = Cassette()
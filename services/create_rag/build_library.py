@@ -0,0 +1,174 @@
+"""
+Build the RAG image library from events.yaml with bounded concurrency across the Seelab key pool.
+
+Progress is kept in a manifest of completed ids and checksums, so an interrupted or
+partially failed run resumes where it stopped:
+
+    python -m services.create_rag.build_library --concurrency-per-key 2
+    python -m services.create_rag.build_library --ids 12,57 --force
+"""
+import argparse
+import asyncio
+import hashlib
+import json
+import os
+import time
+
+import yaml
+
+from services.create_rag.generate_image import SEELAB_API_KEYS, generate_image_with_key
+
+EVENTS_PATH = "services/create_rag/events.yaml"
+OUTPUT_DIRECTORY = "services/create_rag/rag"
+MANIFEST_NAME = "manifest.json"
+
+
+def build_prompt(event):
+    return f"{event['name']}: {event['description']}"
+
+
+def file_checksum(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class Manifest:
+    """Completed image ids with their checksum, plus the last error of failed ids."""
+
+    def __init__(self, path):
+        self.path = path
+        self.completed = {}
+        self.failed = {}
+        if os.path.exists(path):
+            with open(path, "r") as f:
+                data = json.load(f)
+            self.completed = data.get("completed", {})
+            self.failed = data.get("failed", {})
+
+    def save(self):
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump({"completed": self.completed, "failed": self.failed}, f, indent=2, sort_keys=True)
+        os.replace(tmp_path, self.path)
+
+    def mark_completed(self, event_id, checksum, seconds):
+        self.completed[str(event_id)] = {"sha256": checksum, "seconds": round(seconds, 2)}
+        self.failed.pop(str(event_id), None)
+        self.save()
+
+    def mark_failed(self, event_id, error):
+        self.failed[str(event_id)] = error
+        self.save()
+
+
+def is_done(manifest, event_id, image_path, verify):
+    """An image is done when it exists and, if checked, matches the manifest checksum."""
+    entry = manifest.completed.get(str(event_id))
+    if entry is None or not os.path.exists(image_path):
+        return False
+    return not verify or file_checksum(image_path) == entry["sha256"]
+
+
+async def build_one(event, image_path, key_pool, manifest, retries):
+    prompt = build_prompt(event)
+    tmp_path = f"{image_path}.part"
+    last_error = None
+    for attempt in range(retries + 1):
+        api_key = await key_pool.get()
+        start = time.monotonic()
+        try:
+            await asyncio.to_thread(generate_image_with_key, api_key, prompt, tmp_path)
+        except Exception as e:
+            last_error = f"{type(e).__name__}: {e}"
+            print(f"⚠️ Image {event['id']} attempt {attempt + 1} failed: {last_error}")
+            continue
+        finally:
+            key_pool.put_nowait(api_key)
+        os.replace(tmp_path, image_path)
+        manifest.mark_completed(event["id"], await asyncio.to_thread(file_checksum, image_path),
+                                time.monotonic() - start)
+        print(f"✅ Generated image for event {event['id']}")
+        return True
+    manifest.mark_failed(event["id"], last_error)
+    return False
+
+
+async def build_library(events, output_dir, concurrency_per_key=1, retries=2, verify=False, force=False):
+    """
+    Generate the missing images of the library.
+
+    Every Seelab key may run `concurrency_per_key` generations at once; a failed
+    generation is retried on the next free key instead of aborting the build.
+
+    Args:
+        events: Entries of events.yaml
+        output_dir: Directory receiving image_{id}.png and the manifest
+        concurrency_per_key: Concurrent generations allowed per API key
+        retries: Extra attempts per image after a failure
+        verify: Re-check the checksum of existing images before skipping them
+        force: Regenerate images even if they are already in the manifest
+
+    Returns:
+        tuple[int, int, int]: Number of generated, skipped and failed images
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    manifest = Manifest(os.path.join(output_dir, MANIFEST_NAME))
+
+    key_pool = asyncio.Queue()
+    for api_key in SEELAB_API_KEYS:
+        for _ in range(concurrency_per_key):
+            key_pool.put_nowait(api_key)
+
+    todo = []
+    skipped = 0
+    for event in events:
+        image_path = os.path.join(output_dir, f"image_{event['id']}.png")
+        if not force and is_done(manifest, event["id"], image_path, verify):
+            skipped += 1
+            continue
+        if not force and str(event["id"]) not in manifest.completed and os.path.exists(image_path):
+            # Image produced by an earlier, manifest-less run: adopt it
+            manifest.completed[str(event["id"])] = {"sha256": file_checksum(image_path), "seconds": None}
+            skipped += 1
+            continue
+        todo.append((event, image_path))
+    manifest.save()
+
+    print(f"⏳ {len(todo)} images to generate, {skipped} already done")
+    results = await asyncio.gather(
+        *(build_one(event, image_path, key_pool, manifest, retries) for event, image_path in todo)
+    )
+    generated = sum(results)
+    return generated, skipped, len(results) - generated
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build the RAG image library")
+    parser.add_argument("--events", default=EVENTS_PATH)
+    parser.add_argument("--output", default=OUTPUT_DIRECTORY)
+    parser.add_argument("--concurrency-per-key", type=int, default=1)
+    parser.add_argument("--retries", type=int, default=2)
+    parser.add_argument("--ids", help="Comma-separated event ids to build (default: all)")
+    parser.add_argument("--verify", action="store_true", help="Verify checksums of existing images")
+    parser.add_argument("--force", action="store_true", help="Regenerate selected images")
+    args = parser.parse_args()
+
+    with open(args.events, "r") as f:
+        events = [event for event in yaml.safe_load(f) if event["id"] >= 0]
+    if args.ids:
+        wanted = {int(event_id) for event_id in args.ids.split(",")}
+        events = [event for event in events if event["id"] in wanted]
+
+    generated, skipped, failed = asyncio.run(
+        build_library(events, args.output, args.concurrency_per_key, args.retries, args.verify, args.force)
+    )
+    print(f"Generated {generated}, skipped {skipped}, failed {failed}")
+    if failed:
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,64 +1,33 @@
-import openai
-import yaml
 import numpy as np
-import os
-from sklearn.metrics.pairwise import cosine_similarity
-from dotenv import load_dotenv
 from starlette.concurrency import run_in_threadpool
 import asyncio
-
-load_dotenv()
-openai.api_key = os.getenv("OPENAI_API_KEY")
-
-YAML_PATH = "services/create_rag/events.yaml"
-CACHE_PATH = "services/create_rag/image_embeddings.npz"
-
-# Load YAML data
-def load_events(yaml_path):
-    with open(yaml_path, "r") as f:
-        return yaml.safe_load(f)
-
-
-# Embed list of texts with OpenAI (batched)
-def get_embeddings(texts, model="text-embedding-3-small"):
-    texts = [text.replace("\n", " ") for text in texts]
-    response = openai.embeddings.create(input=texts, model=model)
-    return np.array([r.embedding for r in response.data])
-
-# Generate or load cached embeddings
-def generate_or_load_embeddings(events, cache_path):
-    if os.path.exists(cache_path):
-        print("✅ Loading cached embeddings...")
-        cache = np.load(cache_path, allow_pickle=True)
-        embeddings = cache["embeddings"]
-        ids = cache["ids"]
-        # Validate match with current events
-        if len(ids) == len(events):
-            return embeddings, ids
-        else:
-            print("⚠️ Cache mismatch. Recomputing embeddings...")
-
-    print("⏳ Generating new embeddings...")
-
-    def get_year(event):
-        text = event.get("year", "")
-        if text != "":
-            text = "Year: " + str(text) + ". "
-        return text
-
-    texts = [get_year(e) + f"{e['name']}: {e['description']}" for e in events]
-    embeddings = get_embeddings(texts)
-    ids = np.array([e["id"] for e in events])
-    np.savez(cache_path, embeddings=embeddings, ids=ids)
-    return embeddings, ids
+from services.create_rag.embedding_cache import (
+    CACHE_PATH,
+    EMBEDDING_MODEL,
+    INDEX_PREFIX,
+    YAML_PATH,
+    corpus_fingerprint,
+    generate_or_load_embeddings,
+    get_embeddings,
+    load_events,
+)
+from services.http_clients import aembed
+from services.metrics import time_stage
+from services.shared_index import cosine_scores, load_or_build_index, unique_best_indices
 
 events = load_events(YAML_PATH)
-embeddings, ids = generate_or_load_embeddings(events, CACHE_PATH)
+ids = np.array([e["id"] for e in events])
+# Normalized, memory-mapped copy of the embeddings shared by every worker process
+embeddings = load_or_build_index(
+    INDEX_PREFIX,
+    corpus_fingerprint(events),
+    lambda: generate_or_load_embeddings(events, CACHE_PATH)[0],
+)
 
 # Find closest event by embedding
 def find_closest_event_id(description):
     query_vec = get_embeddings([description])[0]
-    similarities = cosine_similarity([query_vec], embeddings)
+    similarities = cosine_scores(embeddings, [query_vec])
     best_index = int(similarities.argmax())
     return int(ids[best_index])
 
@@ -80,26 +49,23 @@ def find_closest_event_ids(descriptions):
         List of event IDs in the same order as the input descriptions
     """
     # Get embeddings for all descriptions at once
-    query_vecs = get_embeddings(descriptions)
-    
+    return match_event_ids(get_embeddings(descriptions))
+
+def match_event_ids(query_vecs, exclude_ids=()):
+    """
+    Pick the closest event for each query vector, never the same event twice.
+
+    Args:
+        query_vecs: Embeddings of the descriptions
+        exclude_ids: Event IDs already taken by other entries of the batch
+
+    Returns:
+        List of event IDs in the same order as the query vectors
+    """
     # Compute similarities with the database for all at once
-    similarities = cosine_similarity(query_vecs, embeddings)
-    
-    # Track already used indices to avoid duplicates
-    used_indices = set()
-    best_indices = []
-    
-    # For each query, find the best unused index
-    for i in range(len(descriptions)):
-        # Get indices sorted by similarity (highest to lowest)
-        sorted_indices = similarities[i].argsort()[::-1]
-        
-        # Find the first index that hasn't been used yet
-        for idx in sorted_indices:
-            if idx not in used_indices:
-                best_indices.append(idx)
-                used_indices.add(idx)
-                break
+    similarities = cosine_scores(embeddings, query_vecs)
+    used_indices = np.flatnonzero(np.isin(ids, list(exclude_ids))) if exclude_ids else ()
+    best_indices = unique_best_indices(similarities, used_indices)
     
     # Convert to event IDs
     event_ids = [int(ids[idx]) for idx in best_indices]
@@ -109,8 +75,13 @@ def find_closest_event_ids(descriptions):
 async def find_closest_event_ids_async(descriptions):
     """
     Async version of find_closest_event_ids that doesn't block the event loop.
+    The embedding request goes through the shared async client, scoring the
+    memory-mapped index takes a few milliseconds and runs inline.
     """
-    return await run_in_threadpool(find_closest_event_ids, descriptions)
+    with time_stage("image_retrieval"):
+        if not descriptions:
+            return []
+        return match_event_ids(np.array(await aembed(descriptions, EMBEDDING_MODEL)))
 
 # Main logic
 if __name__ == "__main__":
@@ -0,0 +1,158 @@
+"""
+Content-addressed cache of the image corpus embeddings.
+
+Each cached vector is stored with the event id and a hash of the embedded text, so only
+added or edited events are embedded again and deleted ones are dropped. To rebuild the
+whole index and its shared retrieval copy from scratch (written atomically):
+
+    python -m services.create_rag.embedding_cache --rebuild
+"""
+import argparse
+import hashlib
+import os
+
+import numpy as np
+import openai
+import yaml
+from dotenv import load_dotenv
+
+from services.cassette import cassette
+from services.metrics import record_cache, time_stage
+from services.usage import record_usage
+from services.shared_index import load_or_build_index
+
+load_dotenv()
+openai.api_key = os.getenv("OPENAI_API_KEY")
+
+YAML_PATH = "services/create_rag/events.yaml"
+CACHE_PATH = "services/create_rag/image_embeddings.npz"
+# Prefix of the memory-mapped retrieval index derived from the cache (see services/shared_index.py)
+INDEX_PREFIX = "services/create_rag/image_index"
+EMBEDDING_MODEL = "text-embedding-3-small"
+# Texts sent per embeddings request when (re)building the cache
+EMBEDDING_BATCH_SIZE = int(os.getenv("EMBEDDING_BATCH_SIZE", 256))
+
+
+# Load YAML data
+def load_events(yaml_path):
+    with open(yaml_path, "r") as f:
+        return yaml.safe_load(f)
+
+
+# Embed list of texts with OpenAI (batched)
+def get_embeddings(texts, model=EMBEDDING_MODEL):
+    texts = [text.replace("\n", " ") for text in texts]
+
+    def embed():
+        response = openai.embeddings.create(input=texts, model=model)
+        record_usage("embedding", model, response.usage.prompt_tokens)
+        return [r.embedding for r in response.data]
+
+    with time_stage("embedding"):
+        vectors = cassette.call("embedding", {"model": model, "input": texts}, embed)
+    return np.array(vectors)
+
+
+def event_text(event):
+    """Text embedded for an events.yaml entry."""
+    year = event.get("year", "")
+    prefix = f"Year: {year}. " if year != "" else ""
+    return prefix + f"{event['name']}: {event['description']}"
+
+
+def content_hash(text, model=EMBEDDING_MODEL):
+    return hashlib.sha256(f"{model}\n{text}".encode()).hexdigest()[:16]
+
+
+def corpus_fingerprint(events):
+    """Short digest of every (id, content hash) pair, identifying one version of the corpus."""
+    digest = hashlib.sha256()
+    for event in events:
+        digest.update(f"{event['id']}:{content_hash(event_text(event))}\n".encode())
+    return digest.hexdigest()[:16]
+
+
+def save_cache(cache_path, embeddings, ids, hashes):
+    """Write the cache next to its final path and swap it in, so readers never see a partial file."""
+    tmp_path = f"{cache_path}.tmp.npz"
+    np.savez(tmp_path, embeddings=embeddings, ids=ids, hashes=hashes)
+    os.replace(tmp_path, cache_path)
+
+
+def embed_in_batches(texts, batch_size=EMBEDDING_BATCH_SIZE):
+    batches = [get_embeddings(texts[i:i + batch_size]) for i in range(0, len(texts), batch_size)]
+    return np.vstack(batches)
+
+
+# Generate or load cached embeddings
+def generate_or_load_embeddings(events, cache_path, rebuild=False):
+    """
+    Return embeddings and ids aligned with `events`, embedding only what changed.
+
+    Args:
+        events: Entries of events.yaml
+        cache_path: Path of the .npz cache
+        rebuild: Ignore the cache and embed every event again
+
+    Returns:
+        tuple[np.ndarray, np.ndarray]: Embedding matrix and the matching event ids
+    """
+    texts = [event_text(e) for e in events]
+    ids = np.array([e["id"] for e in events])
+    hashes = np.array([content_hash(text) for text in texts])
+
+    cached_rows = {}
+    cached_embeddings = None
+    if os.path.exists(cache_path) and not rebuild:
+        print("✅ Loading cached embeddings...")
+        cache = np.load(cache_path)
+        if "hashes" in cache:
+            cached_embeddings = cache["embeddings"]
+            cached_rows = {
+                (int(event_id), str(digest)): row
+                for row, (event_id, digest) in enumerate(zip(cache["ids"], cache["hashes"]))
+            }
+        else:
+            print("⚠️ Cache has no content hashes. Recomputing embeddings...")
+
+    rows = [cached_rows.get((int(event_id), str(digest))) for event_id, digest in zip(ids, hashes)]
+    missing = [i for i, row in enumerate(rows) if row is None]
+    record_cache("image_embeddings", not missing)
+
+    if not missing and len(cached_rows) == len(events) and rows == list(range(len(rows))):
+        # Cache is exactly up to date
+        return cached_embeddings, ids
+
+    print(f"⏳ Embedding {len(missing)} new or changed events...")
+    new_vectors = embed_in_batches([texts[i] for i in missing]) if missing else None
+    dim = new_vectors.shape[1] if new_vectors is not None else cached_embeddings.shape[1]
+    embeddings = np.empty((len(events), dim))
+    for i, row in enumerate(rows):
+        if row is not None:
+            embeddings[i] = cached_embeddings[row]
+    if missing:
+        embeddings[missing] = new_vectors
+
+    dropped = len(cached_rows) - (len(rows) - len(missing))
+    if dropped:
+        print(f"🗑️ Dropped {dropped} stale embeddings")
+    save_cache(cache_path, embeddings, ids, hashes)
+    return embeddings, ids
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Update or rebuild the image embeddings cache")
+    parser.add_argument("--events", default=YAML_PATH)
+    parser.add_argument("--cache", default=CACHE_PATH)
+    parser.add_argument("--rebuild", action="store_true", help="Re-embed every event")
+    args = parser.parse_args()
+
+    events = load_events(args.events)
+    embeddings, ids = generate_or_load_embeddings(events, args.cache, rebuild=args.rebuild)
+    if args.cache == CACHE_PATH:
+        load_or_build_index(INDEX_PREFIX, corpus_fingerprint(events), lambda: embeddings, force=args.rebuild)
+    print(f"Index holds {len(ids)} embeddings of dimension {embeddings.shape[1]}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,10 +1,12 @@
 import requests
 import time
-import sys
 import os
 
 from dotenv import load_dotenv
 
+from services.cassette import cassette
+from services.metrics import time_stage
+
 load_dotenv()
 
 # Load all API keys
@@ -16,17 +18,18 @@ SEELAB_API_KEYS = [
 ]
 assert all(key is not None for key in SEELAB_API_KEYS), "One or more API keys are None"
 
-API_URL = "https://app.seelab.ai/api/predict"
-POLLING_INTERVAL = 3
+API_URL = os.getenv("SEELAB_API_URL", "https://app.seelab.ai/api/predict")
+POLLING_INTERVAL = float(os.getenv("SEELAB_POLLING_INTERVAL", 3))
 
 
 def initiate_image_generation(api_key, prompt):
-    response = requests.post(
-        url=f"{API_URL}/text-to-image",
-        json={"params": {'prompt': prompt}},
-        headers={"Authorization": f"Token {api_key}"}
-    )
-    response.raise_for_status()
+    with time_stage("seelab_initiate"):
+        response = requests.post(
+            url=f"{API_URL}/text-to-image",
+            json={"params": {'prompt': prompt}},
+            headers={"Authorization": f"Token {api_key}"}
+        )
+        response.raise_for_status()
     session = response.json()
     return session['id']
 
@@ -51,20 +54,50 @@ def poll_image_status(api_key, session_id):
 
 
 def generate_image(prompt, output_path):
-    for api_key in SEELAB_API_KEYS:
-        try:
-            session_id = initiate_image_generation(api_key, prompt)
-            image_url = poll_image_status(api_key, session_id)
+    if not cassette.enabled:
+        return _generate_image(prompt, output_path)
+
+    def generate_and_read():
+        _generate_image(prompt, output_path)
+        with open(output_path, "rb") as file:
+            return file.read()
+
+    image = cassette.call(
+        "seelab_image",
+        {"prompt": prompt},
+        generate_and_read,
+        encode=cassette.save_media,
+        decode=cassette.load_media,
+    )
+    if cassette.mode == "replay":
+        output_dir = os.path.dirname(output_path)
+        if output_dir:
+            os.makedirs(output_dir, exist_ok=True)
+        with open(output_path, "wb") as file:
+            file.write(image)
+
+
+def generate_image_with_key(api_key, prompt, output_path):
+    session_id = initiate_image_generation(api_key, prompt)
+    with time_stage("seelab_poll"):
+        image_url = poll_image_status(api_key, session_id)
+
+    output_dir = os.path.dirname(output_path)
+    if output_dir and not os.path.exists(output_dir):
+        os.makedirs(output_dir, exist_ok=True)
+        print(f"Created directory: {output_dir}")
+
+    with time_stage("seelab_download"):
+        response = requests.get(image_url)
+        response.raise_for_status()
+        with open(output_path, "wb") as file:
+            file.write(response.content)
 
-            output_dir = os.path.dirname(output_path)
-            if output_dir and not os.path.exists(output_dir):
-                os.makedirs(output_dir)
-                print(f"Created directory: {output_dir}")
 
-            response = requests.get(image_url)
-            response.raise_for_status()
-            with open(output_path, "wb") as file:
-                file.write(response.content)
+def _generate_image(prompt, output_path):
+    for api_key in SEELAB_API_KEYS:
+        try:
+            generate_image_with_key(api_key, prompt, output_path)
             return  # Return after successful image generation
         except requests.HTTPError as http_err:
             print(f"HTTP error occurred with API key {api_key}: {http_err}")
@@ -72,7 +105,7 @@ def generate_image(prompt, output_path):
             print(f"Runtime error with API key {api_key}: {runtime_err}")
         except Exception as err:
             print(f"An unexpected error occurred with API key {api_key}: {err}")
-    sys.exit(1)  # Exit if all API keys fail
+    raise RuntimeError("All API keys failed")
 
 
 async def generate_image_async(prompt: str, output_path: str):
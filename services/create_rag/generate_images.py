@@ -1,7 +1,7 @@
 import yaml
 import os
 
-from generate_image import generate_image  # Assuming this function is defined in a separate module
+from services.create_rag.generate_image import generate_image
 
 # Assuming generate_image is defined elsewhere and properly imported
 # from image_generator import generate_image
@@ -44,7 +44,7 @@ def save_dict_to_yaml(data: dict, file_path: str):
         yaml.dump(data, f, default_flow_style=False, sort_keys=False)
 
 
-def generate_images_from_cycles(cycle):
+def generate_images_from_cycles(cycles):
     output_dir = "data/rag"
     if not os.path.exists(output_dir):
         os.makedirs(output_dir, exist_ok=True)
@@ -0,0 +1,184 @@
+"""
+Validation of generated turns against the Event/Option models, with targeted repair.
+
+A turn must hold EVENTS_PER_TURN events with OPTIONS_PER_EVENT options each. Instead of
+rerunning the whole generation chain when the model gets the shape wrong, only the
+missing or invalid events and options are regenerated in one small call and merged into
+the valid ones.
+"""
+import logging
+
+from pydantic import ValidationError
+
+from models.event import Event, Option
+from services.llm_router import routed_completion
+from services.metrics import time_stage
+from utils.parse_llm_output import parse_json_markdown
+
+logger = logging.getLogger(__name__)
+
+# Shape the client expects from every turn
+EVENTS_PER_TURN = 3
+OPTIONS_PER_EVENT = 2
+
+
+def _as_list(value):
+    # Models often return a single string where the schema asks for a list of paragraphs
+    return [value] if isinstance(value, str) else value
+
+
+def normalize_event(raw):
+    """Coerce the string-instead-of-list mistakes of a raw generated event."""
+    if not isinstance(raw, dict):
+        return raw
+    event = dict(raw)
+    event["description"] = _as_list(event.get("description"))
+    if isinstance(event.get("options"), list):
+        event["options"] = [
+            {**option, "consequence": _as_list(option.get("consequence"))} if isinstance(option, dict) else option
+            for option in event["options"]
+        ]
+    return event
+
+
+def valid_options(options):
+    """Options that match the Option model, trimmed to OPTIONS_PER_EVENT."""
+    valid = []
+    for option in options if isinstance(options, list) else []:
+        try:
+            valid.append(Option.model_validate(option).model_dump(include={"title", "consequence"}))
+        except ValidationError:
+            continue
+    return valid[:OPTIONS_PER_EVENT]
+
+
+def check_events(raw_events):
+    """
+    Validate generated events against the Event/Option models.
+
+    Args:
+        raw_events: The "events" value of the parsed model output
+
+    Returns:
+        tuple[list, dict, dict]: The events (None where missing or invalid), index -> reason
+        of each event to regenerate, and index -> number of options still needed
+    """
+    raw_events = raw_events if isinstance(raw_events, list) else []
+    events, broken, missing_options = [], {}, {}
+    for index in range(EVENTS_PER_TURN):
+        raw = normalize_event(raw_events[index]) if index < len(raw_events) else None
+        if not isinstance(raw, dict):
+            broken[index] = "missing"
+            events.append(None)
+            continue
+        try:
+            # Ids are assigned after validation; options are checked one by one below
+            event = Event.model_validate({**raw, "id": "0", "options": []})
+        except ValidationError as e:
+            broken[index] = f"invalid ({e.error_count()} errors)"
+            events.append(None)
+            continue
+        event = event.model_dump(include={"title", "date", "description"})
+        event["options"] = valid_options(raw.get("options"))
+        if len(event["options"]) < OPTIONS_PER_EVENT:
+            missing_options[index] = OPTIONS_PER_EVENT - len(event["options"])
+        events.append(event)
+    return events, broken, missing_options
+
+
+async def repair_events(narrative_arc, events, broken, missing_options):
+    """
+    Regenerate only the broken events and missing options in one small call and merge them.
+
+    Args:
+        narrative_arc: Narrative arc the events were extracted from
+        events: Events returned by check_events
+        broken: Indexes of the events to regenerate, with the reason
+        missing_options: Indexes of the events lacking options, with the number missing
+
+    Returns:
+        list: The merged events, still to be checked with check_events
+    """
+    needed = [
+        f"- events[{index}] is {reason}: write the full event (title, date, description, {OPTIONS_PER_EVENT} options)"
+        for index, reason in broken.items()
+    ] + [
+        f"- events[{index}] \"{events[index]['title']}\" ({events[index]['date']}) needs {count} more option(s)"
+        for index, count in missing_options.items()
+    ]
+    kept = [f"- events[{index}]: {event['date']} {event['title']}" for index, event in enumerate(events) if event]
+    system_message = {
+        "role": "system",
+        "content": f"""
+        We are working on uchronia, a game that displays a chronological timeline, with events and we allow our users to change the course of history.
+        Events were extracted from a narrative arc but some parts are missing or invalid. Write only the missing parts.
+
+        Output a JSON object with the following structure:
+        {{
+            "events": {{"<index>": {{"title": "string", "date": "YYYY-MM-DD", "description": ["string"], "options": [{{"title": "string", "consequence": ["string"]}}]}}}},
+            "options": {{"<index>": [{{"title": "string", "consequence": ["string"]}}]}}
+        }}
+        Notes:
+        - Don't output any text other than the JSON. Output should be in French
+        - Each event has exactly {OPTIONS_PER_EVENT} options; option titles start with a verb
+        - Descriptions and consequences are lists of 2-3 paragraphs of 2-3 lines
+        - The options should produce unexpected consequences with a twist
+        """,
+    }
+    user_message = {
+        "role": "user",
+        "content": f"""
+        Narrative Arc: {narrative_arc}
+
+        Valid events:
+        {chr(10).join(kept) or "(none)"}
+
+        Missing parts:
+        {chr(10).join(needed)}
+        """,
+    }
+    completion = await routed_completion(
+        "repair_events",
+        [system_message, user_message],
+        temperature=0.7,
+        validate=lambda content: isinstance(parse_json_markdown(content), dict),
+    )
+    repair = parse_json_markdown(completion.choices[0].message.content)
+    new_events = repair.get("events") if isinstance(repair.get("events"), dict) else {}
+    new_options = repair.get("options") if isinstance(repair.get("options"), dict) else {}
+
+    merged = list(events)
+    for index in broken:
+        merged[index] = new_events.get(str(index))
+    for index in missing_options:
+        merged[index] = {
+            **merged[index],
+            "options": merged[index]["options"] + valid_options(normalize_event(
+                {"options": new_options.get(str(index))}
+            ).get("options")),
+        }
+    return merged
+
+
+async def validated_events(narrative_arc, raw_events):
+    """
+    Return the complete events of a turn, repairing missing or invalid parts if needed.
+
+    Events that are still incomplete after the repair are dropped.
+
+    Raises:
+        ValueError: If no complete event could be produced
+    """
+    events, broken, missing_options = check_events(raw_events)
+    if broken or missing_options:
+        logger.warning(f"Repairing generated events: broken={broken}, missing options={missing_options}")
+        try:
+            with time_stage("repair_events"):
+                repaired = await repair_events(narrative_arc, events, broken, missing_options)
+            events, _, _ = check_events(repaired)
+        except Exception as e:
+            logger.warning(f"Event repair failed, keeping the valid events: {e}")
+    complete = [event for event in events if event and len(event["options"]) == OPTIONS_PER_EVENT]
+    if not complete:
+        raise ValueError("The model did not produce any complete event")
+    return complete
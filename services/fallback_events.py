@@ -0,0 +1,279 @@
+"""
+Library of ready-made events served when the LLM pipeline misses the turn latency budget.
+
+The library is derived from the starting deck and the image corpus (events.yaml): the
+corpus entries are rewritten once into French game events with two options, and get
+their images and music from the existing retrieval. Entries are indexed by theme and era
+so a degraded turn still follows the chosen option with later, related events:
+
+    python -m services.fallback_events --batch-size 10 --concurrency 4
+"""
+import argparse
+import asyncio
+import copy
+import json
+import logging
+import os
+import random
+import re
+from collections import defaultdict
+
+import yaml
+
+from models.event import Event
+from services.event_repair import OPTIONS_PER_EVENT, normalize_event, valid_options
+from services.llm_router import routed_completion
+from services.turns import IMAGE_URL, assign_media, load_initial_events
+from utils.parse_llm_output import parse_json_markdown
+
+logger = logging.getLogger(__name__)
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.dirname(__file__)), "data")
+FALLBACK_LIBRARY_PATH = os.getenv("FALLBACK_LIBRARY_PATH", os.path.join(DATA_DIR, "fallback_events.json"))
+EVENTS_YAML_PATH = "services/create_rag/events.yaml"
+
+# Keywords (English corpus and French game text) used to tag events and chosen options
+THEMES = {
+    "war": ["war", "battle", "army", "invasion", "siege", "conquest", "military", "revolt",
+            "guerre", "bataille", "armée", "siège", "conquête", "militaire", "révolte"],
+    "science": ["science", "scientific", "discovery", "invention", "university", "technology", "space", "moon",
+                "découverte", "université", "technologie", "espace", "lune", "scientifique", "machine"],
+    "religion": ["church", "pope", "crusade", "cathedral", "religious", "monastery",
+                 "église", "pape", "croisade", "cathédrale", "religieu", "foi"],
+    "politics": ["king", "queen", "treaty", "law", "parliament", "revolution", "election", "government",
+                 "roi", "reine", "traité", "loi", "parlement", "révolution", "élection", "gouvernement"],
+    "culture": ["art", "music", "literature", "painting", "theatre", "architecture", "novel",
+                "artiste", "musique", "littérature", "peinture", "théâtre", "roman"],
+    "exploration": ["expedition", "voyage", "explorer", "colony", "navigation", "continent",
+                    "expédition", "explorateur", "colonie", "navigat"],
+    "economy": ["trade", "bank", "market", "industry", "company", "commerce",
+                "banque", "marché", "industrie", "économi", "entreprise"],
+    "catastrophe": ["plague", "earthquake", "fire", "famine", "flood", "epidemic", "pandemic",
+                    "peste", "séisme", "incendie", "inondation", "épidémie", "pandémie"],
+}
+DEFAULT_THEME = "society"
+_THEME_PATTERNS = {
+    theme: re.compile(r"\b(?:" + "|".join(re.escape(k) for k in keywords) + r")", re.IGNORECASE)
+    for theme, keywords in THEMES.items()
+}
+# Upper year bound (exclusive) of each era
+ERAS = [(500, "antiquity"), (1500, "middle_ages"), (1800, "early_modern"), (1914, "industrial"),
+        (2025, "contemporary"), (float("inf"), "future")]
+# Years between the chosen event and re-dated fallback events when the library has nothing later
+FUTURE_OFFSETS = (1, 25, 120)
+
+
+def classify_theme(text):
+    scores = {theme: len(pattern.findall(text)) for theme, pattern in _THEME_PATTERNS.items()}
+    theme, score = max(scores.items(), key=lambda item: item[1])
+    return theme if score else DEFAULT_THEME
+
+
+def era_of(year):
+    return next(name for bound, name in ERAS if year < bound)
+
+
+def year_of(date):
+    match = re.match(r"-?\d+", date or "")
+    return int(match.group()) if match else 0
+
+
+def _with_year(date, year):
+    month_day = date.split("-")[-2:] if date and date.count("-") >= 2 else ["01", "01"]
+    return f"{year:04d}-{'-'.join(month_day)}"
+
+
+class FallbackLibrary:
+    """Pre-built events indexed by theme (sorted by year) and tagged with their era."""
+
+    def __init__(self, path=FALLBACK_LIBRARY_PATH):
+        self.path = path
+        self.events = []
+        if os.path.exists(path):
+            with open(path, "r") as f:
+                self.events = json.load(f)["events"]
+            logger.info(f"Loaded {len(self.events)} fallback events from {path}")
+        self.events.sort(key=lambda e: e["year"])
+        self.by_theme = defaultdict(list)
+        self.by_era = defaultdict(list)
+        for entry in self.events:
+            self.by_theme[entry["theme"]].append(entry)
+            self.by_era[entry["era"]].append(entry)
+
+    def __len__(self):
+        return len(self.events)
+
+    def pick(self, filtered_events, chosen_option, count=3, rng=random):
+        """
+        Choose `count` events that plausibly follow the chosen option.
+
+        Events later than the chosen one are preferred, with the theme of the chosen option,
+        one from each third of the remaining time span (soon, later, much later). When the
+        library has nothing later, entries are re-dated into the future.
+
+        Args:
+            filtered_events: Timeline up to and including the chosen event
+            chosen_option: Dict with the title and consequence of the chosen option
+
+        Returns:
+            list[dict]: Event dicts without ids, sorted by date
+        """
+        chosen = filtered_events[-1]
+        after = year_of(chosen.date)
+        theme = classify_theme(" ".join([chosen.title, chosen_option["title"], *chosen_option["consequence"]]))
+        used = {event.title for event in filtered_events}
+
+        def later(entries):
+            return [e for e in entries if e["year"] > after and e["title"] not in used]
+
+        pool = later(self.by_theme[theme])
+        if len(pool) < count:
+            pool = later(self.events)
+        if len(pool) >= count:
+            slices = [pool[len(pool) * i // count:len(pool) * (i + 1) // count] for i in range(count)]
+            picks = [copy.deepcopy(rng.choice(part)) for part in slices]
+        else:
+            # Nothing later in the library: prefer futuristic entries, re-dated after the chosen event
+            future = [e for e in self.by_era["future"] if e["title"] not in used]
+            candidates = [e for e in future if e["theme"] == theme] or future or self.events
+            if len(candidates) < count:
+                candidates = self.events
+            picks = [copy.deepcopy(e) for e in rng.sample(candidates, min(count, len(candidates)))]
+            for entry, offset in zip(picks, FUTURE_OFFSETS):
+                entry["date"] = _with_year(entry["date"], after + offset)
+
+        return [
+            {key: entry[key] for key in ("title", "date", "description", "image", "music_file", "options")}
+            for entry in sorted(picks, key=lambda e: year_of(e["date"]))
+        ]
+
+
+def library_entry(event, source, source_id, year):
+    return {
+        "source": source,
+        "source_id": source_id,
+        "year": year,
+        "era": era_of(year),
+        "theme": classify_theme(" ".join([event["title"], *(event["description"] or [])])),
+        **{key: event.get(key) for key in ("title", "date", "description", "image", "music_file", "options")},
+    }
+
+
+async def rewrite_batch(corpus_events):
+    """Rewrite corpus entries into French game events with options, in one call."""
+    system_message = {
+        "role": "system",
+        "content": f"""
+        We are working on uchronia, a game that displays a chronological timeline, with events and we allow our users to change the course of history.
+        Rewrite each historical event below as a game event, in French.
+
+        Output a JSON object with the following structure:
+        {{
+            "events": [{{"id": <id of the input event>, "title": "string", "description": ["string"], "options": [{{"title": "string", "consequence": ["string"]}}]}}]
+        }}
+        Notes:
+        - Don't output any text other than the JSON
+        - Titles are explicit and start with a noun; option titles start with a verb
+        - Each event has exactly {OPTIONS_PER_EVENT} options that could change the course of history, with unexpected consequences
+        - Descriptions and consequences are lists of 2 paragraphs of 2-3 lines
+        """,
+    }
+    user_message = {
+        "role": "user",
+        "content": json.dumps(
+            [{"id": e["id"], "name": e["name"], "year": e["year"], "description": e["description"]}
+             for e in corpus_events],
+            ensure_ascii=False,
+        ),
+    }
+    completion = await routed_completion(
+        "build_fallback_library",
+        [system_message, user_message],
+        temperature=0.7,
+        validate=lambda content: bool(parse_json_markdown(content).get("events")),
+    )
+    by_id = {e["id"]: e for e in corpus_events}
+    events = []
+    for raw in parse_json_markdown(completion.choices[0].message.content)["events"]:
+        try:
+            source = by_id.get(int(raw["id"]))
+        except (TypeError, KeyError, ValueError):
+            continue
+        if source is None:
+            continue
+        event = normalize_event(raw)
+        event["date"] = f"{source['year']:04d}-01-01"
+        event["options"] = valid_options(event.get("options"))
+        try:
+            Event.model_validate({**event, "id": "0"})
+        except Exception:
+            continue
+        if len(event["options"]) == OPTIONS_PER_EVENT:
+            events.append((source, event))
+    return events
+
+
+async def build_library(library, corpus_events, batch_size=10, concurrency=4):
+    """
+    Add the starting deck and the missing corpus entries to the library.
+
+    Args:
+        library: FallbackLibrary to complete (existing entries are kept, so builds resume)
+        corpus_events: Entries of events.yaml
+        batch_size: Corpus entries rewritten per LLM call
+        concurrency: LLM calls run at once
+    """
+    done = {(e["source"], e["source_id"]) for e in library.events}
+    entries = list(library.events)
+    for event in load_initial_events():
+        if ("deck", event["id"]) not in done:
+            entries.append(library_entry(event, "deck", event["id"], year_of(event["date"])))
+
+    todo = [e for e in corpus_events if ("corpus", e["id"]) not in done]
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def run(batch):
+        async with semaphore:
+            try:
+                rewritten = await rewrite_batch(batch)
+            except Exception as e:
+                print(f"⚠️ Batch starting at corpus id {batch[0]['id']} failed: {e}")
+                return
+            events = [event for _, event in rewritten]
+            await assign_media(events)
+        for source, event in rewritten:
+            # The corpus entry has its own library image
+            event["image"] = IMAGE_URL.format(source["id"])
+            entries.append(library_entry(event, "corpus", source["id"], source["year"]))
+        print(f"✅ {len(rewritten)}/{len(batch)} events from corpus id {batch[0]['id']}")
+
+    await asyncio.gather(*(run(todo[i:i + batch_size]) for i in range(0, len(todo), batch_size)))
+    return entries
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build the fallback events library")
+    parser.add_argument("--events", default=EVENTS_YAML_PATH)
+    parser.add_argument("--output", default=FALLBACK_LIBRARY_PATH)
+    parser.add_argument("--batch-size", type=int, default=10)
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--limit", type=int, help="Only rewrite the first N corpus entries")
+    args = parser.parse_args()
+
+    with open(args.events, "r") as f:
+        corpus_events = [e for e in yaml.safe_load(f) if e["id"] >= 0][:args.limit]
+    library = FallbackLibrary(args.output)
+    entries = asyncio.run(build_library(library, corpus_events, args.batch_size, args.concurrency))
+
+    tmp_path = f"{args.output}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump({"events": entries}, f, ensure_ascii=False)
+    os.replace(tmp_path, args.output)
+    themes = defaultdict(int)
+    for entry in entries:
+        themes[entry["theme"]] += 1
+    print(f"Fallback library holds {len(entries)} events: {dict(themes)}")
+
+
+if __name__ == "__main__":
+    main()
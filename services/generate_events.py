@@ -1,5 +1,8 @@
 import litellm
 
+from services.event_repair import validated_events
+from services.llm_router import routed_completion
+from services.timeline_context import build_timeline_context, log_token_report
 from utils.parse_llm_output import parse_json_markdown, extract_tag_content
 
 from dotenv import load_dotenv
@@ -47,17 +50,15 @@ async def generate_future_events(events, option_chosen, model="gpt-4o", temperat
         "role": "user",
         "content": f"""
         Option chosen : {option_chosen} 
-        Events : {events}
+        Events : {build_timeline_context(events)}
         """,
     }
-    completion = await litellm.acompletion(
-        model=model,
-        # model="groq/llama-3.3-70b-versatile",
+    completion = await routed_completion(
+        "generate_future_events",
+        [system_message, user_message],
         temperature=temperature,
-        messages=[system_message, user_message],
-        metadata={
-            "tags": ["generate_future_events"]
-        }
+        model=model,
+        validate=lambda content: extract_tag_content(content, "events") is not None,
     )
     think = extract_tag_content(completion.choices[0].message.content, "think")
     events_str = extract_tag_content(completion.choices[0].message.content, "events")
@@ -65,7 +66,7 @@ async def generate_future_events(events, option_chosen, model="gpt-4o", temperat
     return think, events
 
 
-async def generate_narrative_arc(events, option_chosen):
+async def generate_narrative_arc(timeline, option_chosen):
     user_message = {
         "role": "user",
         "content": f"""
@@ -75,15 +76,13 @@ async def generate_narrative_arc(events, option_chosen):
 
         Option chosen: {option_chosen}
         Events:
-        {events}
+        {timeline}
         """,
     }
-    completion = await litellm.acompletion(
-        # model="groq/llama-3.3-70b-versatile",
-        model="groq/deepseek-r1-distill-llama-70b",
+    completion = await routed_completion(
+        "generate_narrative_arc",
+        [user_message],
         temperature=0.7,
-        messages=[user_message],
-        metadata={"tags": ["generate_narrative_arc"]},
     )
 
     return completion.choices[0].message.content
@@ -121,21 +120,28 @@ async def format_narrative_arc(narrative_arc):
         Narrative Arc: {narrative_arc}
         """,
     }
-    completion = await litellm.acompletion(
-        model="groq/llama-3.3-70b-versatile",
+    completion = await routed_completion(
+        "format_narrative_arc",
+        [system_message, user_message],
         temperature=0.7,
-        messages=[system_message, user_message],
-        metadata={
-            "tags": ["format_narrative_arc"]
-        }
+        # A truncated response is usable as long as at least one complete event was salvaged
+        validate=lambda content: bool(parse_json_markdown(content).get("events")),
     )
     return completion.choices[0].message.content
 
 
-async def generate_narrative_arc_events(events, option_chosen):
-    narrative_arc = await generate_narrative_arc(events, option_chosen)
+async def generate_narrative_arc_events(events, option_chosen, session_id=None, choices=None, on_narrative_arc=None):
+    timeline = build_timeline_context(events, session_id=session_id, choices=choices)
+    log_token_report(events, timeline)
+    narrative_arc = await generate_narrative_arc(timeline, option_chosen)
+    if on_narrative_arc is not None:
+        # Lets the caller start work that only needs the free-form arc while it is formatted
+        on_narrative_arc(narrative_arc)
     formatted_narrative_arc = await format_narrative_arc(narrative_arc)
-    narrative_arc_events = parse_json_markdown(formatted_narrative_arc)["events"]
+    # Regenerate only what is missing or invalid instead of the whole chain
+    narrative_arc_events = await validated_events(
+        narrative_arc, parse_json_markdown(formatted_narrative_arc)["events"]
+    )
 
     # generate ids
     max_id = max([int(event.id) for event in events])
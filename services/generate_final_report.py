@@ -1,5 +1,6 @@
 import litellm
 
+from services.llm_router import routed_completion
 from utils.parse_llm_output import parse_json_markdown, extract_tag_content
 
 from dotenv import load_dotenv
@@ -42,8 +43,12 @@ async def generate_final_report(events, model="gpt-4o", temperature=0.9):
         Events : {events}
         """,
     }
-    summary = await litellm.acompletion(
-        model=model, temperature=temperature, messages=[system_message, user_message]
+    summary = await routed_completion(
+        "generate_final_report",
+        [system_message, user_message],
+        temperature=temperature,
+        model=model,
+        validate=parse_json_markdown,
     )
     summary_str = summary.choices[0].message.content
     events = parse_json_markdown(summary_str)
@@ -0,0 +1,119 @@
+"""
+Shared, long-lived async clients for the provider APIs called on the turn's critical path.
+
+The OpenAI client used for retrieval embeddings is opened in the app lifespan and reused
+by every request, so its connections stay warm between turns instead of each retrieval
+holding a threadpool thread for a full HTTPS round-trip. Its httpx pool is bounded and
+kept alive, uses HTTP/2 when the `h2` package is installed (pip install h2) and applies a
+short per-call timeout to embeddings:
+
+    OPENAI_MAX_CONNECTIONS=32 OPENAI_KEEPALIVE_EXPIRY=60 EMBEDDING_TIMEOUT=5 uvicorn api.main:app
+
+The endpoint and key are read by the SDK from OPENAI_BASE_URL and OPENAI_API_KEY.
+"""
+import asyncio
+import logging
+import os
+
+import httpx
+import openai
+
+from services.cassette import cassette
+from services.metrics import time_stage
+from services.usage import record_usage
+
+logger = logging.getLogger(__name__)
+
+OPENAI_MAX_CONNECTIONS = int(os.getenv("OPENAI_MAX_CONNECTIONS", 32))
+# Idle connections kept open, and for how long (seconds)
+OPENAI_MAX_KEEPALIVE = int(os.getenv("OPENAI_MAX_KEEPALIVE", 16))
+OPENAI_KEEPALIVE_EXPIRY = float(os.getenv("OPENAI_KEEPALIVE_EXPIRY", 60))
+# "auto" uses HTTP/2 when h2 is installed, "0"/"1" force it off/on
+OPENAI_HTTP2 = os.getenv("OPENAI_HTTP2", "auto")
+OPENAI_CONNECT_TIMEOUT = float(os.getenv("OPENAI_CONNECT_TIMEOUT", 3))
+OPENAI_TIMEOUT = float(os.getenv("OPENAI_TIMEOUT", 60))
+# Per-call timeout of embedding requests, retried OPENAI_MAX_RETRIES times by the SDK
+EMBEDDING_TIMEOUT = float(os.getenv("EMBEDDING_TIMEOUT", 10))
+OPENAI_MAX_RETRIES = int(os.getenv("OPENAI_MAX_RETRIES", 2))
+
+# (event loop, client): httpx pools cannot be shared across event loops
+_openai = None
+
+
+def http2_enabled(setting=OPENAI_HTTP2):
+    if setting != "auto":
+        return setting == "1"
+    try:
+        import h2  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+def create_openai_client():
+    http_client = httpx.AsyncClient(
+        http2=http2_enabled(),
+        limits=httpx.Limits(
+            max_connections=OPENAI_MAX_CONNECTIONS,
+            max_keepalive_connections=OPENAI_MAX_KEEPALIVE,
+            keepalive_expiry=OPENAI_KEEPALIVE_EXPIRY,
+        ),
+        timeout=httpx.Timeout(OPENAI_TIMEOUT, connect=OPENAI_CONNECT_TIMEOUT),
+    )
+    return openai.AsyncOpenAI(
+        http_client=http_client,
+        timeout=httpx.Timeout(OPENAI_TIMEOUT, connect=OPENAI_CONNECT_TIMEOUT),
+        max_retries=OPENAI_MAX_RETRIES,
+    )
+
+
+def get_openai_client():
+    """The shared AsyncOpenAI client of the running event loop, created on first use outside the lifespan."""
+    global _openai
+    loop = asyncio.get_running_loop()
+    if _openai is None or _openai[0] is not loop:
+        _openai = (loop, create_openai_client())
+    return _openai[1]
+
+
+async def open_clients():
+    """Create the shared clients (app lifespan startup)."""
+    try:
+        get_openai_client()
+    except openai.OpenAIError as e:
+        # Same as the synchronous SDK: fail on the first call rather than at startup
+        logger.warning(f"OpenAI client not created: {e}")
+        return
+    logger.info(f"OpenAI client ready (HTTP/2: {http2_enabled()}, {OPENAI_MAX_CONNECTIONS} connections)")
+
+
+async def close_clients():
+    """Close the shared clients and their connections (app lifespan shutdown)."""
+    global _openai
+    if _openai is not None:
+        client = _openai[1]
+        _openai = None
+        await client.close()
+
+
+async def aembed(texts, model, timeout=EMBEDDING_TIMEOUT):
+    """
+    Embed texts in one request on the shared client.
+
+    Args:
+        texts: Texts to embed (newlines are replaced, as the synchronous helpers do)
+        model: OpenAI embedding model
+        timeout: Seconds allowed for each attempt
+
+    Returns:
+        list[list[float]]: One vector per text, in order
+    """
+    texts = [text.replace("\n", " ") for text in texts]
+
+    async def embed():
+        response = await get_openai_client().embeddings.create(input=texts, model=model, timeout=timeout)
+        record_usage("embedding", model, response.usage.prompt_tokens)
+        return [r.embedding for r in response.data]
+
+    with time_stage("embedding"):
+        return await cassette.acall("embedding", {"model": model, "input": texts}, embed)
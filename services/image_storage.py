@@ -0,0 +1,151 @@
+"""
+Where generated images are stored and the URL clients load them from.
+
+IMAGE_STORAGE=local (default) keeps them under data/generated_images, served by the API
+through StaticFiles. IMAGE_STORAGE=s3 uploads them to an S3-compatible bucket with a
+streamed multipart upload and hands out direct object URLs, so images outlive the
+container and the API workers never serve image bytes. S3_ENDPOINT_URL points boto3 at
+any S3-compatible server (MinIO, moto) for local runs and tests.
+"""
+import logging
+import os
+import tempfile
+
+from services.metrics import time_stage
+
+logger = logging.getLogger(__name__)
+
+IMAGE_STORAGE = os.getenv("IMAGE_STORAGE", "local")
+IMAGES_DIR = os.path.join(os.path.dirname(os.path.dirname(__file__)), "data", "generated_images")
+S3_BUCKET = os.getenv("S3_BUCKET", "uchronia")
+S3_PREFIX = os.getenv("S3_PREFIX", "generated_images/")
+S3_REGION = os.getenv("S3_REGION", "eu-west-3")
+S3_ENDPOINT_URL = os.getenv("S3_ENDPOINT_URL")
+# Base of the object URLs returned to clients (default: the bucket's virtual-hosted URL)
+S3_PUBLIC_URL = os.getenv("S3_PUBLIC_URL")
+# Part size of the multipart upload, images above one part are sent part by part
+S3_MULTIPART_CHUNKSIZE = int(os.getenv("S3_MULTIPART_CHUNKSIZE", 8 * 1024 * 1024))
+# Generated images are never rewritten: a task id always names the same image
+IMAGE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+
+
+class ImageStorage:
+    """Interface of an image storage backend. Methods are blocking and run in the threadpool."""
+
+    def spool_path(self, task_id):
+        """Local path the image generator writes to before store() is called."""
+        raise NotImplementedError
+
+    def store(self, task_id, path):
+        """Move the image written at `path` into the storage."""
+        raise NotImplementedError
+
+    def exists(self, task_id):
+        raise NotImplementedError
+
+    def url(self, task_id):
+        raise NotImplementedError
+
+    def task_ids(self):
+        """Ids of the stored images, used to seed the status tracker at startup (any iterable)."""
+        raise NotImplementedError
+
+
+class LocalImageStorage(ImageStorage):
+    """PNG files in one directory, served by the API under /data/generated_images."""
+
+    def __init__(self, directory=IMAGES_DIR):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+    def spool_path(self, task_id):
+        # Next to the final file, so store() is an atomic rename and a half-written image is never served
+        return os.path.join(self.directory, f"{task_id}.png.part")
+
+    def store(self, task_id, path):
+        os.replace(path, os.path.join(self.directory, f"{task_id}.png"))
+
+    def exists(self, task_id):
+        return os.path.exists(os.path.join(self.directory, f"{task_id}.png"))
+
+    def url(self, task_id):
+        return f"data/generated_images/{task_id}.png"
+
+    def task_ids(self):
+        return [filename[:-len(".png")] for filename in os.listdir(self.directory) if filename.endswith(".png")]
+
+
+class S3ImageStorage(ImageStorage):
+    """Objects `{prefix}{task_id}.png` in an S3-compatible bucket, loaded by clients directly."""
+
+    def __init__(self, bucket=S3_BUCKET, prefix=S3_PREFIX, endpoint_url=S3_ENDPOINT_URL, region=S3_REGION,
+                 public_url=S3_PUBLIC_URL, client=None):
+        try:
+            import boto3
+            from boto3.s3.transfer import TransferConfig
+        except ImportError as e:
+            raise RuntimeError("IMAGE_STORAGE=s3 requires boto3 (pip install boto3)") from e
+
+        self.bucket = bucket
+        self.prefix = prefix
+        self.client = client or boto3.client("s3", endpoint_url=endpoint_url, region_name=region)
+        self.transfer_config = TransferConfig(
+            multipart_threshold=S3_MULTIPART_CHUNKSIZE, multipart_chunksize=S3_MULTIPART_CHUNKSIZE
+        )
+        if public_url:
+            self.public_url = public_url.rstrip("/")
+        elif endpoint_url:
+            self.public_url = f"{endpoint_url.rstrip('/')}/{bucket}"
+        else:
+            self.public_url = f"https://{bucket}.s3.{region}.amazonaws.com"
+        self.spool_dir = tempfile.mkdtemp(prefix="uchronia-images-")
+
+    def _key(self, task_id):
+        return f"{self.prefix}{task_id}.png"
+
+    def spool_path(self, task_id):
+        return os.path.join(self.spool_dir, f"{task_id}.png")
+
+    def store(self, task_id, path):
+        try:
+            with open(path, "rb") as f, time_stage("image_upload"):
+                self.client.upload_fileobj(
+                    f,
+                    self.bucket,
+                    self._key(task_id),
+                    ExtraArgs={"ContentType": "image/png", "CacheControl": IMAGE_CACHE_CONTROL},
+                    Config=self.transfer_config,
+                )
+        finally:
+            os.remove(path)
+
+    def exists(self, task_id):
+        from botocore.exceptions import ClientError
+
+        try:
+            self.client.head_object(Bucket=self.bucket, Key=self._key(task_id))
+            return True
+        except ClientError as e:
+            if e.response.get("Error", {}).get("Code") in ("404", "NoSuchKey", "NotFound"):
+                return False
+            raise
+
+    def url(self, task_id):
+        return f"{self.public_url}/{self._key(task_id)}"
+
+    def task_ids(self):
+        # Yielded as the pages of 1000 keys arrive, instead of after listing the whole bucket
+        paginator = self.client.get_paginator("list_objects_v2")
+        for page in paginator.paginate(Bucket=self.bucket, Prefix=self.prefix):
+            for entry in page.get("Contents", []):
+                name = entry["Key"][len(self.prefix):]
+                if name.endswith(".png") and "/" not in name:
+                    yield name[:-len(".png")]
+
+
+def get_image_storage(name=IMAGE_STORAGE):
+    if name == "local":
+        return LocalImageStorage()
+    if name == "s3":
+        return S3ImageStorage()
+    raise ValueError(f"Unknown image storage: {name}")
@@ -0,0 +1,369 @@
+import asyncio
+import logging
+import os
+import time
+from collections import deque
+
+import litellm
+
+from services.cassette import cassette
+from services.metrics import LLM_BUDGET_DOWNGRADES, LLM_CALL_SECONDS, LLM_HEDGES
+from services.usage import budget_exceeded, record_completion, record_usage
+
+logger = logging.getLogger(__name__)
+
+# Number of latency samples kept per model for the rolling estimates
+LATENCY_WINDOW = int(os.getenv("LLM_LATENCY_WINDOW", 50))
+# Samples needed before the rolling p95 replaces the configured hedge delay
+MIN_SAMPLES = int(os.getenv("LLM_LATENCY_MIN_SAMPLES", 5))
+# Seconds a model is pushed to the back of the candidate list after an error
+ERROR_COOLDOWN = float(os.getenv("LLM_ERROR_COOLDOWN", 30))
+# Cheaper, faster models used by every stage once a spending budget is exceeded (see services/usage.py)
+BUDGET_MODELS = ["groq/llama-3.3-70b-versatile", "gpt-4o-mini"]
+
+
+def _route(stage, models, deadline, hedge_after, budget_models=BUDGET_MODELS):
+    """
+    Build a stage route, letting LLM_MODELS_<STAGE> / LLM_BUDGET_MODELS_<STAGE> /
+    LLM_DEADLINE_<STAGE> / LLM_HEDGE_<STAGE> override it.
+    """
+    env_key = stage.upper()
+    env_models = os.getenv(f"LLM_MODELS_{env_key}")
+    env_budget_models = os.getenv(f"LLM_BUDGET_MODELS_{env_key}")
+    return {
+        "models": env_models.split(",") if env_models else models,
+        "budget_models": env_budget_models.split(",") if env_budget_models else budget_models,
+        "deadline": float(os.getenv(f"LLM_DEADLINE_{env_key}", deadline)),
+        "hedge_after": float(os.getenv(f"LLM_HEDGE_{env_key}", hedge_after)),
+    }
+
+
+# Candidate models per stage (preference order), the models used instead once a budget
+# is spent, the hard deadline for the whole stage and the hedge delay used until the
+# primary model has enough latency samples.
+ROUTES = {
+    "generate_future_events": _route(
+        "generate_future_events", ["gpt-4o", "groq/llama-3.3-70b-versatile"], deadline=60, hedge_after=25
+    ),
+    "generate_narrative_arc": _route(
+        "generate_narrative_arc", ["groq/deepseek-r1-distill-llama-70b", "gpt-4o"], deadline=45, hedge_after=20
+    ),
+    "format_narrative_arc": _route(
+        "format_narrative_arc", ["groq/llama-3.3-70b-versatile", "gpt-4o-mini"], deadline=30, hedge_after=10
+    ),
+    "repair_events": _route(
+        "repair_events", ["gpt-4o-mini", "groq/llama-3.3-70b-versatile"], deadline=20, hedge_after=8
+    ),
+    "build_fallback_library": _route(
+        "build_fallback_library", ["gpt-4o-mini", "gpt-4o"], deadline=120, hedge_after=60
+    ),
+    "generate_final_report": _route(
+        "generate_final_report", ["gpt-4o", "groq/llama-3.3-70b-versatile"], deadline=30, hedge_after=12
+    ),
+    "update_report_summary": _route(
+        "update_report_summary", ["gpt-4o-mini", "groq/llama-3.3-70b-versatile"], deadline=20, hedge_after=8
+    ),
+}
+
+
+class LLMDeadlineExceeded(asyncio.TimeoutError):
+    """Raised when no candidate model produced a valid response within the stage deadline."""
+
+
+class ModelLatency:
+    """Rolling latency window and error state of a single model."""
+
+    def __init__(self, window=LATENCY_WINDOW):
+        self.samples = deque(maxlen=window)
+        self.last_error = None
+
+    def record(self, seconds):
+        self.samples.append(seconds)
+
+    def record_error(self):
+        self.last_error = time.monotonic()
+
+    def cooling_down(self):
+        return self.last_error is not None and time.monotonic() - self.last_error < ERROR_COOLDOWN
+
+    def percentile(self, q):
+        if len(self.samples) < MIN_SAMPLES:
+            return None
+        ordered = sorted(self.samples)
+        return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+latency_stats = {}
+
+
+def get_latency(model):
+    if model not in latency_stats:
+        latency_stats[model] = ModelLatency()
+    return latency_stats[model]
+
+
+def rank_models(models):
+    """
+    Order candidate models for a call.
+
+    Models that errored recently go last. The others keep their configured order until
+    each of them has MIN_SAMPLES latency samples, and are then ordered by their rolling
+    median latency, so the preferred model leads until the estimates say otherwise.
+
+    Args:
+        models: Candidate model names in preference order
+
+    Returns:
+        List of model names, best candidate first
+    """
+    healthy = [model for model in models if not get_latency(model).cooling_down()]
+    medians = {model: get_latency(model).percentile(0.5) for model in healthy}
+    by_latency = all(median is not None for median in medians.values())
+
+    def key(item):
+        position, model = item
+        if model not in medians:
+            return (True, 0.0, position)
+        return (False, medians[model] if by_latency else 0.0, position)
+
+    return [model for _, model in sorted(enumerate(models), key=key)]
+
+
+def _is_valid(completion, validate):
+    content = completion.choices[0].message.content
+    if not content:
+        return False
+    if validate is None:
+        return True
+    try:
+        return bool(validate(content))
+    except Exception as e:
+        logger.warning(f"Response validation raised: {e}")
+        return False
+
+
+def _prompt_tokens(model, messages):
+    try:
+        return litellm.token_counter(model=model, messages=messages)
+    except Exception:
+        return 0
+
+
+async def _call(model, stage, messages, temperature, timeout, metadata):
+    stats = get_latency(model)
+    start = time.monotonic()
+    try:
+        completion = await cassette.acall(
+            "llm",
+            {"stage": stage, "model": model, "messages": messages, "temperature": temperature},
+            lambda: litellm.acompletion(
+                model=model,
+                temperature=temperature,
+                messages=messages,
+                timeout=timeout,
+                metadata=metadata,
+            ),
+            encode=lambda c: c.model_dump(),
+            decode=lambda d: litellm.ModelResponse(**d),
+        )
+    except asyncio.CancelledError:
+        LLM_CALL_SECONDS.labels(stage, model, "cancelled").observe(time.monotonic() - start)
+        if cassette.mode != "replay":
+            # A losing hedge or a call past the deadline is still billed for its prompt; the
+            # completion tokens generated before the cancellation are unknown and not counted
+            record_usage(stage, model, _prompt_tokens(model, messages))
+        raise
+    except Exception:
+        stats.record_error()
+        LLM_CALL_SECONDS.labels(stage, model, "error").observe(time.monotonic() - start)
+        raise
+    elapsed = time.monotonic() - start
+    stats.record(elapsed)
+    LLM_CALL_SECONDS.labels(stage, model, "ok").observe(elapsed)
+    record_completion(stage, model, completion)
+    return completion
+
+
+def stage_candidates(stage, model=None):
+    """
+    Ranked candidate models of a stage call.
+
+    Once the session or global budget is spent, the stage's budget models replace its
+    configured models, and an explicitly requested model is ignored.
+    """
+    route = ROUTES[stage]
+    budget = budget_exceeded()
+    if budget:
+        LLM_BUDGET_DOWNGRADES.labels(stage, budget).inc()
+        logger.info(f"[{stage}] {budget} budget spent, using {route['budget_models']}")
+        return rank_models(route["budget_models"])
+    candidates = rank_models(route["models"])
+    if model is not None:
+        candidates = [model] + [m for m in candidates if m != model]
+    return candidates
+
+
+async def routed_completion(stage, messages, temperature=0.7, model=None, validate=None, metadata=None):
+    """
+    Run a chat completion for a pipeline stage with a deadline, hedging and fallback.
+
+    The best ranked model is called first. If it has not answered once its rolling p95
+    (or the stage's configured hedge delay) has elapsed, the next model is started in
+    parallel and the first valid response wins. A model that errors or returns an
+    invalid response is replaced by the next candidate while the deadline allows.
+
+    Args:
+        stage: Key of ROUTES describing candidate models and deadlines
+        messages: Chat messages passed to litellm
+        temperature: Sampling temperature
+        model: Optional model to try before the stage's configured candidates (unless over budget)
+        validate: Optional callable taking the response content and returning whether it is usable
+        metadata: Optional litellm metadata (defaults to tagging the call with the stage name)
+
+    Returns:
+        The litellm completion of the winning model
+
+    Raises:
+        LLMDeadlineExceeded: If no valid response arrived before the stage deadline
+        Exception: The last provider error if every candidate failed
+    """
+    route = ROUTES[stage]
+    candidates = stage_candidates(stage, model)
+    metadata = metadata or {"tags": [stage]}
+
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + route["deadline"]
+    pending = {}
+    last_error = None
+
+    def launch():
+        candidate = candidates.pop(0)
+        remaining = max(deadline - loop.time(), 0.1)
+        task = asyncio.create_task(_call(candidate, stage, messages, temperature, remaining, metadata))
+        pending[task] = candidate
+        return candidate
+
+    primary = launch()
+    hedge_after = get_latency(primary).percentile(0.95) or route["hedge_after"]
+    hedge_at = loop.time() + hedge_after
+
+    try:
+        while pending:
+            now = loop.time()
+            if now >= deadline:
+                break
+            wake_at = min(hedge_at, deadline) if candidates else deadline
+            done, _ = await asyncio.wait(
+                pending, timeout=max(wake_at - now, 0), return_when=asyncio.FIRST_COMPLETED
+            )
+
+            if not done:
+                if candidates and loop.time() >= hedge_at:
+                    hedged = launch()
+                    hedge_at = deadline
+                    LLM_HEDGES.labels(stage).inc()
+                    logger.info(f"[{stage}] {primary} exceeded {hedge_after:.1f}s, hedging with {hedged}")
+                continue
+
+            for task in done:
+                candidate = pending.pop(task)
+                try:
+                    completion = task.result()
+                except Exception as e:
+                    last_error = e
+                    logger.warning(f"[{stage}] {candidate} failed: {e}")
+                else:
+                    if _is_valid(completion, validate):
+                        return completion
+                    logger.warning(f"[{stage}] {candidate} returned an invalid response")
+                # Fall back to the next candidate if nothing else is still running
+                if not pending and candidates:
+                    launch()
+    finally:
+        for task in pending:
+            task.cancel()
+
+    if loop.time() >= deadline:
+        raise LLMDeadlineExceeded(f"{stage} missed its {route['deadline']:g}s deadline")
+    if last_error is not None:
+        raise last_error
+    raise ValueError(f"{stage}: no candidate returned a valid response")
+
+
+async def routed_stream(stage, messages, temperature=0.7, metadata=None):
+    """
+    Stream the text of a chat completion for a pipeline stage.
+
+    Candidates are tried in ranked order until one starts streaming within the stage
+    deadline; once text has been sent there is no fallback. With a cassette enabled the
+    whole completion goes through routed_completion and is yielded in one piece.
+
+    Yields:
+        str: Successive pieces of the response content
+
+    Raises:
+        LLMDeadlineExceeded: If no model started streaming before the stage deadline
+        Exception: The last provider error if every candidate failed
+    """
+    if cassette.enabled:
+        completion = await routed_completion(stage, messages, temperature=temperature, metadata=metadata)
+        yield completion.choices[0].message.content
+        return
+
+    route = ROUTES[stage]
+    metadata = metadata or {"tags": [stage]}
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + route["deadline"]
+    last_error = None
+    for candidate in stage_candidates(stage):
+        remaining = deadline - loop.time()
+        if remaining <= 0:
+            break
+        start = time.monotonic()
+        try:
+            stream = await asyncio.wait_for(
+                litellm.acompletion(
+                    model=candidate,
+                    temperature=temperature,
+                    messages=messages,
+                    timeout=remaining,
+                    metadata=metadata,
+                    stream=True,
+                ),
+                remaining,
+            )
+            chunks = stream.__aiter__()
+            first = await asyncio.wait_for(chunks.__anext__(), max(deadline - loop.time(), 0.1))
+        except (Exception, asyncio.TimeoutError) as e:
+            get_latency(candidate).record_error()
+            LLM_CALL_SECONDS.labels(stage, candidate, "error").observe(time.monotonic() - start)
+            last_error = e
+            logger.warning(f"[{stage}] {candidate} failed to start streaming: {e}")
+            continue
+
+        chunk = first
+        pieces = []
+        while True:
+            text = chunk.choices[0].delta.content if chunk.choices else None
+            if text:
+                pieces.append(text)
+                yield text
+            try:
+                chunk = await chunks.__anext__()
+            except StopAsyncIteration:
+                break
+        elapsed = time.monotonic() - start
+        get_latency(candidate).record(elapsed)
+        LLM_CALL_SECONDS.labels(stage, candidate, "ok").observe(elapsed)
+        # Streamed chunks carry no usage: count the tokens locally
+        record_usage(
+            stage,
+            candidate,
+            litellm.token_counter(model=candidate, messages=messages),
+            litellm.token_counter(model=candidate, text="".join(pieces)),
+        )
+        return
+
+    if last_error is None or isinstance(last_error, asyncio.TimeoutError):
+        raise LLMDeadlineExceeded(f"{stage} missed its {route['deadline']:g}s deadline")
+    raise last_error
@@ -0,0 +1,173 @@
+"""
+Speculative media retrieval, overlapped with the formatting LLM call of a turn.
+
+The free-form narrative arc already names the turn's salient events, usually one per line
+with a year. With MEDIA_PIPELINE=speculative, their provisional titles and years are
+extracted as soon as the arc arrives, and the library image and music of each event are
+retrieved while format_narrative_arc runs. When the formatted events arrive, a provisional
+pick is kept if its event kept the same year and (at least partly) the same title. The
+other events and all the options (only known after formatting) are then retrieved in one
+embeddings request.
+
+Reuse is counted in uchronia_cache_requests_total{cache="media_prefetch"}.
+"""
+import asyncio
+import logging
+import os
+import re
+import unicodedata
+
+import numpy as np
+
+from services.create_rag.choose_image import EMBEDDING_MODEL as IMAGE_EMBEDDING_MODEL, match_event_ids
+from services.event_repair import EVENTS_PER_TURN
+from services.http_clients import aembed
+from services.metrics import record_cache, time_stage
+from services.music.choose_music import EMBEDDING_MODEL as MUSIC_EMBEDDING_MODEL, match_music
+
+logger = logging.getLogger(__name__)
+
+# "sequential" retrieves media after formatting, "speculative" starts from the narrative arc
+MEDIA_PIPELINE = os.getenv("MEDIA_PIPELINE", "sequential")
+# Share of the shorter title's words the formatted title must keep for a provisional pick to be reused
+MEDIA_TITLE_OVERLAP = float(os.getenv("MEDIA_TITLE_OVERLAP", 0.5))
+
+_YEAR = re.compile(r"\b(\d{3,4})\b")
+_LIST_MARKER = re.compile(r"^\s*(?:[-*•]|#+|\d+[.)])\s*")
+_BOLD = re.compile(r"\*\*(.+?)\*\*")
+# Words compared on their first letters, so "Revolution" and "Révolution" match
+_STEM_LENGTH = 5
+
+
+def provisional_events(narrative_arc, count=EVENTS_PER_TURN):
+    """
+    Extract the salient events named in a narrative arc.
+
+    Lines of a list or heading that carry a year are candidates; the arc describes its
+    phases first, so the last `count` candidates are the events it was asked for.
+
+    Returns:
+        list[dict]: {"title", "year", "text"} per event, possibly fewer than `count`
+    """
+    candidates = []
+    for line in narrative_arc.splitlines():
+        if not _LIST_MARKER.match(line):
+            continue
+        year = _YEAR.search(line)
+        if year is None:
+            continue
+        text = _LIST_MARKER.sub("", line).strip()
+        bold = _BOLD.search(text)
+        title = bold.group(1) if bold else re.split(r"\s[-–—(:]|:", text, maxsplit=1)[0]
+        title = _YEAR.sub("", title).strip(" *()[]:-–—,.")
+        if title:
+            candidates.append({"title": title, "year": int(year.group(1)), "text": text.replace("*", "")})
+    return candidates[-count:]
+
+
+def _stems(text):
+    text = unicodedata.normalize("NFKD", text).encode("ascii", "ignore").decode().lower()
+    return {word[:_STEM_LENGTH] for word in re.findall(r"[a-z0-9]+", text) if len(word) >= 4 or word.isdigit()}
+
+
+def _year(date):
+    match = _YEAR.search(date or "")
+    return int(match.group(1)) if match else None
+
+
+def materially_changed(provisional, event, min_overlap=MEDIA_TITLE_OVERLAP):
+    """Tell whether a formatted event no longer matches the provisional event its media was picked for."""
+    if provisional is None or _year(event.get("date")) != provisional["year"]:
+        return True
+    final, guessed = _stems(event.get("title", "")), _stems(provisional["title"])
+    if not final or not guessed:
+        return True
+    return len(final & guessed) / min(len(final), len(guessed)) < min_overlap
+
+
+async def _embed(image_texts, music_texts):
+    """Embed the image and music prompts, in a single request when both indexes use the same model."""
+    if IMAGE_EMBEDDING_MODEL == MUSIC_EMBEDDING_MODEL:
+        vectors = await aembed(image_texts + music_texts, IMAGE_EMBEDDING_MODEL) if image_texts + music_texts else []
+        return vectors[:len(image_texts)], vectors[len(image_texts):]
+    return await asyncio.gather(
+        aembed(image_texts, IMAGE_EMBEDDING_MODEL) if image_texts else asyncio.sleep(0, []),
+        aembed(music_texts, MUSIC_EMBEDDING_MODEL) if music_texts else asyncio.sleep(0, []),
+    )
+
+
+class MediaPrefetch:
+    """Media retrieval of one turn, started from the narrative arc and finished on the formatted events."""
+
+    def __init__(self, image_url):
+        # Format of the library image URLs (services.turns.IMAGE_URL)
+        self.image_url = image_url
+        self.provisional = []
+        self._task = None
+
+    def start(self, narrative_arc):
+        """Extract the provisional events and retrieve their media in the background."""
+        self.provisional = provisional_events(narrative_arc)
+        if self.provisional:
+            self._task = asyncio.create_task(self._retrieve(self.provisional))
+
+    async def _retrieve(self, provisional):
+        with time_stage("media_prefetch"):
+            image_vectors, music_vectors = await _embed(
+                [f"{event['title']} - Year : {event['year']}" for event in provisional],
+                [event["text"] for event in provisional],
+            )
+            return match_event_ids(np.array(image_vectors)), match_music(music_vectors)
+
+    def cancel(self):
+        if self._task is not None:
+            self._task.cancel()
+
+    async def _prefetched(self):
+        if self._task is None:
+            return [], []
+        try:
+            return await self._task
+        except Exception as e:
+            logger.warning(f"Speculative media retrieval failed, retrieving after formatting: {e}")
+            return [], []
+
+    async def finish(self, new_events):
+        """Assign the image and music of every new event and option, in place (like assign_media)."""
+        image_ids, music_files = await self._prefetched()
+        reused = {}
+        for i, event in enumerate(new_events):
+            provisional = self.provisional[i] if i < len(image_ids) else None
+            keep = not materially_changed(provisional, event)
+            record_cache("media_prefetch", keep)
+            if keep:
+                reused[i] = (image_ids[i], music_files[i])
+        logger.info(f"Reusing the speculative media of {len(reused)}/{len(new_events)} events")
+
+        changed = [i for i in range(len(new_events)) if i not in reused]
+        options = [(i, j) for i, event in enumerate(new_events) for j in range(len(event["options"]))]
+        image_texts = [new_events[i]["title"] + " - Year : " + new_events[i]["date"] for i in changed]
+        image_texts += [new_events[i]["options"][j]["title"] + "- Year :" + new_events[i]["date"] for i, j in options]
+        music_texts = [new_events[i]["title"] + " " + " ".join(new_events[i]["description"] or []) for i in changed]
+        music_texts += [new_events[i]["options"][j]["title"] + " " + new_events[i]["title"] for i, j in options]
+        with time_stage("media_retrieval"):
+            image_vectors, music_vectors = await _embed(image_texts, music_texts)
+
+        # Events and options are deduplicated separately, as in assign_media
+        event_ids = match_event_ids(
+            np.array(image_vectors[:len(changed)]), exclude_ids={image_id for image_id, _ in reused.values()}
+        ) if changed else []
+        option_ids = match_event_ids(np.array(image_vectors[len(changed):])) if options else []
+        music = match_music(music_vectors) if music_vectors else []
+
+        for i, event in enumerate(new_events):
+            if i in reused:
+                image_id, event["music_file"] = reused[i]
+            else:
+                position = changed.index(i)
+                image_id, event["music_file"] = event_ids[position], music[position]
+            event["image"] = self.image_url.format(image_id)
+        for position, (i, j) in enumerate(options):
+            option = new_events[i]["options"][j]
+            option["img"] = self.image_url.format(option_ids[position])
+            option["music_file"] = music[len(changed) + position]
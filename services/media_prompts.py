@@ -0,0 +1,60 @@
+"""
+Retrieval prompts of a turn's media and the assignment of the results to its events.
+
+Kept free of the retrieval modules (which load the indexes at import) so the loops can be
+benchmarked offline (benchmarks/micro.py).
+"""
+
+IMAGE_URL = "https://uchronia.s3.eu-west-3.amazonaws.com/image_{}.png"
+
+
+def media_prompts(new_events):
+    """
+    Collect the image and music prompts of every new event and option.
+
+    Returns:
+        dict: Prompt lists "event_images", "option_images" and "music", with the
+        (event index, option index or None) each prompt belongs to in "event_indices",
+        "option_indices" and "music_indices"
+    """
+    prompts = {
+        "event_images": [], "event_indices": [],
+        "option_images": [], "option_indices": [],
+        "music": [], "music_indices": [],
+    }
+    for event_idx, event in enumerate(new_events):
+        # Event image prompt
+        prompts["event_images"].append(event["title"] + " - Year : " + event["date"])
+        prompts["event_indices"].append((event_idx, None))
+
+        # Event music prompt
+        prompts["music"].append(event["title"] + " " + " ".join(event["description"] or []))
+        prompts["music_indices"].append((event_idx, None))
+
+        # Option prompts
+        for option_idx, option in enumerate(event["options"]):
+            # Option image prompt
+            prompts["option_images"].append(option["title"] + "- Year :" + event["date"])
+            prompts["option_indices"].append((event_idx, option_idx))
+
+            # Option music prompt
+            prompts["music"].append(option["title"] + " " + event["title"])
+            prompts["music_indices"].append((event_idx, option_idx))
+    return prompts
+
+
+def apply_media(new_events, prompts, event_image_ids, option_image_ids, music_files):
+    """Write the retrieved library images and music onto the events and options, in place."""
+    music_indices = prompts["music_indices"]
+
+    # Assign event images and music
+    for i, (event_idx, _) in enumerate(prompts["event_indices"]):
+        event = new_events[event_idx]
+        event["image"] = IMAGE_URL.format(event_image_ids[i])
+        event["music_file"] = music_files[music_indices.index((event_idx, None))]
+
+    # Assign option images and music
+    for i, (event_idx, option_idx) in enumerate(prompts["option_indices"]):
+        option = new_events[event_idx]["options"][option_idx]
+        option["img"] = IMAGE_URL.format(option_image_ids[i])
+        option["music_file"] = music_files[music_indices.index((event_idx, option_idx))]
@@ -0,0 +1,163 @@
+import os
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from prometheus_client import (
+    CONTENT_TYPE_LATEST,
+    CollectorRegistry,
+    Counter,
+    Gauge,
+    Histogram,
+    generate_latest,
+    multiprocess,
+)
+
+# Latency buckets (seconds) covering sub-millisecond cache hits up to slow LLM calls
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60, 120)
+# Event loop lag buckets (seconds): a healthy loop stays in the first few
+LAG_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5)
+
+# Stage timings of the request being profiled (see services/profiling.py)
+_stage_trace = ContextVar("stage_trace", default=None)
+
+LLM_CALL_SECONDS = Histogram(
+    "uchronia_llm_call_seconds",
+    "Latency of LLM calls by pipeline stage, model and outcome",
+    ["stage", "model", "outcome"],
+    buckets=LATENCY_BUCKETS,
+)
+LLM_HEDGES = Counter(
+    "uchronia_llm_hedges_total",
+    "Hedged requests sent because the primary model exceeded its hedge delay",
+    ["stage"],
+)
+LLM_TOKENS = Counter(
+    "uchronia_llm_tokens_total",
+    "Tokens of LLM and embedding calls by stage, model and kind (prompt/completion)",
+    ["stage", "model", "kind"],
+)
+LLM_COST = Counter(
+    "uchronia_llm_cost_usd_total",
+    "Estimated dollar cost of LLM and embedding calls by stage and model",
+    ["stage", "model"],
+)
+LLM_BUDGET_DOWNGRADES = Counter(
+    "uchronia_llm_budget_downgrades_total",
+    "Calls routed to the cheaper models because a budget was spent, by stage and budget",
+    ["stage", "budget"],
+)
+STAGE_SECONDS = Histogram(
+    "uchronia_stage_seconds",
+    "Latency of request stages (embedding, retrieval, Seelab calls, whole turns)",
+    ["stage"],
+    buckets=LATENCY_BUCKETS,
+)
+STAGE_ERRORS = Counter(
+    "uchronia_stage_errors_total",
+    "Stages that raised an exception",
+    ["stage"],
+)
+IMAGE_TASKS_IN_FLIGHT = Gauge(
+    "uchronia_image_tasks_in_flight",
+    "Background image generation tasks currently running",
+    multiprocess_mode="livesum",
+)
+CACHE_REQUESTS = Counter(
+    "uchronia_cache_requests_total",
+    "Cache lookups by cache name and result (hit/miss)",
+    ["cache", "result"],
+)
+TURN_FALLBACKS = Counter(
+    "uchronia_turn_fallbacks_total",
+    "Turns answered with fallback events, by reason (budget, deadline, error)",
+    ["reason"],
+)
+EVENT_LOOP_LAG = Histogram(
+    "uchronia_event_loop_lag_seconds",
+    "Delay of the event loop waking up a periodic timer (time the loop was blocked)",
+    buckets=LAG_BUCKETS,
+)
+THREADPOOL_BUSY = Gauge(
+    "uchronia_threadpool_busy_threads",
+    "Threads of the run_in_threadpool pool currently in use",
+    multiprocess_mode="livesum",
+)
+ADMISSION_ACTIVE = Gauge(
+    "uchronia_admission_active",
+    "Requests currently holding an admission slot",
+    ["endpoint_class"],
+    multiprocess_mode="livesum",
+)
+ADMISSION_QUEUE_DEPTH = Gauge(
+    "uchronia_admission_queue_depth",
+    "Requests waiting for an admission slot",
+    ["endpoint_class"],
+    multiprocess_mode="livesum",
+)
+ADMISSION_REJECTED = Counter(
+    "uchronia_admission_rejected_total",
+    "Requests rejected by admission control, by endpoint class and reason",
+    ["endpoint_class", "reason"],
+)
+
+
+@contextmanager
+def time_stage(stage):
+    """
+    Record the duration of the wrapped block in the stage histogram.
+
+    Exceptions are counted in uchronia_stage_errors_total and re-raised.
+
+    Example:
+        >>> with time_stage("embedding"):
+        ...     vectors = get_embeddings(texts)
+    """
+    start = time.perf_counter()
+    failed = False
+    try:
+        yield
+    except BaseException:
+        failed = True
+        STAGE_ERRORS.labels(stage).inc()
+        raise
+    finally:
+        elapsed = time.perf_counter() - start
+        STAGE_SECONDS.labels(stage).observe(elapsed)
+        trace = _stage_trace.get()
+        if trace is not None:
+            trace.append({"stage": stage, "start": start, "seconds": elapsed, "error": failed})
+
+
+def trace_stages():
+    """Collect the time_stage timings of the current request (and its tasks) into the returned list."""
+    trace = []
+    _stage_trace.set(trace)
+    return trace
+
+
+def record_cache(cache, hit):
+    CACHE_REQUESTS.labels(cache, "hit" if hit else "miss").inc()
+
+
+def mark_worker_dead():
+    """Drop this worker's live gauges from the shared multiprocess directory on shutdown."""
+    if os.getenv("PROMETHEUS_MULTIPROC_DIR"):
+        multiprocess.mark_process_dead(os.getpid())
+
+
+def render_metrics():
+    """
+    Render all metrics in the Prometheus text format.
+
+    When PROMETHEUS_MULTIPROC_DIR is set (multi-worker deployments), the samples of every
+    worker are aggregated so each scrape covers the whole container.
+
+    Returns:
+        tuple[bytes, str]: Exposition payload and its content type
+    """
+    if os.getenv("PROMETHEUS_MULTIPROC_DIR"):
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        return generate_latest(registry), CONTENT_TYPE_LATEST
+    return generate_latest(), CONTENT_TYPE_LATEST
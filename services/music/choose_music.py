@@ -1,39 +1,74 @@
 import openai
-import pandas as pd
+import csv
+import hashlib
 import numpy as np
 import os
-from sklearn.metrics.pairwise import cosine_similarity
 from dotenv import load_dotenv
 from starlette.concurrency import run_in_threadpool
 import asyncio
+from services.cassette import cassette
+from services.http_clients import aembed
+from services.metrics import time_stage
+from services.usage import record_usage
+from services.shared_index import cosine_scores, load_or_build_index
 
 load_dotenv()
 
 openai.api_key = os.getenv("OPENAI_API_KEY")
 
-df = pd.read_csv("services/music/music.csv")
-if not os.path.exists("services/music/embeddings.npy"):
-    save_embeddings(df)
-embeddings = np.load("services/music/embeddings.npy", allow_pickle=True)
+MUSIC_CSV_PATH = "services/music/music.csv"
+EMBEDDINGS_PATH = "services/music/embeddings.npy"
+INDEX_PREFIX = "services/music/music_index"
+EMBEDDING_MODEL = "text-embedding-3-small"
 
+# Plain lists instead of a DataFrame: only two columns are ever read
+with open(MUSIC_CSV_PATH, "r", newline="") as f:
+    rows = list(csv.DictReader(f))
+music_files = [row["File"] for row in rows]
+event_types = [row["Event Type"] for row in rows]
 
-def get_embedding(text, model="text-embedding-3-small"):
+
+def get_embedding(text, model=EMBEDDING_MODEL):
     text = text.replace("\n", " ")
-    response = openai.embeddings.create(input=[text], model=model)
-    return np.array(response.data[0].embedding)
+
+    def embed():
+        response = openai.embeddings.create(input=[text], model=model)
+        record_usage("embedding", model, response.usage.prompt_tokens)
+        return response.data[0].embedding
+
+    with time_stage("embedding"):
+        vector = cassette.call("embedding", {"model": model, "input": [text]}, embed)
+    return np.array(vector)
 
 
 def save_embeddings():
-    event_type_embeddings = [get_embedding(event) for event in df["Event Type"]]
-    np.save("services/music/embeddings.npy", event_type_embeddings)
-    print("Embeddings saved to services/music/embeddings.npy")
+    event_type_embeddings = [get_embedding(event) for event in event_types]
+    np.save(EMBEDDINGS_PATH, event_type_embeddings)
+    print(f"Embeddings saved to {EMBEDDINGS_PATH}")
+
+
+def _embeddings_fingerprint():
+    # Content hash, like the image index: a copied or touched file keeps its index
+    digest = hashlib.sha256()
+    with open(EMBEDDINGS_PATH, "rb") as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(block)
+    return digest.hexdigest()[:16]
+
+
+if not os.path.exists(EMBEDDINGS_PATH):
+    save_embeddings()
+# Normalized, memory-mapped copy of the embeddings shared by every worker process
+embeddings = load_or_build_index(
+    INDEX_PREFIX, _embeddings_fingerprint(), lambda: np.load(EMBEDDINGS_PATH, allow_pickle=True)
+)
 
 
 def choose_music(prompt: str) -> str:
     prompt_embedding = get_embedding(prompt)
-    similarities = cosine_similarity([prompt_embedding], embeddings)
+    similarities = cosine_scores(embeddings, [prompt_embedding])
     best_idx = similarities.argmax()
-    return df.iloc[best_idx]["File"]
+    return music_files[best_idx]
 
 
 async def choose_music_async(prompt: str) -> str:
@@ -56,24 +91,30 @@ def choose_music_batch(prompts: list) -> list:
     """
     # Get embeddings for all prompts at once
     prompt_embeddings = [get_embedding(prompt) for prompt in prompts]
-    
+    return match_music(prompt_embeddings)
+
+
+def match_music(prompt_embeddings):
+    """Closest music file of each prompt embedding."""
     # Compute similarities with the database for all at once
-    similarities = cosine_similarity(prompt_embeddings, embeddings)
+    similarities = cosine_scores(embeddings, prompt_embeddings)
     
     # Get the best index for each query
     best_indices = similarities.argmax(axis=1)
     
     # Convert to music file paths
-    music_files = [df.iloc[idx]["File"] for idx in best_indices]
-    
-    return music_files
+    return [music_files[idx] for idx in best_indices]
 
 
 async def choose_music_batch_async(prompts: list) -> list:
     """
     Async version of choose_music_batch that doesn't block the event loop.
+    Embeds every prompt in one request on the shared async client.
     """
-    return await run_in_threadpool(choose_music_batch, prompts)
+    with time_stage("music_retrieval"):
+        if not prompts:
+            return []
+        return match_music(await aembed(prompts, EMBEDDING_MODEL))
 
 
 if __name__ == "__main__":
@@ -0,0 +1,178 @@
+"""
+End-of-game report maintained incrementally during the game.
+
+With REPORT_MODE=incremental, every completed turn folds the new decision and its
+consequence into a short running summary stored on the session, in the background. At
+the end of the game /exit_game only has to fold in the decisions that are not summarized
+yet, if any, instead of sending the whole timeline to a large model.
+"""
+import asyncio
+import os
+import weakref
+
+from services.llm_router import routed_completion, routed_stream
+
+# "full": /exit_game generates the report from the whole timeline; "incremental": running summary
+REPORT_MODE = os.getenv("REPORT_MODE", "full")
+
+STAGE = "update_report_summary"
+
+# One lock per session so background updates and the final report never fold a decision twice
+_session_locks = weakref.WeakValueDictionary()
+
+
+def session_lock(session_id):
+    lock = _session_locks.get(session_id)
+    if lock is None:
+        lock = _session_locks[session_id] = asyncio.Lock()
+    return lock
+
+
+def decision_key(event, option_idx):
+    """Identify a decision, so a choice made again after a rewind (or on a reused id) is a new one."""
+    return f"{event.id}:{option_idx}:{event.title}"
+
+
+def current_decisions(session):
+    """
+    Decisions of the session's current timeline.
+
+    Returns:
+        list[tuple[str, str]]: (decision key, description of the decision) in timeline order
+    """
+    events = {event.id: event for event in session.events}
+    decisions = []
+    for event_id, option_idx in session.choices.items():
+        event = events.get(event_id)
+        if event is None or option_idx >= len(event.options):
+            continue
+        option = event.options[option_idx]
+        decisions.append((event.date, decision_key(event, option_idx), (
+            f"- {event.date} - {event.title}: the player chose \"{option.title}\". "
+            f"Consequence: {' '.join(option.consequence)}"
+        )))
+    return [(key, text) for _, key, text in sorted(decisions)]
+
+
+def pending_decisions(session):
+    """
+    Split the session's decisions into the running summary to extend and those to fold in.
+
+    When the summary covers a decision that is no longer in the timeline (the player
+    rewound), it describes a dropped branch and is rebuilt from every current decision.
+
+    Returns:
+        tuple[str | None, list[str], list[tuple[str, str]]]: The summary to extend, the keys of
+        the decisions it covers, and the pending (decision key, description) pairs
+    """
+    decisions = current_decisions(session)
+    keys = {key for key, _ in decisions}
+    summarized = list(session.summarized_choices)
+    if any(key not in keys for key in summarized):
+        return None, [], decisions
+    done = set(summarized)
+    return session.report_summary, summarized, [(key, text) for key, text in decisions if key not in done]
+
+
+def build_messages(summary, decisions):
+    system_message = {
+        "role": "system",
+        "content": """
+        We are working on uchronia, a game that displays a chronological timeline, with events and we allow our users to change the course of history.
+
+        At each turn the user picks one of two options of an event. You maintain the end-of-game report:
+        you congratulate the user for the decisions taken and summarize their consequences on history.
+
+        You receive the current report (possibly empty) and the new decisions with their consequences.
+        Rewrite the report so it covers every decision, in 2-3 lines of plain text (no JSON, no title).
+
+        Notes :
+        - The language of the report should be in french.
+    """,
+    }
+    user_message = {
+        "role": "user",
+        "content": f"""
+        Current report : {summary or "(empty)"}
+
+        New decisions :
+        {chr(10).join(decisions)}
+        """,
+    }
+    return [system_message, user_message]
+
+
+async def fold_decisions(summary, decisions, temperature=0.7):
+    completion = await routed_completion(STAGE, build_messages(summary, decisions), temperature=temperature)
+    return completion.choices[0].message.content.strip()
+
+
+async def _commit(session_store, session_id, summary, covered):
+    # Re-read the session: the turn that scheduled us may have saved a newer timeline meanwhile
+    session = await session_store.get(session_id)
+    if session is None:
+        return
+    session.report_summary = summary
+    session.summarized_choices = covered
+    await session_store.save(session)
+
+
+async def refresh_summary(session_store, session_id):
+    """Fold the pending decisions of a session into its running summary (run as a background task)."""
+    async with session_lock(session_id):
+        session = await session_store.get(session_id)
+        if session is None:
+            return
+        summary, covered, pending = pending_decisions(session)
+        if not pending:
+            return
+        try:
+            summary = await fold_decisions(summary, [text for _, text in pending])
+        except Exception as e:
+            # The final report folds in whatever is still pending
+            print(f"Error updating the running report of session {session_id}: {e}")
+            return
+        await _commit(session_store, session_id, summary, covered + [key for key, _ in pending])
+
+
+async def final_summary(session_store, session_id):
+    """
+    Return the end-of-game report of a session, finalizing it only if decisions are pending.
+
+    Returns:
+        str | None: The report, or None if the session does not exist
+    """
+    async with session_lock(session_id):
+        session = await session_store.get(session_id)
+        if session is None:
+            return None
+        summary, covered, pending = pending_decisions(session)
+        if not pending:
+            return summary or ""
+        summary = await fold_decisions(summary, [text for _, text in pending])
+        await _commit(session_store, session_id, summary, covered + [key for key, _ in pending])
+        return summary
+
+
+async def stream_final_summary(session_store, session):
+    """
+    Stream the end-of-game report of a session.
+
+    The precomputed report is sent at once when it is up to date; otherwise the
+    finalization is streamed as it is generated and stored on the session afterwards.
+
+    Yields:
+        str: Pieces of the report text
+    """
+    async with session_lock(session.session_id):
+        session = await session_store.get(session.session_id) or session
+        summary, covered, pending = pending_decisions(session)
+        if not pending:
+            if summary:
+                yield summary
+            return
+        pieces = []
+        async for text in routed_stream(STAGE, build_messages(summary, [t for _, t in pending])):
+            pieces.append(text)
+            yield text
+        await _commit(session_store, session.session_id, "".join(pieces).strip(), covered + [k for k, _ in pending])
@@ -0,0 +1,138 @@
+import json
+import logging
+import os
+import time
+import uuid
+from collections import OrderedDict
+
+from starlette.concurrency import run_in_threadpool
+
+from models.session import GameSession
+from services.metrics import record_cache
+from services.usage import current_tracker
+
+logger = logging.getLogger(__name__)
+
+# Maximum number of sessions kept in memory (least recently used are evicted first)
+MAX_SESSIONS = int(os.getenv("SESSION_MAX_IN_MEMORY", 10000))
+# Persistent backend: "memory" (none) or "file"
+SESSION_BACKEND = os.getenv("SESSION_BACKEND", "memory")
+SESSION_DIR = os.getenv(
+    "SESSION_DIR", os.path.join(os.path.dirname(os.path.dirname(__file__)), "data", "sessions")
+)
+
+
+class SessionBackend:
+    """Interface of a persistent session backend. Methods are blocking and run in the threadpool."""
+
+    def load(self, session_id):
+        raise NotImplementedError
+
+    def save(self, session_id, data):
+        raise NotImplementedError
+
+    def delete(self, session_id):
+        raise NotImplementedError
+
+
+class FileSessionBackend(SessionBackend):
+    """Stores each session as a JSON file, written atomically."""
+
+    def __init__(self, directory=SESSION_DIR):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, session_id):
+        # Session ids are generated uuids, reject anything that could escape the directory
+        return os.path.join(self.directory, f"{uuid.UUID(session_id)}.json")
+
+    def load(self, session_id):
+        try:
+            with open(self._path(session_id), "r") as f:
+                return json.load(f)
+        except (FileNotFoundError, ValueError):
+            return None
+
+    def save(self, session_id, data):
+        path = self._path(session_id)
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(data, f, ensure_ascii=False)
+        os.replace(tmp_path, path)
+
+    def delete(self, session_id):
+        try:
+            os.remove(self._path(session_id))
+        except (FileNotFoundError, ValueError):
+            pass
+
+
+def get_session_backend(name=SESSION_BACKEND):
+    if name == "memory":
+        return None
+    if name == "file":
+        return FileSessionBackend()
+    raise ValueError(f"Unknown session backend: {name}")
+
+
+class SessionStore:
+    """
+    In-memory LRU of game sessions with an optional write-through persistent backend.
+
+    Sessions missing from memory (evicted, or created by another worker) are looked up
+    in the backend and cached again.
+    """
+
+    def __init__(self, backend=None, max_sessions=MAX_SESSIONS):
+        self.backend = backend
+        self.max_sessions = max_sessions
+        self._sessions = OrderedDict()
+
+    def _remember(self, session):
+        self._sessions[session.session_id] = session
+        self._sessions.move_to_end(session.session_id)
+        while len(self._sessions) > self.max_sessions:
+            self._sessions.popitem(last=False)
+
+    async def get(self, session_id):
+        session = self._sessions.get(session_id)
+        record_cache("session_memory", session is not None)
+        if session is not None:
+            self._sessions.move_to_end(session_id)
+            return session
+        if self.backend is None:
+            return None
+        data = await run_in_threadpool(self.backend.load, session_id)
+        record_cache("session_backend", data is not None)
+        if data is None:
+            return None
+        session = GameSession.model_validate(data)
+        self._remember(session)
+        return session
+
+    async def save(self, session):
+        # Usage recorded by the current request since the last save (see services/usage.py)
+        tracker = current_tracker()
+        if tracker is not None:
+            tracker.drain_into(session)
+        session.updated_at = time.time()
+        self._remember(session)
+        if self.backend is not None:
+            await run_in_threadpool(self.backend.save, session.session_id, session.model_dump())
+
+    async def create(self, events, choices=None):
+        now = time.time()
+        session = GameSession(
+            session_id=str(uuid.uuid4()),
+            events=events,
+            choices=choices or {},
+            created_at=now,
+            updated_at=now,
+        )
+        await self.save(session)
+        return session
+
+    async def delete(self, session_id):
+        self._sessions.pop(session_id, None)
+        if self.backend is not None:
+            await run_in_threadpool(self.backend.delete, session_id)
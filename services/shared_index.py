@@ -0,0 +1,220 @@
+"""
+Read-only retrieval indexes shared by all workers through memory-mapped .npy files.
+
+Each index is stored L2-normalized as float32 under a name that carries a fingerprint of
+its source data. Workers only map the file, so its pages live once in the OS page cache
+however many workers run. Build them before starting the workers with:
+
+    python -m services.shared_index
+
+INDEX_DTYPE=float16 or int8 scores a quantized copy of the index instead, which keeps 2x or
+4x fewer pages resident per worker. The INDEX_RERANK_K best candidates of every query are
+then re-scored exactly from the float32 file, of which only those rows are read.
+
+The quantized formats only save memory; they do not score faster. numpy has no float16 or
+int8 matrix-product kernels, so scoring the codes directly is far slower than the float32
+BLAS product (100k x 1536 index, batch of 9 queries: float32 0.2s, int8 codes with int32
+accumulation 2.1s, float16 codes 10.6s). Codes are therefore converted to float32 block by
+block, which is still 2x (int8) to 4x (float16) slower than the exact index; see
+benchmarks/quantized_index.py --direct. Keep the float32 default unless memory is the limit.
+"""
+import glob
+import logging
+import os
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# Storage format of the scored index: float32 (exact, fastest), float16 or int8 (memory-only savings)
+INDEX_DTYPE = os.getenv("INDEX_DTYPE", "float32")
+# Candidates per query re-scored against the exact index when quantized (0 disables)
+INDEX_RERANK_K = int(os.getenv("INDEX_RERANK_K", 16))
+# Rows dequantized at once while scoring, bounds the temporary float32 copy
+SCORE_BLOCK_ROWS = 8192
+INDEX_DTYPES = ("float32", "float16", "int8")
+
+
+def normalize_rows(matrix):
+    """Return a float32 copy of `matrix` with unit-norm rows, so dot products are cosine similarities."""
+    matrix = np.asarray(matrix, dtype=np.float32)
+    norms = np.linalg.norm(matrix, axis=-1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return matrix / norms
+
+
+def quantize(index, dtype):
+    """
+    Quantize a normalized float32 index.
+
+    float16 is a plain cast. int8 uses one symmetric scale per row: the row's largest
+    absolute value maps to 127.
+
+    Returns:
+        tuple[np.ndarray, np.ndarray | None]: The codes and, for int8, the float32 row scales
+    """
+    if dtype == "float16":
+        return np.asarray(index, dtype=np.float16), None
+    if dtype == "int8":
+        peaks = np.abs(index).max(axis=1)
+        peaks[peaks == 0] = 1.0
+        scales = (peaks / 127).astype(np.float32)
+        return np.round(index / scales[:, None]).astype(np.int8), scales
+    raise ValueError(f"Unknown index dtype {dtype!r}, expected one of {INDEX_DTYPES}")
+
+
+class QuantizedIndex:
+    """
+    A quantized index scored block by block, with an optional exact re-rank.
+
+    Saves resident memory at the cost of scoring time (see the module docstring).
+
+    Attributes:
+        codes: (n_items, dim) float16 or int8 matrix, memory-mapped
+        scales: Per-row int8 scales, or None for float16
+        exact: The normalized float32 index, memory-mapped (used for the re-rank)
+        rerank_k: Candidates per query re-scored exactly (0 disables)
+    """
+
+    def __init__(self, codes, scales, exact, rerank_k=INDEX_RERANK_K):
+        self.codes = codes
+        self.scales = scales
+        self.exact = exact
+        self.rerank_k = rerank_k
+        self.shape = codes.shape
+        self.dtype = codes.dtype
+
+    @property
+    def nbytes(self):
+        return self.codes.nbytes + (self.scales.nbytes if self.scales is not None else 0)
+
+    def approximate_scores(self, queries):
+        # Blocks are converted to float32 for the BLAS product; the int8 row scales are
+        # applied once to the scores rather than to the codes
+        scores = np.empty((len(queries), self.shape[0]), dtype=np.float32)
+        for start in range(0, self.shape[0], SCORE_BLOCK_ROWS):
+            block = np.asarray(self.codes[start:start + SCORE_BLOCK_ROWS], dtype=np.float32)
+            scores[:, start:start + len(block)] = queries @ block.T
+        if self.scales is not None:
+            scores *= self.scales
+        return scores
+
+    def scores(self, queries):
+        queries = normalize_rows(queries)
+        scores = self.approximate_scores(queries)
+        k = min(self.rerank_k, self.shape[0])
+        if k:
+            candidates = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+            for row, rows in enumerate(candidates):
+                rows = np.sort(rows)
+                scores[row, rows] = np.asarray(self.exact[rows]) @ queries[row]
+        return scores
+
+
+def cosine_scores(index, queries):
+    """
+    Cosine similarities between queries and a normalized index.
+
+    Args:
+        index: Normalized (n_items, dim) matrix, typically memory-mapped, or a QuantizedIndex
+        queries: (n_queries, dim) query vectors
+
+    Returns:
+        np.ndarray: (n_queries, n_items) similarity matrix
+    """
+    if isinstance(index, QuantizedIndex):
+        return index.scores(queries)
+    return normalize_rows(queries) @ index.T
+
+
+def unique_best_indices(similarities, used_indices=()):
+    """
+    Greedily give each query its most similar item not taken by an earlier query.
+
+    Args:
+        similarities: (n_queries, n_items) similarity matrix
+        used_indices: Items already taken
+
+    Returns:
+        list[int]: One item index per query, in query order
+    """
+    # Track already used indices to avoid duplicates
+    used_indices = set(used_indices)
+    best_indices = []
+
+    # For each query, find the best unused index
+    for row in similarities:
+        # Get indices sorted by similarity (highest to lowest)
+        sorted_indices = row.argsort()[::-1]
+
+        # Find the first index that hasn't been used yet
+        for idx in sorted_indices:
+            if idx not in used_indices:
+                best_indices.append(idx)
+                used_indices.add(idx)
+                break
+    return best_indices
+
+
+def _save_atomic(prefix, fingerprint, path, array):
+    tmp_path = f"{prefix}.{fingerprint}.{os.getpid()}.tmp.npy"
+    np.save(tmp_path, array)
+    os.replace(tmp_path, path)
+
+
+def load_or_build_index(prefix, fingerprint, build, force=False, dtype=INDEX_DTYPE):
+    """
+    Memory-map the index `{prefix}.{fingerprint}.npy`, building it first if needed.
+
+    The file is written to a temporary path and moved into place, so concurrent workers
+    building the same index never read a partial file. Indexes left over from older
+    fingerprints are removed. With a quantized dtype, the codes (and int8 scales) are
+    derived from the float32 file into `{prefix}.{fingerprint}.{dtype}.npy`.
+
+    Args:
+        prefix: Path prefix of the index file
+        fingerprint: Identifier of the source data the index is built from
+        build: Zero-argument callable returning the raw (n_items, dim) embeddings
+        force: Rebuild the index even if it already exists
+        dtype: float32, float16 or int8
+
+    Returns:
+        np.memmap | QuantizedIndex: Read-only normalized float32 index, or its quantized copy
+    """
+    path = f"{prefix}.{fingerprint}.npy"
+    if force or not os.path.exists(path):
+        logger.info(f"Building shared index {path}")
+        _save_atomic(prefix, fingerprint, path, normalize_rows(build()))
+        for stale in glob.glob(f"{glob.escape(prefix)}.*.npy"):
+            if stale != path and not stale.endswith(".tmp.npy"):
+                try:
+                    os.remove(stale)
+                except FileNotFoundError:
+                    pass
+    exact = np.load(path, mmap_mode="r")
+    if dtype == "float32":
+        return exact
+
+    codes_path = f"{prefix}.{fingerprint}.{dtype}.npy"
+    scales_path = f"{prefix}.{fingerprint}.{dtype}_scales.npy"
+    if not os.path.exists(codes_path) or (dtype == "int8" and not os.path.exists(scales_path)):
+        logger.info(f"Building {dtype} copy of shared index {path}")
+        codes, scales = quantize(exact, dtype)
+        if scales is not None:
+            _save_atomic(prefix, fingerprint, scales_path, scales)
+        _save_atomic(prefix, fingerprint, codes_path, codes)
+    scales = np.load(scales_path) if dtype == "int8" else None
+    logger.info(f"Using the {dtype} copy of {path}: less memory, slower scoring than float32")
+    return QuantizedIndex(np.load(codes_path, mmap_mode="r"), scales, exact)
+
+
+def main():
+    # Importing the retrieval modules builds (or validates) every shared index
+    import services.create_rag.choose_image  # noqa: F401
+    import services.music.choose_music  # noqa: F401
+
+    print("✅ Shared retrieval indexes are ready")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,188 @@
+import logging
+import os
+from collections import OrderedDict
+
+import litellm
+
+from services.metrics import record_cache
+
+logger = logging.getLogger(__name__)
+
+# Number of most recent events rendered in full, older ones are summarized
+RECENT_EVENTS = int(os.getenv("TIMELINE_RECENT_EVENTS", 3))
+# Maximum length of the description excerpt kept in a summary line
+SUMMARY_EXCERPT_CHARS = int(os.getenv("TIMELINE_SUMMARY_EXCERPT_CHARS", 160))
+# Number of sessions whose summary is kept in memory
+SUMMARY_CACHE_SIZE = int(os.getenv("TIMELINE_SUMMARY_CACHE_SIZE", 1024))
+# Also count the tokens of the legacy `{events}` repr in the per-turn report (debug logging only)
+COMPARE_WITH_REPR = os.getenv("TIMELINE_CONTEXT_COMPARE", "0") == "1"
+
+# session_id -> {"keys": [(id, title, chosen option) of the events already summarized], "lines": [summary lines]}
+_summary_cache = OrderedDict()
+
+
+def _field(event, name):
+    """Read a field from either a pydantic Event or a plain dict event."""
+    if isinstance(event, dict):
+        return event.get(name)
+    return getattr(event, name, None)
+
+
+def _description_text(event):
+    description = _field(event, "description") or []
+    if isinstance(description, str):
+        description = [description]
+    return " ".join(" ".join(paragraph.split()) for paragraph in description if paragraph)
+
+
+def _chosen_option_title(event, choices):
+    if not choices or _field(event, "id") not in choices:
+        return None
+    options = _field(event, "options") or []
+    option_idx = int(choices[_field(event, "id")])
+    if option_idx >= len(options):
+        return None
+    return _field(options[option_idx], "title")
+
+
+def summarize_event(event, choices=None):
+    """
+    Render an older event as a single compact line.
+
+    Args:
+        event: Event (pydantic model or dict)
+        choices: Optional mapping of event id to the index of the option the player chose
+
+    Returns:
+        str: "- #id [date] title: excerpt" followed by the chosen option when known
+    """
+    excerpt = _description_text(event)
+    if len(excerpt) > SUMMARY_EXCERPT_CHARS:
+        excerpt = excerpt[:SUMMARY_EXCERPT_CHARS].rsplit(" ", 1)[0] + "…"
+    line = f"- #{_field(event, 'id')} [{_field(event, 'date')}] {_field(event, 'title')}"
+    if excerpt:
+        line += f": {excerpt}"
+    chosen = _chosen_option_title(event, choices)
+    if chosen:
+        line += f" (choix : {chosen})"
+    return line
+
+
+def format_event(event, choices=None):
+    """
+    Render a recent event in full, keeping only the option the player chose.
+
+    Args:
+        event: Event (pydantic model or dict)
+        choices: Optional mapping of event id to the index of the option the player chose
+
+    Returns:
+        str: Multi-line description of the event
+    """
+    lines = [f"#{_field(event, 'id')} [{_field(event, 'date')}] {_field(event, 'title')}"]
+    description = _description_text(event)
+    if description:
+        lines.append(description)
+    chosen = _chosen_option_title(event, choices)
+    if chosen:
+        lines.append(f"Choix : {chosen}")
+    return "\n".join(lines)
+
+
+def _summary_key(event, choices):
+    """
+    Identify the summary line of an event without reading its text.
+
+    Timelines only grow between turns, and a rewind drops the later events and their
+    choices, so the id, title and chosen option tell a cached line from a stale one.
+    """
+    event_id = _field(event, "id")
+    return (event_id, _field(event, "title"), choices.get(event_id) if choices else None)
+
+
+def _older_summary(older, session_id, choices):
+    """Return summary lines for the older events, extending the session's cached summary."""
+    keys = [_summary_key(event, choices) for event in older]
+    cached = _summary_cache.get(session_id) if session_id else None
+
+    hit = cached is not None and keys[: len(cached["keys"])] == cached["keys"]
+    if session_id:
+        record_cache("timeline_summary", hit)
+
+    if hit:
+        _summary_cache.move_to_end(session_id)
+        start = len(cached["keys"])
+        lines = cached["lines"]
+    else:
+        # Cache miss or the timeline diverged from the cached prefix (player rewound)
+        cached = {"keys": [], "lines": []}
+        start = 0
+        lines = cached["lines"]
+
+    for event in older[start:]:
+        lines.append(summarize_event(event, choices))
+    cached["keys"] = keys
+
+    if session_id:
+        _summary_cache[session_id] = cached
+        while len(_summary_cache) > SUMMARY_CACHE_SIZE:
+            _summary_cache.popitem(last=False)
+    return lines
+
+
+def build_timeline_context(events, session_id=None, choices=None, recent=RECENT_EVENTS):
+    """
+    Build the timeline text interpolated into the generation prompts.
+
+    The `recent` last events are kept in full, older events are reduced to one summary
+    line each and options the player did not choose are dropped. When a session id is
+    given, the summary of older events is cached and only extended with the events that
+    aged out since the previous turn.
+
+    Args:
+        events: Chronologically sorted events, the last one being the event just played
+        session_id: Optional session id used to cache the older events summary
+        choices: Optional mapping of event id to the index of the option the player chose
+        recent: Number of trailing events rendered in full
+
+    Returns:
+        str: Prompt-ready timeline context
+    """
+    recent = max(recent, 1)
+    older, latest = events[:-recent], events[-recent:]
+
+    sections = []
+    if older:
+        summary = _older_summary(older, session_id, choices)
+        sections.append("Chronologie antérieure (résumé) :\n" + "\n".join(summary))
+    sections.append("Événements récents :\n" + "\n\n".join(format_event(e, choices) for e in latest))
+    return "\n\n".join(sections)
+
+
+def count_tokens(text, model="gpt-4o"):
+    return litellm.token_counter(model=model, text=text)
+
+
+def log_token_report(events, context, model="gpt-4o"):
+    """
+    Log and return the token footprint of the timeline context for the current turn.
+
+    Tokenizing is not free on the turn's critical path, so nothing is counted unless
+    debug logging is enabled for this module.
+
+    Args:
+        events: Events the context was built from
+        context: Output of build_timeline_context
+        model: Model whose tokenizer is used for counting
+
+    Returns:
+        dict | None: Event count, context tokens and, when enabled, the tokens of the raw
+        events repr; None when debug logging is off
+    """
+    if not logger.isEnabledFor(logging.DEBUG):
+        return None
+    report = {"events": len(events), "context_tokens": count_tokens(context, model)}
+    if COMPARE_WITH_REPR:
+        report["repr_tokens"] = count_tokens(f"{events}", model)
+    logger.debug(f"Timeline context token report: {report}")
+    return report
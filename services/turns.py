@@ -0,0 +1,184 @@
+"""
+Building blocks of a game turn, shared by update_events and the offline branch tree builder.
+"""
+import asyncio
+import copy
+import json
+import logging
+import os
+import random
+import time
+import uuid
+from collections import OrderedDict
+
+from services.create_rag.choose_image import find_closest_event_ids_async
+from services.generate_events import generate_narrative_arc_events
+from services.media_prefetch import MEDIA_PIPELINE, MediaPrefetch
+from services.media_prompts import IMAGE_URL, apply_media, media_prompts
+from services.metrics import record_cache, time_stage
+from services.music.choose_music import choose_music_batch_async
+
+logger = logging.getLogger(__name__)
+
+# Turns kept in memory after a generation finished too late to be served (see TurnCache)
+TURN_CACHE_SIZE = int(os.getenv("TURN_CACHE_SIZE", 512))
+# Variants kept per turn, the oldest are dropped first
+TURN_CACHE_VARIANTS = int(os.getenv("TURN_CACHE_VARIANTS", 4))
+STARTING_DECK_PATH = os.path.join(os.path.dirname(os.path.dirname(__file__)), "data", "starting_deck.json")
+
+
+def load_initial_events():
+    """Read the starting deck JSON file and convert it to the Event layout"""
+    # Read the JSON file
+    with open(STARTING_DECK_PATH, "r") as f:
+        data = json.load(f)
+
+    # Convert the data to match our API model
+    events = []
+    for story in data["stories"]:
+        # For each story, create an event
+        event = {
+            "id": story["id"],
+            "title": story["title"],
+            "description": story["description"],
+            "image": story["img"],  # No image links in the source data
+            "date": story["date"],  # No dates in the source data
+            "music_file": story["music_file"],
+            "options": []
+        }
+
+        # For each option in the story, create an option with its consequence
+        for option in story["options"]:
+            event["options"].append({
+                "title": option["title"],
+                "img": option["img"],
+                "consequence": option["consequence"],
+                "music_file": option["music_file"]
+            })
+
+        events.append(event)
+
+    return events[:4]  # Return only the first 4 events to match the expected response
+
+
+async def assign_media(new_events):
+    """Pick the library image and the music of every new event and option, in place."""
+    # Prepare all prompts for image finding at once
+    logger.info("Preparing batch processing for images and music...")
+    batch_start = time.time()
+    prompts = media_prompts(new_events)
+
+    # Process all image IDs and music selections concurrently using async functions
+    logger.info(f"Finding image IDs and music for all events and options...")
+
+    # Run the async operations concurrently to save time
+    with time_stage("media_retrieval"):
+        event_image_ids, option_image_ids, all_music_files = await asyncio.gather(
+            find_closest_event_ids_async(prompts["event_images"]),
+            find_closest_event_ids_async(prompts["option_images"]),
+            choose_music_batch_async(prompts["music"])
+        )
+
+    # Now assign all the results back to the events and options
+    logger.info("Assigning image IDs and music files...")
+    apply_media(new_events, prompts, event_image_ids, option_image_ids, all_music_files)
+
+    logger.info(f"Batch processing completed in {time.time() - batch_start:.2f} seconds")
+
+
+def plan_image_tasks(new_events):
+    """
+    Create the image generation tasks of a turn.
+
+    Returns:
+        tuple[list, list]: (prompt, task_id) pairs to generate, and the image_tasks
+        entries returned to the client
+    """
+    prompts = []
+    image_tasks = []
+    for event in new_events:
+        # Main event image
+        task_id = str(uuid.uuid4())
+        prompts.append((event["title"], task_id))
+        image_tasks.append({
+            "event_id": event["id"],
+            "task_id": task_id,
+            "type": "event"
+        })
+
+        # Options images
+        for idx, option in enumerate(event["options"]):
+            option_task_id = str(uuid.uuid4())
+            prompts.append((option["title"], option_task_id))
+            image_tasks.append({
+                "event_id": event["id"],
+                "option_id": idx,
+                "task_id": option_task_id,
+                "type": "option"
+            })
+    return prompts, image_tasks
+
+
+async def generate_turn(filtered_events, chosen_option, session_id=None, choices=None):
+    """
+    Generate the new events of a turn with their library images and music.
+
+    Args:
+        filtered_events: Timeline up to and including the chosen event
+        chosen_option: Dict with the title and consequence of the chosen option
+        session_id: Optional session id, used to cache the timeline summary
+        choices: Optional event id -> chosen option index
+
+    Returns:
+        list[dict]: The new events
+    """
+    generation_start = time.time()
+    # MEDIA_PIPELINE=speculative retrieves the events' media while the narrative arc is formatted
+    prefetch = MediaPrefetch(IMAGE_URL) if MEDIA_PIPELINE == "speculative" else None
+    try:
+        with time_stage("generate_events"):
+            new_events = await generate_narrative_arc_events(
+                filtered_events, chosen_option, session_id=session_id, choices=choices,
+                on_narrative_arc=prefetch.start if prefetch else None,
+            )
+    except BaseException:
+        if prefetch:
+            prefetch.cancel()
+        raise
+    logger.info(f"Events generation completed in {time.time() - generation_start:.2f} seconds")
+    logger.info(f"Generated {len(new_events)} new events")
+    if prefetch:
+        await prefetch.finish(new_events)
+    else:
+        await assign_media(new_events)
+    return new_events
+
+
+class TurnCache:
+    """
+    Recently generated turns keyed by turn signature (see services/branch_tree.py).
+
+    Generations that finish after the turn was answered in degraded mode land here, so the
+    next player (or retry) reaching the same timeline gets the real events immediately.
+    """
+
+    def __init__(self, max_turns=TURN_CACHE_SIZE, max_variants=TURN_CACHE_VARIANTS):
+        self.max_turns = max_turns
+        self.max_variants = max_variants
+        self._turns = OrderedDict()
+
+    def get(self, signature):
+        events = self._turns.get(signature)
+        record_cache("turn", events is not None)
+        if events is None:
+            return None
+        self._turns.move_to_end(signature)
+        return copy.deepcopy(random.choice(events))
+
+    def put(self, signature, events):
+        variants = self._turns.setdefault(signature, [])
+        variants.append(copy.deepcopy(events))
+        del variants[:-self.max_variants]
+        self._turns.move_to_end(signature)
+        while len(self._turns) > self.max_turns:
+            self._turns.popitem(last=False)
@@ -0,0 +1,152 @@
+"""
+Token and cost accounting of LLM and embedding calls, with spending budgets.
+
+Every call is counted in Prometheus per stage and model. Calls made while a game session
+is being served are also attributed to it: handlers call track_session(), which puts a
+UsageTracker in a context variable (inherited by background tasks and streamed
+responses of the same request), and SessionStore.save() moves what it recorded into
+GameSession.usage, so the per-session totals persist with the session.
+
+Budgets make the router switch to each stage's cheaper models (see ROUTES in
+services/llm_router.py) once the session or this worker's hourly spend exceeds them:
+
+    SESSION_BUDGET_USD=0.05 GLOBAL_BUDGET_USD_PER_HOUR=5 uvicorn api.main:app
+"""
+import logging
+import os
+import time
+from collections import deque
+from contextvars import ContextVar
+
+import litellm
+
+from services.metrics import LLM_COST, LLM_TOKENS
+
+logger = logging.getLogger(__name__)
+
+# Spend after which a session's calls use the cheaper models (0 disables)
+SESSION_BUDGET_USD = float(os.getenv("SESSION_BUDGET_USD", 0))
+# Spend of this worker over the last hour after which every call uses the cheaper models (0 disables)
+GLOBAL_BUDGET_USD_PER_HOUR = float(os.getenv("GLOBAL_BUDGET_USD_PER_HOUR", 0))
+GLOBAL_WINDOW_SECONDS = 3600
+
+_tracker = ContextVar("usage_tracker", default=None)
+# (timestamp, cost) of the calls of the last GLOBAL_WINDOW_SECONDS
+_recent_costs = deque()
+_recent_total = 0.0
+
+
+def call_cost(model, prompt_tokens, completion_tokens=0):
+    """Dollar cost of a call from litellm's price table, 0 for models it does not know."""
+    try:
+        prompt_cost, completion_cost = litellm.cost_per_token(
+            model=model, prompt_tokens=prompt_tokens, completion_tokens=completion_tokens
+        )
+    except Exception:
+        return 0.0
+    return prompt_cost + completion_cost
+
+
+def add_usage(usage, stage, prompt_tokens, completion_tokens, cost, calls=1):
+    """Add a call to a stage -> totals dict (the layout of GameSession.usage)."""
+    totals = usage.setdefault(stage, {"calls": 0, "prompt_tokens": 0, "completion_tokens": 0, "cost_usd": 0.0})
+    totals["calls"] += calls
+    totals["prompt_tokens"] += prompt_tokens
+    totals["completion_tokens"] += completion_tokens
+    totals["cost_usd"] += cost
+
+
+def total_cost(usage):
+    return sum(totals["cost_usd"] for totals in usage.values())
+
+
+class UsageTracker:
+    """Usage of one request, not yet saved on its session."""
+
+    def __init__(self, session_id=None, spent=0.0):
+        self.session_id = session_id
+        # Spend already saved on the session, for the budget check
+        self.spent = spent
+        self.pending = {}
+
+    @property
+    def cost(self):
+        return self.spent + total_cost(self.pending)
+
+    def drain_into(self, session):
+        """Move the pending usage onto the session (GameSession.usage)."""
+        if self.session_id not in (None, session.session_id) or not self.pending:
+            return
+        self.session_id = session.session_id
+        for stage, totals in self.pending.items():
+            add_usage(session.usage, stage, totals["prompt_tokens"], totals["completion_tokens"],
+                      totals["cost_usd"], totals["calls"])
+        self.spent = total_cost(session.usage)
+        self.pending = {}
+
+
+def track_session(session=None):
+    """Attribute the calls of the current request (and its background tasks) to `session`."""
+    tracker = UsageTracker(
+        session.session_id if session else None, total_cost(session.usage) if session else 0.0
+    )
+    _tracker.set(tracker)
+    return tracker
+
+
+def current_tracker():
+    return _tracker.get()
+
+
+def _prune_global(now):
+    """Forget the calls older than GLOBAL_WINDOW_SECONDS."""
+    global _recent_total
+    while _recent_costs and now - _recent_costs[0][0] > GLOBAL_WINDOW_SECONDS:
+        _recent_total -= _recent_costs.popleft()[1]
+
+
+def _record_global(cost):
+    global _recent_total
+    now = time.monotonic()
+    _recent_costs.append((now, cost))
+    _recent_total += cost
+    _prune_global(now)
+
+
+def record_usage(stage, model, prompt_tokens, completion_tokens=0):
+    """Count a call in the metrics, the hourly spend and the current session."""
+    cost = call_cost(model, prompt_tokens, completion_tokens)
+    LLM_TOKENS.labels(stage, model, "prompt").inc(prompt_tokens)
+    LLM_TOKENS.labels(stage, model, "completion").inc(completion_tokens)
+    LLM_COST.labels(stage, model).inc(cost)
+    _record_global(cost)
+    tracker = _tracker.get()
+    if tracker is not None:
+        add_usage(tracker.pending, stage, prompt_tokens, completion_tokens, cost)
+    logger.debug(f"[{stage}] {model}: {prompt_tokens}+{completion_tokens} tokens, ${cost:.5f}")
+    return cost
+
+
+def record_completion(stage, model, completion):
+    """Record the usage reported in a litellm completion."""
+    usage = getattr(completion, "usage", None)
+    if usage is None:
+        return 0.0
+    return record_usage(stage, model, usage.prompt_tokens or 0, usage.completion_tokens or 0)
+
+
+def budget_exceeded():
+    """
+    Tell whether calls should switch to the cheaper models.
+
+    Returns:
+        str | None: "session" or "global" when that budget is spent, else None
+    """
+    tracker = _tracker.get()
+    if SESSION_BUDGET_USD and tracker is not None and tracker.cost >= SESSION_BUDGET_USD:
+        return "session"
+    if GLOBAL_BUDGET_USD_PER_HOUR:
+        _prune_global(time.monotonic())
+        if _recent_total >= GLOBAL_BUDGET_USD_PER_HOUR:
+            return "global"
+    return None
@@ -1,5 +1,34 @@
 #!/bin/bash
 # Change to the directory containing your app code
 cd "$(dirname "$0")"
-echo "Starting Uvicorn server..."
-uvicorn api.main:app --host 0.0.0.0 --port 8000
\ No newline at end of file
+
+# Number of worker processes (send SIGHUP to restart them one by one)
+WORKERS="${WEB_CONCURRENCY:-1}"
+if [ "$WORKERS" -gt 1 ]; then
+    # Workers write their metrics to a shared directory, aggregated by /metrics
+    export PROMETHEUS_MULTIPROC_DIR="${PROMETHEUS_MULTIPROC_DIR:-/tmp/uchronia_metrics}"
+    rm -rf "$PROMETHEUS_MULTIPROC_DIR"
+    mkdir -p "$PROMETHEUS_MULTIPROC_DIR"
+
+    # Delta update_events and exit_game requests can land on any worker: sessions must be shared
+    if [ "${SESSION_BACKEND:-memory}" = "memory" ]; then
+        if [ -n "$SESSION_BACKEND" ]; then
+            echo "SESSION_BACKEND=memory cannot be shared by $WORKERS workers, use SESSION_BACKEND=file" >&2
+            exit 1
+        fi
+        export SESSION_BACKEND=file
+    fi
+    # Always read sessions from the shared backend, another worker may have updated them
+    export SESSION_MAX_IN_MEMORY="${SESSION_MAX_IN_MEMORY:-0}"
+fi
+
+echo "Building shared retrieval indexes..."
+python -m services.shared_index
+
+echo "Hashing static assets..."
+python -m services.assets
+
+echo "Starting Uvicorn server with $WORKERS worker(s)..."
+exec uvicorn api.main:app --host 0.0.0.0 --port 8000 \
+    --workers "$WORKERS" \
+    --timeout-graceful-shutdown "${GRACEFUL_SHUTDOWN_TIMEOUT:-30}"
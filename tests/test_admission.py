@@ -0,0 +1,64 @@
+import asyncio
+
+import pytest
+from fastapi import HTTPException
+
+from services.admission import AdmissionController
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+def test_queued_request_gets_slot_released_by_another():
+    async def scenario():
+        controller = AdmissionController("test", max_concurrent=1, max_queue=1, queue_timeout=1)
+        first = await controller.acquire("a")
+        waiter = asyncio.create_task(controller.acquire("b"))
+        await asyncio.sleep(0)
+        assert controller.queue_depth == 1
+        controller.release("a", first)
+        await waiter
+        assert controller.active == 1 and controller.queue_depth == 0
+        controller.release("b", waiter.result())
+        assert controller.active == 0
+
+    run(scenario())
+
+
+def test_full_queue_is_rejected_with_retry_after():
+    async def scenario():
+        controller = AdmissionController("test", max_concurrent=1, max_queue=0, queue_timeout=1)
+        await controller.acquire("a")
+        with pytest.raises(HTTPException) as rejected:
+            await controller.acquire("b")
+        assert rejected.value.status_code == 503
+        assert int(rejected.value.headers["Retry-After"]) >= 1
+
+    run(scenario())
+
+
+def test_queue_timeout_frees_the_queue_entry():
+    async def scenario():
+        controller = AdmissionController("test", max_concurrent=1, max_queue=1, queue_timeout=0.01)
+        await controller.acquire("a")
+        with pytest.raises(HTTPException) as rejected:
+            await controller.acquire("b")
+        assert rejected.value.status_code == 503
+        assert controller.queue_depth == 0 and controller.active == 1
+        # Clients that gave up are not kept in the per-client table
+        assert dict(controller._clients) == {"a": 1}
+
+    run(scenario())
+
+
+def test_per_client_limit_returns_429():
+    async def scenario():
+        controller = AdmissionController("test", max_concurrent=4, max_queue=4, queue_timeout=1, per_client_limit=1)
+        await controller.acquire("a")
+        with pytest.raises(HTTPException) as rejected:
+            await controller.acquire("a")
+        assert rejected.value.status_code == 429
+        await controller.acquire("b")
+
+    run(scenario())
@@ -0,0 +1,65 @@
+import os
+
+import pytest
+from fastapi.testclient import TestClient
+
+import api.main as main
+from services.assets import ASSET_CACHE_CONTROL, AssetManifest, etag_matches
+
+
+def test_manifest_hashes_assets_and_rehashes_changed_files(tmp_path):
+    (tmp_path / "images").mkdir()
+    image = tmp_path / "images" / "img_1.png"
+    image.write_bytes(b"first")
+    manifest_path = str(tmp_path / "manifest.json")
+
+    manifest = AssetManifest(manifest_path, data_dir=str(tmp_path), dirs=("images",))
+    manifest.save()
+    first_url = manifest.url("data/images/img_1.png")
+    assert first_url.startswith("assets/images/img_1.") and first_url.endswith(".png")
+    assert manifest.url("data/other.png") == "data/other.png"
+    path, etag = manifest.resolve(first_url[len("assets/"):])
+    assert os.path.samefile(path, image) and etag.startswith('"')
+
+    image.write_bytes(b"second")
+    reloaded = AssetManifest(manifest_path, data_dir=str(tmp_path), dirs=("images",))
+    assert reloaded.url("data/images/img_1.png") != first_url
+    assert reloaded.resolve(first_url[len("assets/"):]) is None
+
+
+def test_etag_matching():
+    assert etag_matches('"abc"', '"abc"')
+    assert etag_matches('W/"abc", "def"', '"abc"')
+    assert etag_matches("*", '"abc"')
+    assert not etag_matches('"def"', '"abc"') and not etag_matches(None, '"abc"')
+
+
+@pytest.fixture
+def asset_client(tmp_path, monkeypatch):
+    (tmp_path / "images").mkdir()
+    (tmp_path / "images" / "img_1.png").write_bytes(bytes(range(256)) * 8)
+    manifest = AssetManifest(str(tmp_path / "manifest.json"), data_dir=str(tmp_path), dirs=("images",))
+    monkeypatch.setattr(main, "asset_manifest", manifest)
+    return TestClient(main.app), "/" + manifest.url("data/images/img_1.png")
+
+
+def test_asset_is_served_cacheable_with_its_etag(asset_client):
+    client, url = asset_client
+    response = client.get(url)
+    assert response.status_code == 200 and response.content == bytes(range(256)) * 8
+    assert response.headers["cache-control"] == ASSET_CACHE_CONTROL and "immutable" in ASSET_CACHE_CONTROL
+    etag = response.headers["etag"]
+
+    revalidated = client.get(url, headers={"If-None-Match": etag})
+    assert revalidated.status_code == 304 and revalidated.content == b""
+    assert revalidated.headers["etag"] == etag and revalidated.headers["cache-control"] == ASSET_CACHE_CONTROL
+
+
+def test_asset_ranges_and_unknown_hashes(asset_client):
+    client, url = asset_client
+    partial = client.get(url, headers={"Range": "bytes=10-19"})
+    assert partial.status_code == 206 and partial.content == bytes(range(10, 20))
+    assert partial.headers["content-range"] == "bytes 10-19/2048"
+
+    stale = url.rsplit(".", 2)[0] + ".000000000000.png"
+    assert client.get(stale).status_code == 404
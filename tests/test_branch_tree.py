@@ -0,0 +1,88 @@
+import asyncio
+
+from fastapi.testclient import TestClient
+
+import api.main as main
+import services.branch_tree as branch_tree
+from models.event import Event
+from services.branch_tree import BranchTree, build_tree, turn_signature
+from services.turns import load_initial_events
+
+
+def generated_event(event_id="100"):
+    return {"id": event_id, "title": "Generated", "date": "2100-01-01", "description": ["d"],
+            "options": [{"title": "A", "consequence": ["a"]}, {"title": "B", "consequence": ["b"]}]}
+
+
+def test_signature_is_the_same_for_dicts_and_events():
+    deck = load_initial_events()
+    events = [Event.model_validate(e) for e in deck]
+    assert turn_signature(deck, "1", "0") == turn_signature(events, "1", 0)
+    assert turn_signature(deck, "1", 0) != turn_signature(deck, "1", 1)
+    assert turn_signature(deck, "1", 0) != turn_signature(deck[:-1], "1", 0)
+
+
+def test_tree_round_trip_and_pick_returns_a_copy(tmp_path):
+    path = str(tmp_path / "tree.json")
+    tree = BranchTree(path)
+    tree.add_variant("sig", {"events": [generated_event()], "image_tasks": [], "images": []}, depth=1)
+    tree.save()
+
+    loaded = BranchTree(path)
+    assert len(loaded) == 1 and loaded.pick("missing") is None
+    variant = loaded.pick("sig")
+    variant["events"][0]["title"] = "Changed"
+    assert loaded.pick("sig")["events"][0]["title"] == "Generated"
+
+
+def test_build_tree_generates_every_opening_turn_and_resumes(monkeypatch, tmp_path):
+    calls = []
+
+    async def generate_turn(filtered_events, chosen_option, choices=None):
+        calls.append(chosen_option["title"])
+        return [generated_event(str(1000 + len(calls)))]
+
+    monkeypatch.setattr(branch_tree, "generate_turn", generate_turn)
+    tree = BranchTree(str(tmp_path / "tree.json"))
+    options = sum(len(e["options"]) for e in load_initial_events())
+
+    asyncio.run(build_tree(tree, depth=1, variants=2))
+    assert len(tree) == options and len(calls) == 2 * options
+    assert all(len(node["variants"]) == 2 for node in tree.nodes.values())
+
+    # Existing variants are kept: a second build only adds the missing ones
+    asyncio.run(build_tree(tree, depth=1, variants=3))
+    assert len(calls) == 3 * options
+    assert len(BranchTree(tree.path)) == options
+
+
+def test_served_variant_skips_images_stored_or_being_generated(monkeypatch, tmp_path):
+    deck = sorted((Event.model_validate(e) for e in load_initial_events()), key=lambda x: x.date)
+    first = deck[0]
+    signature = turn_signature(deck[:1], first.id, 0)
+    images = [{"prompt": "stored", "task_id": "stored"}, {"prompt": "pending", "task_id": "pending"},
+              {"prompt": "new", "task_id": "new"}]
+    tree = BranchTree(str(tmp_path / "tree.json"))
+    tree.add_variant(signature, {"events": [generated_event()], "image_tasks": [], "images": images}, depth=1)
+    scheduled = []
+
+    async def generate_image_task(prompt, task_id, admission=None):
+        scheduled.append(task_id)
+
+    monkeypatch.setattr(main, "branch_tree", tree)
+    monkeypatch.setattr(main, "generate_image_task", generate_image_task)
+    monkeypatch.setattr(main.image_storage, "exists", lambda task_id: task_id == "stored")
+    monkeypatch.setitem(main.image_task_status, "pending", "processing")
+    monkeypatch.setattr(main, "REPORT_MODE", "full")
+    client = TestClient(main.app)
+
+    payload = {"events": [e.model_dump() for e in deck], "option_chosen": f"{first.id}_0"}
+    response = client.post("/update_events", json=payload)
+    assert response.status_code == 200 and response.json()["events"][0]["title"] == "Generated"
+    assert scheduled == ["new"] and main.image_task_status["stored"] == "completed"
+
+    # A second player served the same variant does not generate the image again
+    assert client.post("/update_events", json=payload).status_code == 200
+    assert scheduled == ["new"]
+    for task_id in ("stored", "new"):
+        main.image_task_status.pop(task_id, None)
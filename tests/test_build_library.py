@@ -0,0 +1,57 @@
+import asyncio
+import json
+import os
+
+import services.create_rag.build_library as build_library_module
+from services.create_rag.build_library import MANIFEST_NAME, build_library
+
+
+def events(count):
+    return [{"id": i, "name": f"Event {i}", "description": "d"} for i in range(count)]
+
+
+def fake_generator(monkeypatch, failures):
+    """Patch the Seelab call: writes the prompt as the image, failing `failures[prompt]` times first."""
+    calls = []
+
+    def generate_image_with_key(api_key, prompt, output_path):
+        calls.append((api_key, prompt))
+        if failures.get(prompt, 0) > 0:
+            failures[prompt] -= 1
+            raise RuntimeError("seelab error")
+        with open(output_path, "w") as f:
+            f.write(prompt)
+
+    monkeypatch.setattr(build_library_module, "SEELAB_API_KEYS", ["key-a", "key-b"])
+    monkeypatch.setattr(build_library_module, "generate_image_with_key", generate_image_with_key)
+    return calls
+
+
+def test_failed_images_are_retried_and_builds_resume(monkeypatch, tmp_path):
+    calls = fake_generator(monkeypatch, {"Event 1: d": 1, "Event 2: d": 2})
+    output = str(tmp_path)
+
+    assert asyncio.run(build_library(events(4), output, retries=1)) == (3, 0, 1)
+    with open(os.path.join(output, MANIFEST_NAME)) as f:
+        manifest = json.load(f)
+    assert sorted(manifest["completed"]) == ["0", "1", "3"] and list(manifest["failed"]) == ["2"]
+    assert not any(name.endswith(".part") for name in os.listdir(output))
+    assert {api_key for api_key, _ in calls} == {"key-a", "key-b"}
+
+    # The next run only builds the image that failed
+    calls.clear()
+    assert asyncio.run(build_library(events(4), output, retries=1)) == (1, 3, 0)
+    assert [prompt for _, prompt in calls] == ["Event 2: d"]
+
+
+def test_verify_regenerates_images_that_no_longer_match(monkeypatch, tmp_path):
+    calls = fake_generator(monkeypatch, {})
+    output = str(tmp_path)
+    asyncio.run(build_library(events(2), output))
+    with open(os.path.join(output, "image_0.png"), "w") as f:
+        f.write("corrupted")
+
+    calls.clear()
+    assert asyncio.run(build_library(events(2), output)) == (0, 2, 0)
+    assert asyncio.run(build_library(events(2), output, verify=True)) == (1, 1, 0)
+    assert [prompt for _, prompt in calls] == ["Event 0: d"]
@@ -0,0 +1,53 @@
+import numpy as np
+
+import services.create_rag.embedding_cache as embedding_cache
+from services.create_rag.embedding_cache import event_text, generate_or_load_embeddings
+
+
+def corpus(*descriptions):
+    return [{"id": i, "name": f"Event {i}", "year": 1900 + i, "description": d} for i, d in enumerate(descriptions)]
+
+
+def fake_embeddings(monkeypatch):
+    """Patch the embeddings call: each text gets a vector from its length, and calls are recorded."""
+    embedded = []
+
+    def get_embeddings(texts):
+        embedded.extend(texts)
+        return np.array([[len(text), 1.0] for text in texts])
+
+    monkeypatch.setattr(embedding_cache, "get_embeddings", get_embeddings)
+    return embedded
+
+
+def test_only_added_or_edited_events_are_embedded_again(monkeypatch, tmp_path):
+    embedded = fake_embeddings(monkeypatch)
+    cache_path = str(tmp_path / "embeddings.npz")
+    events = corpus("a", "b", "c")
+    first, _ = generate_or_load_embeddings(events, cache_path)
+    assert len(embedded) == 3
+
+    # Unchanged cache: nothing is embedded
+    embedded.clear()
+    same, ids = generate_or_load_embeddings(events, cache_path)
+    assert embedded == [] and np.array_equal(same, first) and list(ids) == [0, 1, 2]
+
+    # Event 1 edited, event 2 deleted, event 3 added
+    edited = [events[0], {**events[1], "description": "a longer b"}, corpus("a", "b", "c", "d")[3]]
+    embedded.clear()
+    embeddings, ids = generate_or_load_embeddings(edited, cache_path)
+    assert embedded == [event_text(edited[1]), event_text(edited[2])]
+    assert list(ids) == [0, 1, 3]
+    assert np.array_equal(embeddings[0], first[0]) and embeddings[1][0] == len(event_text(edited[1]))
+
+    cache = np.load(cache_path)
+    assert list(cache["ids"]) == [0, 1, 3] and len(cache["embeddings"]) == 3
+
+
+def test_rebuild_embeds_everything(monkeypatch, tmp_path):
+    embedded = fake_embeddings(monkeypatch)
+    cache_path = str(tmp_path / "embeddings.npz")
+    generate_or_load_embeddings(corpus("a", "b"), cache_path)
+    embedded.clear()
+    generate_or_load_embeddings(corpus("a", "b"), cache_path, rebuild=True)
+    assert len(embedded) == 2
@@ -0,0 +1,52 @@
+import asyncio
+import json
+from types import SimpleNamespace
+
+import services.event_repair as event_repair
+from services.event_repair import check_events, validated_events
+
+
+def option(title):
+    return {"title": title, "consequence": [f"Conséquence de {title}."]}
+
+
+def event(title, options=2):
+    return {
+        "title": title,
+        "date": "2030-01-01",
+        "description": "Une seule chaîne au lieu d'une liste.",
+        "options": [option(f"{title} option {i}") for i in range(options)],
+    }
+
+
+def test_check_events_normalizes_and_reports_gaps():
+    events, broken, missing_options = check_events([event("A"), event("B", options=1)])
+    assert events[0]["description"] == ["Une seule chaîne au lieu d'une liste."]
+    assert broken == {2: "missing"}
+    assert missing_options == {1: 1}
+
+
+def test_only_missing_parts_are_regenerated(monkeypatch):
+    calls = []
+
+    async def fake_completion(stage, messages, **kwargs):
+        calls.append(messages[1]["content"])
+        content = json.dumps({"events": {"2": event("C")}, "options": {"1": [option("B bis")]}})
+        return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content=content))])
+
+    monkeypatch.setattr(event_repair, "routed_completion", fake_completion)
+    events = asyncio.run(validated_events("arc", [event("A"), event("B", options=1)]))
+
+    assert len(calls) == 1
+    assert "events[2] is missing" in calls[0] and "events[1]" in calls[0]
+    assert [e["title"] for e in events] == ["A", "B", "C"]
+    assert [o["title"] for o in events[1]["options"]] == ["B option 0", "B bis"]
+
+
+def test_failed_repair_keeps_complete_events(monkeypatch):
+    async def failing_completion(*args, **kwargs):
+        raise TimeoutError("deadline")
+
+    monkeypatch.setattr(event_repair, "routed_completion", failing_completion)
+    events = asyncio.run(validated_events("arc", [event("A"), {"title": "broken"}]))
+    assert [e["title"] for e in events] == ["A"]
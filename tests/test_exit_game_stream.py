@@ -0,0 +1,88 @@
+import asyncio
+
+import api.main as main
+from models.session import GameSession
+from services.running_report import session_lock
+
+
+def game_session():
+    return GameSession(session_id="stream", events=[], choices={"1": 0}, created_at=0, updated_at=0)
+
+
+async def fake_store_get(session_id):
+    return game_session()
+
+
+async def call_stream(block_body=False, disconnect_after_first=False):
+    """Run POST /exit_game/stream on the ASGI app; returns the body pieces sent."""
+    scope = {
+        "type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1", "method": "POST",
+        "scheme": "http", "path": "/exit_game/stream", "raw_path": b"/exit_game/stream",
+        "query_string": b"session_id=stream", "headers": [], "client": ("test", 1), "server": ("test", 80),
+    }
+    request_read = False
+    first_sent = asyncio.Event()
+    pieces = []
+
+    async def receive():
+        nonlocal request_read
+        if not request_read:
+            request_read = True
+            return {"type": "http.request", "body": b"", "more_body": False}
+        if disconnect_after_first:
+            await first_sent.wait()
+            return {"type": "http.disconnect"}
+        await asyncio.Event().wait()
+
+    async def send(message):
+        if message["type"] == "http.response.body" and message.get("body"):
+            pieces.append(message["body"])
+            first_sent.set()
+            if block_body:
+                # A slow client: the report generator stays suspended at its yield
+                await asyncio.Event().wait()
+
+    await asyncio.wait_for(main.app(scope, receive, send), 5)
+    return pieces
+
+
+def fake_report(pieces):
+    async def stream_final_summary(session_store, session):
+        async with session_lock(session.session_id):
+            for piece in pieces:
+                yield piece
+
+    return stream_final_summary
+
+
+def test_stream_holds_the_report_slot_until_the_body_is_sent(monkeypatch):
+    monkeypatch.setattr(main.session_store, "get", fake_store_get)
+    seen = []
+
+    async def stream_final_summary(session_store, session):
+        seen.append(main.report_admission.active)
+        yield "Bravo"
+        seen.append(main.report_admission.active)
+        yield " !"
+
+    monkeypatch.setattr(main, "stream_final_summary", stream_final_summary)
+    pieces = asyncio.run(call_stream(block_body=False))
+    assert b"".join(pieces) == "Bravo !".encode()
+    # The slot is still held while the second piece is generated, and released afterwards
+    assert seen == [1, 1]
+    assert main.report_admission.active == 0
+
+
+def test_client_disconnect_releases_the_slot_and_the_session_lock(monkeypatch):
+    monkeypatch.setattr(main.session_store, "get", fake_store_get)
+    monkeypatch.setattr(main, "stream_final_summary", fake_report(["Bravo", " !"]))
+
+    async def scenario():
+        lock = session_lock("stream")
+        pieces = await call_stream(block_body=True, disconnect_after_first=True)
+        return pieces, lock.locked()
+
+    pieces, locked = asyncio.run(scenario())
+    assert pieces == ["Bravo".encode()]
+    assert not locked
+    assert main.report_admission.active == 0
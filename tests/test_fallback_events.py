@@ -0,0 +1,84 @@
+import json
+import random
+
+from fastapi.testclient import TestClient
+
+import api.main as main
+from models.event import Event
+from services.fallback_events import FallbackLibrary, classify_theme, era_of, library_entry
+from services.session_store import SessionStore
+
+
+def game_event(title, year, description):
+    return {
+        "title": title,
+        "date": f"{year:04d}-01-01",
+        "description": [description],
+        "image": "",
+        "music_file": "",
+        "options": [{"title": f"Choisir {title}", "consequence": ["Suite."]} for _ in range(2)],
+    }
+
+
+def test_classify_theme_reads_french_and_english():
+    assert classify_theme("La bataille de Verdun, une guerre totale") == "war"
+    assert classify_theme("The invention of the printing press") == "science"
+    assert classify_theme("Un jour comme les autres") == "society"
+    assert era_of(1453) == "middle_ages" and era_of(2300) == "future"
+
+
+def test_pick_prefers_later_events_of_the_chosen_theme(tmp_path):
+    entries = [library_entry(game_event(f"Guerre {year}", year, "Une bataille."), "corpus", year, year)
+               for year in (1500, 1700, 1800, 1900, 1950, 2000)]
+    entries.append(library_entry(game_event("Peinture 1960", 1960, "Un artiste."), "corpus", 1, 1960))
+    path = tmp_path / "fallback.json"
+    path.write_text(json.dumps({"events": entries}))
+    library = FallbackLibrary(str(path))
+
+    chosen = Event(id="4", title="Guerre de Cent Ans", date="1750-01-01", description=["..."], image="", options=[])
+    chosen_option = {"title": "Déclarer la guerre", "consequence": ["Une armée marche."]}
+    picks = library.pick([chosen], chosen_option, rng=random.Random(0))
+
+    # One pick per third of the later war events: soon, later, much later
+    assert [pick["title"] for pick in picks][:2] == ["Guerre 1800", "Guerre 1900"]
+    assert picks[2]["title"] in ("Guerre 1950", "Guerre 2000")
+    assert all("id" not in pick for pick in picks)
+
+
+def test_pick_redates_when_nothing_is_later(tmp_path):
+    entries = [library_entry(game_event(f"Guerre {year}", year, "Une bataille."), "corpus", year, year)
+               for year in (1500, 1600, 1700)]
+    path = tmp_path / "fallback.json"
+    path.write_text(json.dumps({"events": entries}))
+    library = FallbackLibrary(str(path))
+
+    chosen = Event(id="9", title="Guerre", date="2100-06-01", description=["..."], image="", options=[])
+    picks = library.pick([chosen], {"title": "Attaquer", "consequence": ["..."]}, rng=random.Random(0))
+
+    assert [int(pick["date"][:4]) for pick in picks] == [2101, 2125, 2220]
+
+
+def test_degraded_turns_keep_library_images_without_renders(monkeypatch):
+    fallback = game_event("Le premier vol habité", 1903, "Les frères Wright décollent.")
+    fallback["image"] = "https://images.example/library/17.png"
+    fallback["options"][0]["img"] = "https://images.example/library/18.png"
+    monkeypatch.setattr(main, "session_store", SessionStore())
+    monkeypatch.setattr(main, "REPORT_MODE", "full")
+    monkeypatch.setattr(main.branch_tree, "pick", lambda signature: None)
+    monkeypatch.setattr(main.turn_cache, "get", lambda signature: None)
+    planned = []
+    monkeypatch.setattr(main, "plan_image_tasks", lambda new_events: planned.append(new_events) or ([], []))
+
+    async def generate_within_budget(signature, filtered_events, chosen_option, session_id=None, choices=None):
+        return [{**fallback, "id": "2"}], True
+
+    monkeypatch.setattr(main, "generate_within_budget", generate_within_budget)
+    timeline = [Event.model_validate({**game_event("La chute de la Bastille", 1789, "Paris."), "id": "1"})]
+    response = TestClient(main.app).post("/update_events", json={
+        "events": [e.model_dump() for e in timeline], "option_chosen": "1_0",
+    })
+
+    body = response.json()
+    assert response.status_code == 200 and body["degraded"] and body["image_tasks"] == [] and planned == []
+    assert body["events"][0]["image"] == fallback["image"]
+    assert body["events"][0]["options"][0]["img"] == fallback["options"][0]["img"]
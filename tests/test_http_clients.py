@@ -0,0 +1,30 @@
+import asyncio
+
+import services.http_clients as http_clients
+from services.http_clients import close_clients, get_openai_client, http2_enabled
+
+
+def test_http2_setting():
+    assert http2_enabled("1") and not http2_enabled("0")
+    try:
+        import h2  # noqa: F401
+        available = True
+    except ImportError:
+        available = False
+    assert http2_enabled("auto") == available
+
+
+def test_client_is_shared_within_an_event_loop(monkeypatch):
+    monkeypatch.setenv("OPENAI_API_KEY", "test")
+
+    async def clients():
+        first, second = get_openai_client(), get_openai_client()
+        await close_clients()
+        return first, second
+
+    first, second = asyncio.run(clients())
+    assert first is second
+    assert first.max_retries == http_clients.OPENAI_MAX_RETRIES
+    # A new event loop gets its own connection pool
+    other, _ = asyncio.run(clients())
+    assert other is not first
@@ -0,0 +1,69 @@
+import asyncio
+import os
+
+import pytest
+
+import api.main as main
+from services.image_storage import LocalImageStorage, S3ImageStorage
+
+
+def test_local_storage_publishes_spooled_images_on_store(tmp_path):
+    storage = LocalImageStorage(str(tmp_path / "images"))
+    path = storage.spool_path("task")
+    with open(path, "wb") as f:
+        f.write(b"png")
+    # A partly written image is neither listed nor served
+    assert not storage.exists("task") and storage.task_ids() == []
+    storage.store("task", path)
+
+    assert storage.exists("task") and not storage.exists("other") and not os.path.exists(path)
+    assert storage.url("task") == "data/generated_images/task.png"
+    assert storage.task_ids() == ["task"]
+
+
+def test_s3_storage_uploads_and_returns_object_urls(tmp_path, monkeypatch):
+    boto3 = pytest.importorskip("boto3")
+    moto = pytest.importorskip("moto")
+    monkeypatch.setenv("AWS_ACCESS_KEY_ID", "testing")
+    monkeypatch.setenv("AWS_SECRET_ACCESS_KEY", "testing")
+
+    with moto.mock_aws():
+        client = boto3.client("s3", region_name="eu-west-3")
+        client.create_bucket(Bucket="images", CreateBucketConfiguration={"LocationConstraint": "eu-west-3"})
+        storage = S3ImageStorage(bucket="images", prefix="generated/", region="eu-west-3", client=client)
+        path = storage.spool_path("task")
+        with open(path, "wb") as f:
+            # Above one part, so the upload goes through the multipart path
+            f.write(b"\x89PNG" + b"\x00" * (9 * 1024 * 1024))
+        storage.store("task", path)
+
+        head = client.head_object(Bucket="images", Key="generated/task.png")
+        assert head["ContentType"] == "image/png"
+        assert storage.exists("task") and not storage.exists("other")
+        assert list(storage.task_ids()) == ["task"]
+        assert storage.url("task") == "https://images.s3.eu-west-3.amazonaws.com/generated/task.png"
+
+
+def test_image_status_caches_missing_ids_for_a_short_ttl(monkeypatch):
+    storage = LocalImageStorage.__new__(LocalImageStorage)
+    lookups = []
+    stored = set()
+    monkeypatch.setattr(storage, "exists", lambda task_id: lookups.append(task_id) or task_id in stored)
+    monkeypatch.setattr(storage, "url", lambda task_id: f"images/{task_id}.png")
+    monkeypatch.setattr(main, "image_storage", storage)
+    monkeypatch.setattr(main, "image_task_status", {})
+    monkeypatch.setattr(main, "missing_images", {})
+
+    async def poll():
+        return await main._image_status("task")
+
+    # Polls within the TTL do not reach the storage again
+    assert asyncio.run(poll()) == {"status": "processing"}
+    assert asyncio.run(poll()) == {"status": "processing"} and lookups == ["task"]
+
+    # Once the negative entry expires, the storage is asked again
+    stored.add("task")
+    main.missing_images["task"] = 0
+    assert asyncio.run(poll()) == {"status": "completed", "image_url": "images/task.png"}
+    assert asyncio.run(poll())["status"] == "completed" and lookups == ["task", "task"]
+    assert main.missing_images == {}
@@ -0,0 +1,131 @@
+import asyncio
+from types import SimpleNamespace
+
+import litellm
+import pytest
+from prometheus_client import REGISTRY
+
+import services.llm_router as llm_router
+from services.cassette import Cassette, CassetteMiss
+from services.llm_router import LLMDeadlineExceeded, get_latency, rank_models, routed_completion, routed_stream
+
+STAGE = "test_stage"
+
+
+@pytest.fixture(autouse=True)
+def test_route(monkeypatch):
+    monkeypatch.setattr(llm_router, "latency_stats", {})
+    monkeypatch.setitem(llm_router.ROUTES, STAGE, {
+        "models": ["gpt-4o", "gpt-4o-mini"], "budget_models": ["gpt-4o-mini"], "deadline": 1.0, "hedge_after": 0.1,
+    })
+
+
+def completion(content):
+    return litellm.ModelResponse(choices=[{"message": {"role": "assistant", "content": content}}])
+
+
+def fake_acompletion(monkeypatch, behaviours):
+    """Patch litellm.acompletion: model -> (delay, content or exception); records the models called."""
+    calls = []
+
+    async def acompletion(model, **kwargs):
+        calls.append(model)
+        delay, result = behaviours[model]
+        await asyncio.sleep(delay)
+        if isinstance(result, Exception):
+            raise result
+        return completion(result)
+
+    monkeypatch.setattr(litellm, "acompletion", acompletion)
+    return calls
+
+
+def test_unsampled_models_keep_their_configured_position():
+    for _ in range(llm_router.MIN_SAMPLES):
+        get_latency("gpt-4o").record(2.0)
+    assert rank_models(["gpt-4o", "groq/llama-3.3-70b-versatile"]) == ["gpt-4o", "groq/llama-3.3-70b-versatile"]
+
+    for _ in range(llm_router.MIN_SAMPLES):
+        get_latency("groq/llama-3.3-70b-versatile").record(0.5)
+    assert rank_models(["gpt-4o", "groq/llama-3.3-70b-versatile"]) == ["groq/llama-3.3-70b-versatile", "gpt-4o"]
+
+
+def test_models_cooling_down_go_last():
+    get_latency("gpt-4o").record_error()
+    assert rank_models(["gpt-4o", "gpt-4o-mini"]) == ["gpt-4o-mini", "gpt-4o"]
+
+
+def test_slow_primary_is_hedged(monkeypatch):
+    calls = fake_acompletion(monkeypatch, {"gpt-4o": (0.8, "slow"), "gpt-4o-mini": (0.0, "fast")})
+    hedges = REGISTRY.get_sample_value("uchronia_llm_hedges_total", {"stage": STAGE}) or 0.0
+    prompt = {"stage": STAGE, "model": "gpt-4o", "kind": "prompt"}
+    prompt_tokens = REGISTRY.get_sample_value("uchronia_llm_tokens_total", prompt) or 0.0
+
+    async def run():
+        result = await routed_completion(STAGE, [{"role": "user", "content": "hi"}])
+        # Let the losing call handle its cancellation
+        await asyncio.sleep(0)
+        return result
+
+    result = asyncio.run(run())
+    assert result.choices[0].message.content == "fast"
+    assert calls == ["gpt-4o", "gpt-4o-mini"]
+    assert REGISTRY.get_sample_value("uchronia_llm_hedges_total", {"stage": STAGE}) == hedges + 1
+    # The cancelled primary is still billed for its prompt
+    assert REGISTRY.get_sample_value("uchronia_llm_tokens_total", prompt) > prompt_tokens
+
+
+def test_invalid_or_failed_responses_fall_back(monkeypatch):
+    calls = fake_acompletion(monkeypatch, {"gpt-4o": (0.0, "not json"), "gpt-4o-mini": (0.0, '{"ok": 1}')})
+    result = asyncio.run(routed_completion(STAGE, [], validate=lambda content: content.startswith("{")))
+    assert result.choices[0].message.content == '{"ok": 1}' and calls == ["gpt-4o", "gpt-4o-mini"]
+
+    fake_acompletion(monkeypatch, {"gpt-4o": (0.0, RuntimeError("down")), "gpt-4o-mini": (0.0, "ok")})
+    assert asyncio.run(routed_completion(STAGE, [])).choices[0].message.content == "ok"
+    assert get_latency("gpt-4o").cooling_down()
+
+
+def test_deadline_is_enforced(monkeypatch):
+    fake_acompletion(monkeypatch, {"gpt-4o": (5, "late"), "gpt-4o-mini": (5, "late")})
+    with pytest.raises(LLMDeadlineExceeded):
+        asyncio.run(routed_completion(STAGE, []))
+
+
+def test_stream_falls_back_until_a_model_starts_streaming(monkeypatch):
+    calls = []
+
+    async def chunks(pieces):
+        for piece in pieces:
+            yield SimpleNamespace(choices=[SimpleNamespace(delta=SimpleNamespace(content=piece))])
+
+    async def acompletion(model, stream=False, **kwargs):
+        calls.append(model)
+        if model == "gpt-4o":
+            raise RuntimeError("down")
+        return chunks(["Bra", "vo"])
+
+    monkeypatch.setattr(litellm, "acompletion", acompletion)
+
+    async def collect():
+        return [piece async for piece in routed_stream(STAGE, [{"role": "user", "content": "hi"}])]
+
+    assert asyncio.run(collect()) == ["Bra", "vo"]
+    assert calls == ["gpt-4o", "gpt-4o-mini"]
+
+
+def test_cassette_records_and_replays_each_model(monkeypatch, tmp_path):
+    path = str(tmp_path / "cassette.jsonl")
+    messages = [{"role": "user", "content": "hi"}]
+    fake_acompletion(monkeypatch, {"gpt-4o": (0.0, RuntimeError("down")), "gpt-4o-mini": (0.0, "recorded")})
+    monkeypatch.setattr(llm_router, "cassette", Cassette(path, mode="record"))
+    assert asyncio.run(routed_completion(STAGE, messages)).choices[0].message.content == "recorded"
+
+    # Replay never reaches the provider, and the recording belongs to the model that answered it
+    calls = fake_acompletion(monkeypatch, {})
+    replay = Cassette(path, mode="replay", latency_scale=0)
+    monkeypatch.setattr(llm_router, "cassette", replay)
+    monkeypatch.setattr(llm_router, "latency_stats", {})
+    with pytest.raises(CassetteMiss):
+        asyncio.run(llm_router._call("gpt-4o", STAGE, messages, 0.7, 1.0, None))
+    completion = asyncio.run(llm_router._call("gpt-4o-mini", STAGE, messages, 0.7, 1.0, None))
+    assert completion.choices[0].message.content == "recorded" and calls == []
@@ -0,0 +1,86 @@
+import asyncio
+
+import services.media_prefetch as media_prefetch
+from services.media_prefetch import MediaPrefetch, materially_changed, provisional_events
+
+NARRATIVE_ARC = """
+**Rise**: in 1815 the Emperor escapes to America and builds a new empire.
+
+Salient events:
+1. **The Founding of New Paris** (1816): exiles raise a capital on the Mississippi.
+2. Great Steam Revolution - 1850, the continent is covered in railways.
+- **Fall of the Napoleonic Republic** (1921)
+"""
+
+
+def test_provisional_events_are_the_last_listed_lines_with_a_year():
+    events = provisional_events(NARRATIVE_ARC)
+    assert [(event["title"], event["year"]) for event in events] == [
+        ("The Founding of New Paris", 1816),
+        ("Great Steam Revolution", 1850),
+        ("Fall of the Napoleonic Republic", 1921),
+    ]
+    assert events[0]["text"].startswith("The Founding of New Paris (1816)")
+
+
+def test_reconcile_keeps_events_with_the_same_year_and_title():
+    provisional = {"title": "The Founding of New Paris", "year": 1816, "text": ""}
+    assert not materially_changed(provisional, {"title": "Fondation de New Paris", "date": "1816-05-01"})
+    assert materially_changed(provisional, {"title": "Fondation de New Paris", "date": "1817-05-01"})
+    assert materially_changed(provisional, {"title": "Couronnement d'un roi", "date": "1816-05-01"})
+    assert materially_changed(None, {"title": "The Founding of New Paris", "date": "1816-05-01"})
+
+
+def formatted_event(title, date):
+    return {
+        "title": title, "date": date, "description": [f"About {title}."],
+        "options": [{"title": f"{title} A", "consequence": []}, {"title": f"{title} B", "consequence": []}],
+    }
+
+
+def test_finish_reuses_unchanged_picks_and_retrieves_the_rest(monkeypatch):
+    texts, requests, excluded = [], [], []
+
+    # Each text embeds to its position in `texts`, and matches to an image or music named after it
+    async def aembed(batch, model):
+        requests.append(list(batch))
+        texts.extend(batch)
+        return [[len(texts) - len(batch) + i] for i in range(len(batch))]
+
+    def match_event_ids(query_vecs, exclude_ids=()):
+        excluded.append(set(exclude_ids))
+        return [texts[int(vector[0])] for vector in query_vecs]
+
+    def match_music(query_vecs):
+        return [f"music:{texts[int(vector[0])]}" for vector in query_vecs]
+
+    monkeypatch.setattr(media_prefetch, "aembed", aembed)
+    monkeypatch.setattr(media_prefetch, "match_event_ids", match_event_ids)
+    monkeypatch.setattr(media_prefetch, "match_music", match_music)
+    monkeypatch.setattr(media_prefetch, "MUSIC_EMBEDDING_MODEL", media_prefetch.IMAGE_EMBEDDING_MODEL)
+    events = [
+        formatted_event("Fondation de New Paris", "1816-05-01"),
+        formatted_event("Couronnement d'un roi", "1850-01-01"),
+        formatted_event("Fall of the Napoleonic Republic", "1921-03-01"),
+    ]
+
+    async def run():
+        prefetch = MediaPrefetch("img:{}")
+        prefetch.start(NARRATIVE_ARC)
+        await prefetch.finish(events)
+
+    asyncio.run(run())
+    first, second, third = events
+    # Events 1 and 3 kept their year and title: their speculative picks are reused
+    assert first["image"] == "img:The Founding of New Paris - Year : 1816"
+    assert first["music_file"] == "music:The Founding of New Paris (1816): exiles raise a capital on the Mississippi."
+    assert third["image"] == "img:Fall of the Napoleonic Republic - Year : 1921"
+    # Event 2 changed title: it is retrieved again, without the images already picked
+    assert second["image"] == "img:Couronnement d'un roi - Year : 1850-01-01"
+    assert second["music_file"] == "music:Couronnement d'un roi About Couronnement d'un roi."
+    assert excluded[1] == {"The Founding of New Paris - Year : 1816", "Fall of the Napoleonic Republic - Year : 1921"}
+    # Options are only known after formatting, and all of them are retrieved
+    assert third["options"][1]["img"] == "img:Fall of the Napoleonic Republic B- Year :1921-03-01"
+    assert third["options"][1]["music_file"] == "music:Fall of the Napoleonic Republic B Fall of the Napoleonic Republic"
+    # One request for the arc, one for the changed event and the options (image and music prompts)
+    assert len(requests) == 2 and len(requests[1]) == 2 * (1 + 6)
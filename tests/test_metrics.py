@@ -0,0 +1,33 @@
+import time
+
+from prometheus_client import REGISTRY
+
+from services.metrics import record_cache, render_metrics, time_stage
+
+
+def sample(name, **labels):
+    return REGISTRY.get_sample_value(name, labels) or 0.0
+
+
+def test_time_stage_records_observation():
+    before = sample("uchronia_stage_seconds_sum", stage="test_stage")
+    with time_stage("test_stage"):
+        time.sleep(0.01)
+    assert sample("uchronia_stage_seconds_sum", stage="test_stage") - before >= 0.01
+
+
+def test_time_stage_counts_errors():
+    before = sample("uchronia_stage_errors_total", stage="test_failing_stage")
+    try:
+        with time_stage("test_failing_stage"):
+            raise ValueError("boom")
+    except ValueError:
+        pass
+    assert sample("uchronia_stage_errors_total", stage="test_failing_stage") == before + 1
+
+
+def test_render_metrics_exposes_stages():
+    record_cache("test_cache", True)
+    payload, content_type = render_metrics()
+    assert content_type.startswith("text/plain")
+    assert b'uchronia_cache_requests_total{cache="test_cache",result="hit"}' in payload
@@ -0,0 +1,64 @@
+import json
+
+import pytest
+
+from utils.parse_llm_output import parse_json_markdown, parse_json_tolerant
+
+EVENT = {
+    "title": "La chute de la Bastille",
+    "date": "1789-07-14",
+    "description": ["Le peuple de Paris prend la forteresse."],
+    "options": [
+        {"title": "Soutenir le roi", "consequence": ["La monarchie se renforce."]},
+        {"title": "Rejoindre le peuple", "consequence": ["La révolution s'étend."]},
+    ],
+}
+
+
+def test_valid_json_in_markdown_fence():
+    text = "```json\n" + json.dumps({"events": [EVENT]}, ensure_ascii=False) + "\n```"
+    assert parse_json_markdown(text) == {"events": [EVENT]}
+
+
+def test_trailing_and_missing_commas():
+    assert parse_json_markdown('{"a": [1, 2,], "b": {"c": 3,},}') == {"a": [1, 2], "b": {"c": 3}}
+    assert parse_json_markdown('{"a": "x"\n"b": "y"}') == {"a": "x", "b": "y"}
+
+
+def test_unescaped_quotes_and_newlines_in_french_text():
+    text = '{"consequence": ["Le roi déclara "non", puis s\'enfuit.", "Une ligne\nbrisée", "Le "Grand" Soir"]}'
+    assert parse_json_markdown(text) == {
+        "consequence": ['Le roi déclara "non", puis s\'enfuit.', "Une ligne\nbrisée", 'Le "Grand" Soir']
+    }
+    assert parse_json_markdown('{"title": "Base sur la "lune"", "date": "1969"}') == {
+        "title": 'Base sur la "lune"', "date": "1969"
+    }
+    # A quote followed by a comma and a number that does not end at structure stays in the text
+    assert parse_json_markdown('{"description": ["Il dit "oui", 2 fois.", "Puis "non", true story"], "n": 1}') == {
+        "description": ['Il dit "oui", 2 fois.', 'Puis "non", true story'], "n": 1
+    }
+    # Inside an object, a quote followed by `, "` only closes the string before a `"key":`
+    assert parse_json_markdown('{"a": "Il dit "oui", "non" et rien", "b": 2}') == {
+        "a": 'Il dit "oui", "non" et rien', "b": 2
+    }
+    assert parse_json_markdown('{"a": ["x", 2, -1.5 ], "b": "y", "c": null,}') == {"a": ["x", 2, -1.5], "b": "y", "c": None}
+
+
+def test_numbers_with_a_trailing_dot():
+    assert parse_json_markdown('{"a": 1., "b": [2., -3.e2]}') == {"a": 1.0, "b": [2.0, -300.0]}
+
+
+def test_truncated_output_keeps_complete_events():
+    complete = json.dumps({"events": [EVENT, EVENT]}, ensure_ascii=False)
+    # Cut inside the consequence of the second event's last option
+    truncated = complete[: complete.rindex("La révolution") + 5]
+    assert parse_json_markdown(truncated) == {"events": [EVENT]}
+
+
+def test_truncated_after_array_keeps_complete_members():
+    assert parse_json_tolerant('{"events": [{"id": "1"}], "chaos_level": "hi') == {"events": [{"id": "1"}]}
+
+
+def test_unrepairable_input_raises_json_error():
+    with pytest.raises(json.JSONDecodeError):
+        parse_json_markdown("Désolé, je ne peux pas répondre.")
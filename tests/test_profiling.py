@@ -0,0 +1,134 @@
+import asyncio
+import threading
+import time
+
+import pytest
+from fastapi import BackgroundTasks, FastAPI, HTTPException
+from fastapi.testclient import TestClient
+from starlette.requests import Request
+
+import services.profiling as profiling
+from services.metrics import time_stage
+from services.profiling import ProfileStore, StackSampler, require_admin
+
+
+def profile(started_at, profile_id):
+    return {"id": profile_id, "path": "/update_events", "started_at": started_at, "stages": [], "folded": "a;b 3"}
+
+
+def test_store_keeps_the_newest_profiles(tmp_path):
+    store = ProfileStore(directory=str(tmp_path), max_files=2)
+    for i in range(3):
+        store.save(profile(1000 + i, f"{(1000 + i) * 1000}-0000000{i}"))
+
+    listed = store.list()
+    assert [p["id"] for p in listed] == ["1002000-00000002", "1001000-00000001"]
+    assert "folded" not in listed[0]
+    assert store.load("1002000-00000002")["folded"] == "a;b 3"
+    assert store.load("1000000-00000000") is None
+    # Ids are validated before touching the filesystem
+    assert store.load("../../etc/passwd") is None
+    assert store.download_path("1002000-00000002") is None
+
+
+def test_admin_endpoints_require_the_token(monkeypatch):
+    def request(token=None):
+        headers = [(b"x-admin-token", token.encode())] if token else []
+        return Request({"type": "http", "headers": headers})
+
+    monkeypatch.setattr(profiling, "ADMIN_TOKEN", "")
+    with pytest.raises(HTTPException) as e:
+        require_admin(request("anything"))
+    assert e.value.status_code == 404
+
+    monkeypatch.setattr(profiling, "ADMIN_TOKEN", "secret")
+    with pytest.raises(HTTPException) as e:
+        require_admin(request("wrong"))
+    assert e.value.status_code == 401
+    require_admin(request("secret"))
+
+
+@pytest.fixture
+def profiled_app(tmp_path, monkeypatch):
+    store = ProfileStore(directory=str(tmp_path))
+    monkeypatch.setattr(profiling, "profile_store", store)
+    monkeypatch.setattr(profiling, "PROFILE_SLOW_SECONDS", 0.2)
+    monkeypatch.setattr(profiling, "PROFILE_TOKEN", "profile-me")
+
+    app = FastAPI()
+    app.add_middleware(profiling.ProfilingMiddleware)
+
+    @app.get("/slow")
+    async def slow():
+        with time_stage("generate_events"):
+            await asyncio.sleep(0.3)
+        return {}
+
+    @app.get("/fast")
+    async def fast(background_tasks: BackgroundTasks):
+        async def later():
+            with time_stage("image_generation"):
+                await asyncio.sleep(0.5)
+
+        background_tasks.add_task(later)
+        return {}
+
+    return TestClient(app), store
+
+
+def test_slow_requests_are_captured_with_their_stages(profiled_app):
+    client, store = profiled_app
+    client.get("/slow")
+    [profile] = store.list()
+    full = store.load(profile["id"])
+    assert profile["trigger"] == "slow" and profile["path"] == "/slow" and profile["status"] == 200
+    assert 0.3 <= profile["duration"] < 1
+    assert [stage["stage"] for stage in full["stages"]] == ["generate_events"]
+    assert full["stages"][0]["seconds"] >= 0.3
+
+
+def test_background_tasks_do_not_count_in_the_duration(profiled_app):
+    client, store = profiled_app
+    client.get("/fast")
+    assert store.list() == []
+
+    client.get("/fast", headers={"X-Profile": "profile-me"})
+    [profile] = store.list()
+    assert profile["trigger"] == "header" and profile["cprofile"]
+    assert profile["duration"] < 0.2
+    assert store.load(profile["id"])["stages"] == []
+    assert store.download_path(profile["id"]) is not None
+
+
+def test_sampler_window_does_not_depend_on_the_thread_count():
+    workers = [threading.Thread(target=time.sleep, args=(1,)) for _ in range(10)]
+    for worker in workers:
+        worker.start()
+    sampler = StackSampler(interval=0.01, window=0.5)
+    sampler.start()
+    time.sleep(0.8)
+    sampler.stop()
+    kept = [at for at, _ in sampler.samples]
+    assert kept[-1] - kept[0] >= 0.4
+    assert all(sum(count for _, count in pairs) >= 10 for _, pairs in sampler.samples)
+    # Each worker's stack is folded once and counted on every tick
+    assert sampler.folded_between(kept[0], kept[-1]).count("threading.py:run") >= 10
+    for worker in workers:
+        worker.join()
+
+
+def test_sampler_skips_parked_threads_and_bounds_its_memory():
+    stop = threading.Event()
+    parked = [threading.Thread(target=stop.wait, name=f"parked-{i}") for i in range(5)]
+    for thread in parked:
+        thread.start()
+    sampler = StackSampler(interval=0.01, window=10, max_bytes=2000)
+    sampler.start()
+    time.sleep(0.3)
+    sampler.stop()
+    stop.set()
+    for thread in parked:
+        thread.join()
+    # Each parked thread is seen at most once, when it was first sampled
+    assert sampler.folded_between(0, time.perf_counter()).count("parked-") <= 5
+    assert sampler.nbytes <= 2000 and len(sampler.samples) < 30
@@ -0,0 +1,76 @@
+import asyncio
+
+import services.running_report as running_report
+from models.event import Event
+from services.running_report import final_summary, refresh_summary
+from services.session_store import SessionStore
+
+
+def event(event_id, year, title=None):
+    return Event(id=event_id, title=title or f"Event {event_id}", date=f"{year}-01-01", options=[
+        {"title": f"Option {event_id}a", "consequence": ["a"]}, {"title": f"Option {event_id}b", "consequence": ["b"]},
+    ])
+
+
+def fake_fold(monkeypatch):
+    """Patch the LLM fold: the report lists the chosen options; returns the (summary, decisions) calls."""
+    calls = []
+
+    async def fold_decisions(summary, decisions, temperature=0.7):
+        calls.append((summary, decisions))
+        chosen = [decision.split('"')[1] for decision in decisions]
+        return " | ".join(([summary] if summary else []) + chosen)
+
+    monkeypatch.setattr(running_report, "fold_decisions", fold_decisions)
+    return calls
+
+
+def test_decisions_are_folded_once(monkeypatch):
+    calls = fake_fold(monkeypatch)
+
+    async def run():
+        store = SessionStore()
+        session = await store.create([event("1", 1900), event("2", 1950)], {"1": 0})
+        await refresh_summary(store, session.session_id)
+        session.choices["2"] = 1
+        await store.save(session)
+        await refresh_summary(store, session.session_id)
+        report = await final_summary(store, session.session_id)
+        return report, session
+
+    report, session = asyncio.run(run())
+    assert report == "Option 1a | Option 2b"
+    # The final report was up to date: no third call
+    assert [len(decisions) for _, decisions in calls] == [1, 1]
+    assert session.summarized_choices == ["1:0:Event 1", "2:1:Event 2"]
+
+
+def test_rewound_or_reused_decisions_rebuild_the_report(monkeypatch):
+    calls = fake_fold(monkeypatch)
+
+    async def run():
+        store = SessionStore()
+        session = await store.create([event("1", 1900), event("2", 1950)], {"1": 0, "2": 0})
+        await refresh_summary(store, session.session_id)
+
+        # Rewind: the player chose again on event 1, and the regenerated event reuses id 2
+        session.events = [event("1", 1900), event("2", 1920, "Regenerated")]
+        session.choices = {"1": 1, "2": 0}
+        await store.save(session)
+        return await final_summary(store, session.session_id), session
+
+    report, session = asyncio.run(run())
+    # The dropped branch is not kept in the report
+    assert report == "Option 1b | Option 2a" and calls[-1][0] is None
+    assert session.summarized_choices == ["1:1:Event 1", "2:0:Regenerated"]
+
+
+def test_no_decisions_means_no_llm_call(monkeypatch):
+    calls = fake_fold(monkeypatch)
+
+    async def run():
+        store = SessionStore()
+        session = await store.create([event("1", 1900)])
+        return await final_summary(store, session.session_id)
+
+    assert asyncio.run(run()) == "" and calls == []
@@ -0,0 +1,105 @@
+import asyncio
+import os
+
+from fastapi.testclient import TestClient
+
+import api.main as main
+from models.event import Event
+from services.session_store import FileSessionBackend, SessionStore
+
+
+def event(event_id, date, title="Event"):
+    return Event(id=event_id, title=title, date=date, options=[
+        {"title": "Yes", "consequence": ["a"]}, {"title": "No", "consequence": ["b"]},
+    ])
+
+
+def test_sessions_are_created_saved_and_evicted_in_memory():
+    async def run():
+        store = SessionStore(max_sessions=2)
+        first = await store.create([event("1", "1900-01-01")])
+        assert await store.get(first.session_id) is first
+
+        first.choices["1"] = 1
+        created = first.updated_at
+        await store.save(first)
+        assert (await store.get(first.session_id)).choices == {"1": 1} and first.updated_at >= created
+
+        # first was used last, so the second session is the one evicted
+        second = await store.create([])
+        await store.get(first.session_id)
+        await store.create([])
+        assert await store.get(second.session_id) is None and await store.get(first.session_id) is first
+
+    asyncio.run(run())
+
+
+def test_file_backend_shares_sessions_between_stores(tmp_path):
+    async def run():
+        backend = FileSessionBackend(str(tmp_path))
+        writer, reader = SessionStore(backend, max_sessions=0), SessionStore(backend, max_sessions=0)
+        session = await writer.create([event("1", "1900-01-01")], {"1": 0})
+        assert os.listdir(tmp_path) == [f"{session.session_id}.json"]
+
+        session.choices["1"] = 1
+        await writer.save(session)
+        loaded = await reader.get(session.session_id)
+        assert loaded is not session and loaded.choices == {"1": 1} and loaded.events[0].id == "1"
+
+        await writer.delete(session.session_id)
+        assert await reader.get(session.session_id) is None
+        # Ids that are not uuids never reach the filesystem
+        assert await reader.get("../../etc/passwd") is None
+
+    asyncio.run(run())
+
+
+def delta_app(monkeypatch, tmp_path):
+    """Serve /update_events from a file-backed store, generating one event "3" dated 1950; returns the calls."""
+    store = SessionStore(FileSessionBackend(str(tmp_path)), max_sessions=0)
+    monkeypatch.setattr(main, "session_store", store)
+    monkeypatch.setattr(main, "REPORT_MODE", "full")
+    monkeypatch.setattr(main.branch_tree, "pick", lambda signature: None)
+    monkeypatch.setattr(main.turn_cache, "get", lambda signature: None)
+    monkeypatch.setattr(main, "plan_image_tasks", lambda new_events: ([], []))
+    generated = []
+
+    async def generate_within_budget(signature, filtered_events, chosen_option, session_id=None, choices=None):
+        generated.append((filtered_events, chosen_option, session_id, choices))
+        return [event("3", "1950-01-01", "Generated").model_dump()], False
+
+    monkeypatch.setattr(main, "generate_within_budget", generate_within_budget)
+    return store, generated, TestClient(main.app)
+
+
+def test_delta_request_uses_the_session_timeline(monkeypatch, tmp_path):
+    store, generated, client = delta_app(monkeypatch, tmp_path)
+    # Sessions keep their timeline sorted by date, as /start_game creates it
+    session = asyncio.run(store.create([event("1", "1900-01-01"), event("2", "1920-01-01")]))
+
+    response = client.post("/update_events", json={"session_id": session.session_id, "option_chosen": "1_1"})
+    assert response.status_code == 200 and response.json()["session_id"] == session.session_id
+    filtered_events, chosen_option, session_id, choices = generated[0]
+    # The timeline comes from the session, cut after the chosen event
+    assert [e.id for e in filtered_events] == ["1"]
+    assert chosen_option["title"] == "No" and session_id == session.session_id and choices == {"1": 1}
+
+    saved = asyncio.run(store.get(session.session_id))
+    assert [e.id for e in saved.events] == ["1", "3"] and saved.choices == {"1": 1}
+
+    unknown = client.post("/update_events", json={"session_id": "00000000-0000-0000-0000-000000000000",
+                                                  "option_chosen": "1_0"})
+    assert unknown.status_code == 404
+
+
+def test_rewinding_drops_the_choices_of_the_dropped_events(monkeypatch, tmp_path):
+    store, generated, client = delta_app(monkeypatch, tmp_path)
+    timeline = [event("1", "1900-01-01"), event("2", "1920-01-01"), event("3", "1940-01-01")]
+    session = asyncio.run(store.create(timeline, {"1": 0, "2": 1, "3": 0}))
+
+    # Choosing again on event 2 drops event 3, whose id the generated event reuses
+    response = client.post("/update_events", json={"session_id": session.session_id, "option_chosen": "2_0"})
+    assert response.status_code == 200
+    assert generated[0][3] == {"1": 0, "2": 0}
+    saved = asyncio.run(store.get(session.session_id))
+    assert [e.id for e in saved.events] == ["1", "2", "3"] and saved.choices == {"1": 0, "2": 0}
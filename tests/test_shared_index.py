@@ -0,0 +1,43 @@
+import numpy as np
+import pytest
+
+from services.shared_index import QuantizedIndex, cosine_scores, load_or_build_index, unique_best_indices
+
+
+@pytest.mark.parametrize("dtype", ["float16", "int8"])
+def test_quantized_index_matches_exact_top1(tmp_path, dtype):
+    rng = np.random.default_rng(0)
+    items = rng.normal(size=(500, 64))
+    queries = items[:50] + rng.normal(scale=0.3, size=(50, 64))
+    prefix = str(tmp_path / "index")
+
+    exact = load_or_build_index(prefix, "abc", lambda: items)
+    quantized = load_or_build_index(prefix, "abc", lambda: items, dtype=dtype)
+
+    assert isinstance(quantized, QuantizedIndex)
+    assert quantized.nbytes < exact.nbytes
+    exact_scores = cosine_scores(exact, queries)
+    scores = cosine_scores(quantized, queries)
+    assert (scores.argmax(axis=1) == exact_scores.argmax(axis=1)).all()
+    # Re-ranked candidates carry the exact similarity
+    best = scores.argmax(axis=1)
+    np.testing.assert_allclose(scores[np.arange(50), best], exact_scores[np.arange(50), best], rtol=1e-5)
+
+
+def test_rebuilding_the_exact_index_drops_stale_quantized_copies(tmp_path):
+    items = np.eye(8)
+    prefix = str(tmp_path / "index")
+    load_or_build_index(prefix, "old", lambda: items, dtype="int8")
+    load_or_build_index(prefix, "new", lambda: items)
+
+    assert sorted(path.name for path in tmp_path.iterdir()) == ["index.new.npy"]
+
+
+def test_unique_best_indices_skips_taken_items():
+    similarities = np.array([
+        [0.9, 0.8, 0.1, 0.0],
+        [0.9, 0.7, 0.2, 0.0],
+        [0.1, 0.2, 0.3, 0.4],
+    ])
+    assert unique_best_indices(similarities) == [0, 1, 3]
+    assert unique_best_indices(similarities, used_indices=[0]) == [1, 2, 3]
@@ -0,0 +1,62 @@
+import logging
+
+from prometheus_client import REGISTRY
+
+import services.timeline_context as timeline_context
+from services.timeline_context import build_timeline_context, log_token_report, summarize_event
+
+
+def event(event_id, description="Une description."):
+    return {
+        "id": event_id, "date": f"{1900 + int(event_id)}-01-01", "title": f"Event {event_id}",
+        "description": [description],
+        "options": [{"title": f"Option {event_id}a", "consequence": []}, {"title": f"Option {event_id}b", "consequence": []}],
+    }
+
+
+def summary_hits():
+    return REGISTRY.get_sample_value("uchronia_cache_requests_total", {"cache": "timeline_summary", "result": "hit"}) or 0.0
+
+
+def test_summary_line_is_truncated_and_names_the_choice(monkeypatch):
+    monkeypatch.setattr(timeline_context, "SUMMARY_EXCERPT_CHARS", 20)
+    line = summarize_event(event("1", "Un très long récit qui ne tient pas en vingt caractères"), {"1": 1})
+    assert line == "- #1 [1901-01-01] Event 1: Un très long récit… (choix : Option 1b)"
+
+
+def test_recent_events_are_kept_in_full_without_the_other_options():
+    events = [event(str(i)) for i in range(1, 6)]
+    context = build_timeline_context(events, choices={"4": 0, "5": 1}, recent=2)
+    summary, recent = context.split("Événements récents :")
+    assert "#1" in summary and "#3" in summary and "#4" not in summary
+    assert "Choix : Option 4a" in recent and "Choix : Option 5b" in recent and "Option 5a" not in recent
+
+
+def test_summary_cache_extends_and_notices_rewinds(monkeypatch):
+    monkeypatch.setattr(timeline_context, "_summary_cache", timeline_context._summary_cache.__class__())
+    events = [event(str(i)) for i in range(1, 6)]
+    build_timeline_context(events[:4], session_id="s", choices={"1": 0}, recent=1)
+    hits = summary_hits()
+
+    # The next turn only summarizes the event that aged out
+    build_timeline_context(events, session_id="s", choices={"1": 0}, recent=1)
+    assert summary_hits() == hits + 1 and len(timeline_context._summary_cache["s"]["lines"]) == 4
+
+    # The player chose again on event 1: the summary is rebuilt
+    context = build_timeline_context(events, session_id="s", choices={"1": 1}, recent=1)
+    assert summary_hits() == hits + 1 and "(choix : Option 1b)" in context
+
+    # A regenerated event reusing id 3 is not mistaken for the dropped one
+    events[2] = {**event("3", "Une autre histoire."), "title": "Regenerated"}
+    context = build_timeline_context(events, session_id="s", choices={"1": 1}, recent=1)
+    assert summary_hits() == hits + 1 and "Une autre histoire." in context
+
+
+def test_token_report_only_runs_with_debug_logging(caplog):
+    events = [event("1")]
+    context = build_timeline_context(events)
+    with caplog.at_level(logging.INFO, logger="services.timeline_context"):
+        assert log_token_report(events, context) is None
+    with caplog.at_level(logging.DEBUG, logger="services.timeline_context"):
+        report = log_token_report(events, context)
+    assert report["events"] == 1 and report["context_tokens"] > 0
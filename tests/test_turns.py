@@ -0,0 +1,12 @@
+from services.turns import TurnCache
+
+
+def test_turn_cache_bounds_turns_and_variants():
+    cache = TurnCache(max_turns=2, max_variants=2)
+    for i in range(5):
+        cache.put("a", [{"id": str(i)}])
+    assert {cache.get("a")[0]["id"] for _ in range(50)} == {"3", "4"}
+
+    cache.put("b", [])
+    cache.put("c", [])
+    assert cache.get("a") is None and cache.get("c") == []
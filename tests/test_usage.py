@@ -0,0 +1,75 @@
+import asyncio
+import contextvars
+import time
+
+from fastapi.testclient import TestClient
+
+import api.main as main
+import services.usage as usage
+from models.session import GameSession
+from services.llm_router import ROUTES, stage_candidates
+from services.session_store import SessionStore
+from services.usage import budget_exceeded, record_usage, track_session
+
+
+def session(session_id="s1"):
+    return GameSession(session_id=session_id, events=[], created_at=0, updated_at=0)
+
+
+def test_usage_is_attributed_to_the_tracked_session():
+    def run():
+        game = session()
+        track_session(game)
+        record_usage("format_narrative_arc", "gpt-4o", 1000, 200)
+        record_usage("format_narrative_arc", "gpt-4o", 1000, 200)
+        usage.current_tracker().drain_into(game)
+        return game
+
+    # Each request runs in its own context
+    game = contextvars.copy_context().run(run)
+    totals = game.usage["format_narrative_arc"]
+    assert totals["calls"] == 2 and totals["prompt_tokens"] == 2000 and totals["completion_tokens"] == 400
+    assert totals["cost_usd"] > 0
+    assert usage.current_tracker() is None
+
+
+def test_spent_session_budget_switches_to_the_budget_models(monkeypatch):
+    monkeypatch.setattr(usage, "SESSION_BUDGET_USD", 0.01)
+
+    def run():
+        game = session()
+        game.usage = {"generate_final_report": {"calls": 1, "prompt_tokens": 0, "completion_tokens": 0, "cost_usd": 0.02}}
+        track_session(game)
+        return stage_candidates("generate_final_report", model="gpt-4o")
+
+    candidates = contextvars.copy_context().run(run)
+    assert sorted(candidates) == sorted(ROUTES["generate_final_report"]["budget_models"])
+    assert contextvars.copy_context().run(stage_candidates, "generate_final_report", "gpt-4o")[0] == "gpt-4o"
+
+
+def test_global_budget_only_counts_the_last_hour(monkeypatch):
+    monkeypatch.setattr(usage, "GLOBAL_BUDGET_USD_PER_HOUR", 1.0)
+    # A call more than an hour old that spent the whole budget
+    monkeypatch.setattr(usage, "_recent_costs", usage.deque([(time.monotonic() - 2 * usage.GLOBAL_WINDOW_SECONDS, 5.0)]))
+    monkeypatch.setattr(usage, "_recent_total", 5.0)
+
+    assert contextvars.copy_context().run(budget_exceeded) is None
+    # Checking the budget does not add entries to the window
+    assert len(usage._recent_costs) == 0 and usage._recent_total == 0.0
+
+
+def test_session_usage_sums_the_stages(monkeypatch):
+    store = SessionStore()
+    monkeypatch.setattr(main, "session_store", store)
+    game = session("usage")
+    game.usage = {
+        "format_narrative_arc": {"calls": 2, "prompt_tokens": 1000, "completion_tokens": 200, "cost_usd": 0.01},
+        "embedding": {"calls": 3, "prompt_tokens": 30, "completion_tokens": 0, "cost_usd": 0.001},
+    }
+    asyncio.run(store.save(game))
+    client = TestClient(main.app)
+
+    body = client.get("/session_usage", params={"session_id": "usage"}).json()
+    assert body["calls"] == 5 and body["prompt_tokens"] == 1030 and body["completion_tokens"] == 200
+    assert abs(body["cost_usd"] - 0.011) < 1e-9 and body["stages"] == game.usage
+    assert client.get("/session_usage", params={"session_id": "missing"}).status_code == 404
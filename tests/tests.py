@@ -14,7 +14,7 @@ def test_get_initial_events_structure():
 
     for event in events:
         # Check top-level fields
-        assert all(field in event for field in ["title", "image", "date", "options", "consequences"])
+        assert all(field in event for field in ["title", "image", "date", "options"])
         assert isinstance(event["title"], str)
         assert isinstance(event["image"], str)
         assert isinstance(event["date"], str)
@@ -23,16 +23,14 @@ def test_get_initial_events_structure():
         assert isinstance(event["options"], list)
         assert len(event["options"]) == 2
         for option in event["options"]:
-            assert all(field in option for field in ["title", "img"])
+            assert all(field in option for field in ["title", "img", "consequence"])
             assert isinstance(option["title"], str)
             assert isinstance(option["img"], str)
 
-        # Check consequences
-        assert isinstance(event["consequences"], list)
-        assert len(event["consequences"]) == 2
-        for consequence in event["consequences"]:
-            assert all(field in consequence for field in ["text"])
-            assert isinstance(consequence["text"], str)
+            # Check consequences
+            assert isinstance(option["consequence"], list)
+            for paragraph in option["consequence"]:
+                assert isinstance(paragraph, str)
 
 def test_event_content():
     response = client.get("/get_initial_events")
@@ -1,54 +1,253 @@
 import json
+import logging
 import re
 from typing import Any
 
+logger = logging.getLogger(__name__)
 
-def _replace_new_line(match: re.Match[str]) -> str:
-    """
-    Replace newlines and special characters in a regex match with their escaped counterparts.
 
-    Args:
-        match (re.Match[str]): Regex match object containing the text to process
+# A trailing dot (`1.`) is accepted, as Python writes it
+_NUMBER = re.compile(r"-?(?:0|[1-9]\d*)(?:\.\d*)?(?:[eE][+-]?\d+)?")
+_KEY_STRING = re.compile(r'"(?:[^"\\]|\\.)*(")?')
+_STRING_CHUNK = re.compile(r'[^"\\]*')
+_WHITESPACE = re.compile(r"\s*")
+_LITERALS = {"true": True, "false": False, "null": None, "True": True, "False": False, "None": None}
+_ESCAPES = {'"': '"', "\\": "\\", "/": "/", "b": "\b", "f": "\f", "n": "\n", "r": "\r", "t": "\t"}
 
-    Returns:
-        str: Processed string with escaped special characters
+
+class _Truncated(Exception):
+    """The input ended inside a value."""
+
+
+class _TolerantParser:
+    """
+    Single-pass recursive-descent JSON parser that repairs common LLM mistakes.
+
+    It accepts trailing and missing commas, raw newlines and tabs inside strings,
+    unescaped double quotes inside strings (a quote only closes a string when followed by
+    structure, and inside an object a following `, "` must start a `"key":`) and Python
+    literals. When the input is truncated, the shallowest open array
+    keeps its complete elements and every enclosing container is closed, so the complete
+    events of a cut-off response survive. Without an open array, the outermost object keeps
+    its complete members.
     """
-    value = match.group(2)
-    value = re.sub(r"\n", r"\\n", value)
-    value = re.sub(r"\r", r"\\r", value)
-    value = re.sub(r"\t", r"\\t", value)
-    value = re.sub(r'(?<!\\)"', r"\"", value)
-    return match.group(1) + value + match.group(3)
 
+    def __init__(self, text):
+        self.text = text
+        self.pos = 0
+        self.open_arrays = 0
+        self.open_objects = 0
+        # "{" or "[" for each open container, innermost last
+        self.containers = []
+        self.salvaged = False
+
+    def error(self, message):
+        return json.JSONDecodeError(message, self.text, min(self.pos, len(self.text)))
+
+    def skip_whitespace(self):
+        self.pos = _WHITESPACE.match(self.text, self.pos).end()
+        if self.pos >= len(self.text):
+            raise _Truncated()
+        return self.text[self.pos]
+
+    def parse(self):
+        starts = [i for i in (self.text.find("{"), self.text.find("[")) if i >= 0]
+        if not starts:
+            raise self.error("No JSON object or array found")
+        self.pos = min(starts)
+        try:
+            return self.value()
+        except _Truncated:
+            raise self.error("Truncated JSON with no complete element to salvage")
+
+    def value(self):
+        char = self.skip_whitespace()
+        if char == "{":
+            return self.object()
+        if char == "[":
+            return self.array()
+        if char == '"':
+            return self.string(key=False)
+        match = _NUMBER.match(self.text, self.pos)
+        if match:
+            if match.end() >= len(self.text):
+                raise _Truncated()
+            self.pos = match.end()
+            number = match.group()
+            return float(number) if any(c in number for c in ".eE") else int(number)
+        literal = self.literal_at(self.pos)
+        if literal is not None:
+            self.pos += len(literal)
+            return _LITERALS[literal]
+        if any(literal.startswith(self.text[self.pos:]) for literal in _LITERALS):
+            raise _Truncated()
+        raise self.error(f"Unexpected character {char!r}")
+
+    def literal_at(self, pos):
+        for literal in _LITERALS:
+            if self.text.startswith(literal, pos) and not self.text[pos + len(literal):pos + len(literal) + 1].isalnum():
+                return literal
+        return None
+
+    def string(self, key):
+        self.pos += 1
+        parts = []
+        while True:
+            end = _STRING_CHUNK.match(self.text, self.pos).end()
+            parts.append(self.text[self.pos:end])
+            if end >= len(self.text):
+                raise _Truncated()
+            self.pos = end + 1
+            if self.text[end] == "\\":
+                if self.pos >= len(self.text):
+                    raise _Truncated()
+                escape = self.text[self.pos]
+                if escape == "u":
+                    code = self.text[self.pos + 1:self.pos + 5]
+                    if len(code) < 4:
+                        raise _Truncated()
+                    parts.append(chr(int(code, 16)))
+                    self.pos += 5
+                else:
+                    parts.append(_ESCAPES.get(escape, escape))
+                    self.pos += 1
+            elif self.closes_string(key):
+                return "".join(parts)
+            else:
+                parts.append('"')
 
-def _custom_parser(multiline_string: str) -> str:
+    def closes_string(self, key):
+        """Decide whether the quote just consumed ends the string or is part of the text."""
+        follow = _WHITESPACE.match(self.text, self.pos).end()
+        if follow >= len(self.text):
+            return True
+        char = self.text[follow]
+        if key:
+            return char == ":"
+        if char in "}]":
+            return True
+        if char == ",":
+            after = _WHITESPACE.match(self.text, follow + 1).end()
+            if after >= len(self.text) or self.text[after] in "{[}]":
+                return True
+            if self.text[after] == '"':
+                return self.containers[-1] == "[" or self.key_at(after)
+            return self.complete_scalar_at(after)
+        if char != '"':
+            return False
+        if follow == self.pos:
+            # `""` followed by structure: the string ends with a quoted word
+            after = _WHITESPACE.match(self.text, follow + 1).end()
+            return after < len(self.text) and self.text[after] not in ",}]:"
+        # A string followed by another one on the next line: missing comma
+        return True
+
+    def key_at(self, pos):
+        """Tell whether the string at `pos` is a `"key":`, unlike `"non" et rien"` in `"oui", "non" et rien"`."""
+        match = _KEY_STRING.match(self.text, pos)
+        if match.group(1) is None:
+            return True
+        follow = _WHITESPACE.match(self.text, match.end()).end()
+        return follow >= len(self.text) or self.text[follow] == ":"
+
+    def complete_scalar_at(self, pos):
+        """Tell whether a number or literal ends at structure, unlike the "2" of `"oui", 2 fois"`."""
+        number = _NUMBER.match(self.text, pos)
+        literal = self.literal_at(pos)
+        if number:
+            end = number.end()
+        elif literal is not None:
+            end = pos + len(literal)
+        else:
+            return False
+        follow = _WHITESPACE.match(self.text, end).end()
+        return follow >= len(self.text) or self.text[follow] in ",}]"
+
+    def array(self):
+        self.pos += 1
+        self.open_arrays += 1
+        self.containers.append("[")
+        items = []
+        try:
+            while True:
+                char = self.skip_whitespace()
+                if char == "]":
+                    self.pos += 1
+                    return items
+                if char == ",":
+                    self.pos += 1
+                    continue
+                items.append(self.value())
+        except _Truncated:
+            if self.open_arrays > 1 or self.salvaged:
+                raise
+            self.salvaged = True
+            return items
+        finally:
+            self.open_arrays -= 1
+            self.containers.pop()
+
+    def object(self):
+        self.pos += 1
+        self.open_objects += 1
+        self.containers.append("{")
+        result = {}
+        try:
+            while True:
+                char = self.skip_whitespace()
+                if char == "}":
+                    self.pos += 1
+                    return result
+                if char == ",":
+                    self.pos += 1
+                    continue
+                if char != '"':
+                    raise self.error(f"Expected a key, found {char!r}")
+                key = self.string(key=True)
+                if self.skip_whitespace() != ":":
+                    raise self.error("Expected ':' after key")
+                self.pos += 1
+                value = self.value()
+                result[key] = value
+                if self.salvaged:
+                    return result
+        except _Truncated:
+            # Without an open array to roll back to, the outermost object keeps its complete members
+            if self.salvaged or (self.open_arrays == 0 and self.open_objects == 1):
+                self.salvaged = True
+                return result
+            raise
+        finally:
+            self.open_objects -= 1
+            self.containers.pop()
+
+
+def parse_json_tolerant(text: str) -> Any:
     """
-    Process multiline strings from LLM responses that may contain unescaped special characters.
+    Parse possibly malformed or truncated JSON produced by an LLM in a single pass.
 
-    The LLM response for `action_input` may be a multiline string containing unescaped
-    newlines, tabs or quotes. This function replaces those characters with their escaped
-    counterparts. (newlines in JSON must be double-escaped: `\\n`)
+    Text before the first `{` or `[` (markdown fences, prose) is ignored, as is text after
+    the parsed value.
 
     Args:
-        multiline_string (str): The input string to process
+        text (str): LLM output containing a JSON object or array
 
     Returns:
-        str: Processed string with properly escaped special characters
+        Any: The parsed value, with incomplete trailing elements dropped if truncated
+
+    Raises:
+        json.JSONDecodeError: If the text cannot be repaired
+
+    Example:
+        >>> parse_json_tolerant('{"events": [{"id": "1"}, {"id": "2", "ti')
+        {'events': [{'id': '1'}]}
     """
-    if isinstance(multiline_string, (bytes, bytearray)):
-        multiline_string = multiline_string.decode()
-    multiline_string = re.sub(
-        r'("action_input"\:\s*")(.*?)(")',
-        _replace_new_line,
-        multiline_string,
-        flags=re.DOTALL,
-    )
-    return multiline_string
+    return _TolerantParser(text).parse()
 
 
 def _parse_json(json_str: str) -> dict[str, Any]:
     """
-    Parse a JSON string into a Python dictionary, handling special characters.
+    Parse a JSON string into a Python dictionary.
 
     Args:
         json_str (str): JSON string to parse
@@ -56,11 +255,10 @@ def _parse_json(json_str: str) -> dict[str, Any]:
     Returns:
         dict[str, Any]: Parsed JSON as a Python dictionary
     """
-    # Strip whitespace and newlines from the start and end
+    # Strip whitespace, newlines and markdown fences from the start and end
     json_str = json_str.strip().strip("`")
-    # handle newlines and other special characters inside the returned value
-    json_str = _custom_parser(json_str)
-    # Parse the JSON string into a Python dictionary
+    if json_str.startswith("json"):
+        json_str = json_str[4:]
     return json.loads(json_str)
 
 
@@ -69,7 +267,8 @@ def parse_json_markdown(json_string: str) -> dict[str, Any]:
     Parse JSON from a markdown string that may contain code blocks.
 
     This function handles JSON strings that might be wrapped in markdown code blocks
-    (with or without language specifiers) and properly escapes special characters.
+    (with or without language specifiers). Invalid JSON goes through parse_json_tolerant,
+    which repairs common LLM mistakes and salvages the complete elements of truncated output.
 
     Args:
         json_string (str): The input string that may contain JSON in markdown format
@@ -83,18 +282,9 @@ def parse_json_markdown(json_string: str) -> dict[str, Any]:
     try:
         return _parse_json(json_string)
     except json.JSONDecodeError:
-        # Try to find JSON string within triple backticks
-        if "python" in json_string:
-            match = re.search(r"```(python)?(.*)", json_string, re.DOTALL)
-        else:
-            match = re.search(r"```(json)?(.*)", json_string, re.DOTALL)
-        # If no match found, assume the entire string is a JSON string
-        if match is None:
-            json_str = json_string
-        else:
-            # If match found, use the content within the backticks
-            json_str = match.group(2)
-        return _parse_json(json_str)
+        # Repair trailing commas, unescaped characters and truncation in one pass
+        logger.info("Invalid JSON in LLM output, repairing it")
+        return parse_json_tolerant(json_string)
 
 
 def extract_tag_content(text: str, tag_name: str) -> str | None: